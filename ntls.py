@@ -1,12 +1,41 @@
 import os
+import sys
+import re
+import csv
 import json
+import mmap
+import argparse
+import time
+import asyncio
+import random
+import queue
+import http.client
+import contextlib
+import select
+import struct
+import math
 import socket
+import ipaddress
 import logging
-import requests
+import logging.handlers
 import threading
-import subprocess
-from pyfiglet import Figlet
-from datetime import datetime
+import socketserver
+import selectors
+import tempfile
+import gzip
+import shutil
+import hashlib
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 BLACK = "\033[0;30m"
 RED = "\033[0;31m"
@@ -33,11 +62,8 @@ RESET = "\033[0m"
 def clear():
     os.system("clear")
 
-clear()
-print(f"{CYAN}NTLS")
-print(f"{BLUE}Network Test and Log System | NAX Entertainment - v1.0.0")
-
 def intro():
+    from pyfiglet import Figlet
     clear()
     f = Figlet(font='slant')
     print(BLUE)
@@ -45,37 +71,540 @@ def intro():
     print(RESET)
     print(f"{CYAN}Network Test and Log System - v1.0.0 | by NAX Entertainment\n(iNotAtch Emergency test and log Termux proyect)\n{RESET}")
 
-LOG_DIR = "ntls_logs"
-SENSITIVE_LOG_DIR = "ntls_sensitive_logs"
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
-if not os.path.exists(SENSITIVE_LOG_DIR):
-    os.makedirs(SENSITIVE_LOG_DIR)
+NTLS_HOME = os.path.dirname(os.path.abspath(__file__))
+LOG_DIR = os.path.join(NTLS_HOME, "ntls_logs")
+SENSITIVE_LOG_DIR = os.path.join(NTLS_HOME, "ntls_sensitive_logs")
 
 main_logger_name = 'ntls_main'
 sensitive_logger_name = 'ntls_sensitive'
 
-alerted_levels = set()
+LOG_ROTATE_BYTES = 8 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 3600
+LOG_RETENTION_DAYS = 30
+LOG_RETENTION_BYTES = 256 * 1024 * 1024
+LOG_COMPRESS = True
+LOG_COMPRESS_MIN_AGE = 60
+LOG_INDEX_FILE = "index.json"
+LOG_SEGMENT_COUNTER_PATTERN = re.compile(r"_\d{4}-\d\d-\d\d_\d\d-\d\d-\d\d-(\d+)\.")
+LOG_SEGMENT_PATTERN = re.compile(r"^(network_logs|network_metrics|sens_network_logs|metrics_snapshots|incidents)_(\d{4}-\d\d-\d\d_\d\d-\d\d-\d\d)(?:-\d+)?\.(txt|ntlsb|jsonl)(\.gz)?$")
+
+def segment_counter(name):
+    match = LOG_SEGMENT_COUNTER_PATTERN.search(name)
+    return int(match.group(1)) if match else 0
+
+class LogSegments:
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, LOG_INDEX_FILE)
+        self.lock = threading.Lock()
+        self.open_paths = set()
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                segments = json.load(f).get("segments", {})
+        except (OSError, ValueError):
+            segments = {}
+        return {name: entry for name, entry in segments.items() if os.path.exists(os.path.join(self.directory, name))}
+
+    def _save_index(self):
+        temporary = self.index_path + ".tmp"
+        segments = dict(sorted(self.index.items(), key=lambda item: item[1]["start"] or ""))
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"segments": segments}, f, indent=1)
+        os.replace(temporary, self.index_path)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f"ntls-segments-{os.path.basename(self.directory)}", daemon=True)
+        self.thread.start()
+        self.jobs.put(("sweep", None))
+
+    def open_segment(self, prefix, suffix):
+        now = datetime.now()
+        stamp = now.strftime('%Y-%m-%d_%H-%M-%S')
+        name, counter = f"{prefix}_{stamp}{suffix}", 1
+        while os.path.exists(os.path.join(self.directory, name)) or os.path.exists(os.path.join(self.directory, name + ".gz")):
+            name, counter = f"{prefix}_{stamp}-{counter}{suffix}", counter + 1
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            self.open_paths.add(path)
+            self.index[name] = {"start": now.strftime('%Y-%m-%d %H:%M:%S'), "end": None, "bytes": 0}
+            self._save_index()
+        return path
+
+    def close_segment(self, path, compress=True):
+        name = os.path.basename(path)
+        with self.lock:
+            self.open_paths.discard(path)
+            entry = self.index.setdefault(name, {"start": None})
+            entry["end"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            entry["bytes"] = os.path.getsize(path) if os.path.exists(path) else 0
+            self._save_index()
+        if compress and self.thread is not None and self.thread.is_alive():
+            if LOG_COMPRESS:
+                self.jobs.put(("compress", path))
+            self.jobs.put(("retention", None))
+
+    def _describe(self, name, path):
+        match = LOG_SEGMENT_PATTERN.match(name)
+        return {
+            "start": datetime.strptime(match.group(2), '%Y-%m-%d_%H-%M-%S').strftime('%Y-%m-%d %H:%M:%S'),
+            "end": datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M:%S'),
+            "bytes": os.path.getsize(path)
+        }
+
+    def _compress(self, path):
+        name = os.path.basename(path)
+        target = path + ".gz"
+        temporary = target + ".tmp"
+        with open(path, "rb") as src, gzip.open(temporary, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(temporary, target)
+        os.remove(path)
+        with self.lock:
+            entry = self.index.pop(name, None) or self._describe(name + ".gz", target)
+            entry["original_bytes"] = entry.get("bytes", 0)
+            entry["bytes"] = os.path.getsize(target)
+            self.index[name + ".gz"] = entry
+            self._save_index()
+
+    def _sweep(self):
+        now = time.time()
+        pending = []
+        with self.lock:
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                match = LOG_SEGMENT_PATTERN.match(name)
+                if not match or path in self.open_paths:
+                    continue
+                if name not in self.index:
+                    self.index[name] = self._describe(name, path)
+                if LOG_COMPRESS and not match.group(4) and now - os.path.getmtime(path) >= LOG_COMPRESS_MIN_AGE:
+                    pending.append(path)
+            self._save_index()
+        for path in pending:
+            self._compress(path)
+        self._retention()
+
+    def _retention(self):
+        cutoff = (datetime.now() - timedelta(days=LOG_RETENTION_DAYS)).strftime('%Y-%m-%d %H:%M:%S') if LOG_RETENTION_DAYS else None
+        with self.lock:
+            closed = sorted((entry["end"] or entry["start"] or "", entry["start"] or "", segment_counter(name), name) for name, entry in self.index.items() if os.path.join(self.directory, name) not in self.open_paths)
+            total = sum(entry.get("bytes", 0) for entry in self.index.values())
+        removed = []
+        for end, _, _, name in closed:
+            if not ((cutoff and end < cutoff) or (LOG_RETENTION_BYTES and total > LOG_RETENTION_BYTES)):
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, name))
+            total -= self.index[name].get("bytes", 0)
+            removed.append(name)
+        if removed:
+            with self.lock:
+                for name in removed:
+                    self.index.pop(name, None)
+                self._save_index()
+            logging.getLogger(main_logger_name).info(f"Log retention removed {len(removed)} segment(s) from {self.directory}.")
+        return removed
+
+    def _run(self):
+        while True:
+            job, path = self.jobs.get()
+            if job is None:
+                break
+            try:
+                if job == "compress":
+                    self._compress(path)
+                elif job == "sweep":
+                    self._sweep()
+                else:
+                    self._retention()
+            except OSError as e:
+                logging.getLogger(main_logger_name).warning(f"Log maintenance ({job}) failed in {self.directory}: {e}")
+
+    def close(self, timeout=10):
+        if self.thread is not None and self.thread.is_alive():
+            self.jobs.put((None, None))
+            self.thread.join(timeout)
+
+def load_segment_index(directory):
+    try:
+        with open(os.path.join(directory, LOG_INDEX_FILE), encoding="utf-8") as f:
+            return json.load(f).get("segments", {})
+    except (OSError, ValueError):
+        return {}
+
+class SegmentedFileHandler(logging.handlers.BaseRotatingHandler):
+    def __init__(self, segments, prefix, suffix=".txt", max_bytes=LOG_ROTATE_BYTES, interval=LOG_ROTATE_INTERVAL):
+        self.segments = segments
+        self.prefix = prefix
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.rollover_at = time.monotonic() + interval
+        super().__init__(segments.open_segment(prefix, suffix), "a")
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            return False
+        return bool((self.max_bytes and self.stream.tell() >= self.max_bytes) or (self.interval and time.monotonic() >= self.rollover_at))
+
+    def doRollover(self):
+        closed = self.baseFilename
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.segments.close_segment(closed)
+        self.baseFilename = os.path.abspath(self.segments.open_segment(self.prefix, self.suffix))
+        self.stream = self._open()
+        self.rollover_at = time.monotonic() + self.interval
+
+    def close(self):
+        opened = self.stream is not None
+        super().close()
+        if opened:
+            self.segments.close_segment(self.baseFilename, compress=False)
+
+class JsonLinesLog:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _prepare(self):
+        pass
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            self._prepare()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def close(self):
+        pass
+
+class SegmentedJsonLog(JsonLinesLog):
+    def __init__(self, segments, prefix, max_bytes=LOG_ROTATE_BYTES, interval=LOG_ROTATE_INTERVAL):
+        super().__init__(None)
+        self.segments = segments
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.rollover_at = None
+
+    def _prepare(self):
+        if self.path is not None and ((self.max_bytes and os.path.getsize(self.path) >= self.max_bytes) or (self.interval and time.monotonic() >= self.rollover_at)):
+            self.segments.close_segment(self.path)
+            self.path = None
+        if self.path is None:
+            self.path = self.segments.open_segment(self.prefix, ".jsonl")
+            self.rollover_at = time.monotonic() + self.interval
+
+    def close(self):
+        with self.lock:
+            if self.path is not None:
+                self.segments.close_segment(self.path, compress=False)
+                self.path = None
+
+def open_json_log(name, directory=None):
+    if directory is not None:
+        return JsonLinesLog(os.path.join(directory, name))
+    if log_segments is None:
+        return JsonLinesLog(os.path.join(LOG_DIR, name))
+    return SegmentedJsonLog(log_segments, os.path.splitext(name)[0])
+
+log_segments = None
+sensitive_log_segments = None
 
 def setup_logger():
-    log_filename = f"{LOG_DIR}/network_logs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt"
+    global log_segments, sensitive_log_segments
+    if log_segments is None:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        os.makedirs(SENSITIVE_LOG_DIR, exist_ok=True)
+        log_segments = LogSegments(LOG_DIR)
+        log_segments.start()
+        sensitive_log_segments = LogSegments(SENSITIVE_LOG_DIR)
+        sensitive_log_segments.start()
+
     main_logger = logging.getLogger(main_logger_name)
     main_logger.setLevel(logging.INFO)
     if not main_logger.handlers:
-        main_handler = logging.FileHandler(log_filename)
+        main_handler = SegmentedFileHandler(log_segments, "network_logs")
         main_formatter = logging.Formatter("%(message)s")
         main_handler.setFormatter(main_formatter)
         main_logger.addHandler(main_handler)
 
-    sensitive_log_filename = f"{SENSITIVE_LOG_DIR}/sens_network_logs_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.txt"
     sensitive_logger = logging.getLogger(sensitive_logger_name)
     sensitive_logger.setLevel(logging.INFO)
     if not sensitive_logger.handlers:
-        sensitive_handler = logging.FileHandler(sensitive_log_filename)
+        sensitive_handler = SegmentedFileHandler(sensitive_log_segments, "sens_network_logs")
         sensitive_formatter = logging.Formatter("%(asctime)s - %(message)s", datefmt='%Y-%m-%d %H:%M:%S')
         sensitive_handler.setFormatter(sensitive_formatter)
         sensitive_logger.addHandler(sensitive_handler)
 
+    global structured_log
+    if STRUCTURED_LOG and structured_log is None:
+        structured_log = StructuredLog(log_segments.open_segment("network_metrics", ".ntlsb"), segments=log_segments)
+        structured_log.start()
+
+STRUCTURED_LOG = True
+TEXT_SAMPLE_LOG = True
+STRUCTURED_LOG_QUEUE_SIZE = 8192
+STRUCTURED_LOG_BATCH_SIZE = 512
+STRUCTURED_LOG_FLUSH_INTERVAL = 30.0
+
+SEGMENT_MAGIC = b"NTLSSEG2"
+LEGACY_SEGMENT_MAGIC = b"NTLSSEG1"
+RECORD_SAMPLE = 1
+RECORD_CONTEXT = 2
+BLOCK_HEADER = struct.Struct("<B3xHHII")
+RECORD_LENGTH = struct.Struct("<H")
+SAMPLE_BODY = struct.Struct("<qHHd")
+
+METRIC_IDS = {
+    "rtt": 1,
+    "loss": 2,
+    "download": 3,
+    "battery": 4,
+    "jitter": 5,
+    "upload": 6,
+    "rtt_loaded_download": 7,
+    "rtt_loaded_upload": 8,
+    "dns_resolution": 9
+}
+METRIC_NAMES = {metric_id: name for name, metric_id in METRIC_IDS.items()}
+
+def sample_columns(samples):
+    samples.sort(key=lambda sample: sample[0])
+    return array("q", [sample[0] for sample in samples]), array("d", [sample[1] for sample in samples])
+
+def encode_sample_block(metric_id, context_id, samples, buffer):
+    times, values = sample_columns(samples)
+    if sys.byteorder == "big":
+        times.byteswap()
+        values.byteswap()
+    buffer += BLOCK_HEADER.pack(RECORD_SAMPLE, metric_id, context_id, len(times), 16 * len(times))
+    buffer += times
+    buffer += values
+
+class StructuredLog:
+    def __init__(self, path, queue_size=STRUCTURED_LOG_QUEUE_SIZE, batch_size=STRUCTURED_LOG_BATCH_SIZE, flush_interval=STRUCTURED_LOG_FLUSH_INTERVAL, segments=None, max_bytes=LOG_ROTATE_BYTES, interval=LOG_ROTATE_INTERVAL):
+        self.path = path
+        self.segments = segments
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.rotate_at = time.monotonic() + interval
+        self.context_records = []
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.contexts = {}
+        self.context_id = 0
+        self.written_contexts = set()
+        self.dropped = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, name="ntls-structured-log", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def set_context(self, operator, network_type):
+        key = (operator, network_type)
+        context_id = self.contexts.get(key)
+        if context_id is None:
+            context_id = self.contexts[key] = len(self.contexts) + 1
+            body = json.dumps({"operator": operator, "network_type": network_type}).encode("utf-8")
+            self.context_records.append((RECORD_CONTEXT, context_id, body))
+            try:
+                self.queue.put_nowait((RECORD_CONTEXT, context_id, body))
+            except queue.Full:
+                self.dropped += 1
+        self.context_id = context_id
+
+    def record(self, metric, value, ts_ns=None):
+        try:
+            self.queue.put_nowait((RECORD_SAMPLE, time.time_ns() if ts_ns is None else ts_ns, METRIC_IDS[metric], self.context_id, value))
+        except queue.Full:
+            self.dropped += 1
+
+    def _encode_context(self, context_id, body, buffer):
+        self.written_contexts.add(context_id)
+        padding = -len(body) % 8
+        buffer += BLOCK_HEADER.pack(RECORD_CONTEXT, 0, context_id, len(body), len(body) + padding)
+        buffer += body
+        buffer += bytes(padding)
+
+    def _encode(self, batch, buffer):
+        columns = {}
+        for item in batch:
+            if item[0] == RECORD_SAMPLE:
+                columns.setdefault(item[2:4], []).append((item[1], item[4]))
+            elif item[1] not in self.written_contexts:
+                self._encode_context(item[1], item[2], buffer)
+        for (metric_id, context_id), samples in columns.items():
+            if context_id and context_id not in self.written_contexts:
+                _, _, body = self.context_records[context_id - 1]
+                self._encode_context(context_id, body, buffer)
+            encode_sample_block(metric_id, context_id, samples, buffer)
+
+    def _open(self, path):
+        segment = open(path, "ab")
+        self.written_contexts = set()
+        if segment.tell() == 0:
+            header = bytearray(SEGMENT_MAGIC)
+            for _, context_id, body in list(self.context_records):
+                self._encode_context(context_id, body, header)
+            segment.write(header)
+        return segment
+
+    def _should_rotate(self, segment):
+        if self.segments is None:
+            return False
+        return bool((self.max_bytes and segment.tell() >= self.max_bytes) or (self.interval and time.monotonic() >= self.rotate_at))
+
+    def _rotate(self, segment):
+        segment.close()
+        self.segments.close_segment(self.path)
+        self.path = self.segments.open_segment("network_metrics", ".ntlsb")
+        self.rotate_at = time.monotonic() + self.interval
+        return self._open(self.path)
+
+    def _write(self, segment, batch):
+        buffer = bytearray()
+        self._encode(batch, buffer)
+        segment.write(buffer)
+        segment.flush()
+        self.written += len(batch)
+        batch.clear()
+
+    def _run(self):
+        segment = self._open(self.path)
+        try:
+            batch = []
+            batch_context, flush_at = None, None
+            running = True
+            while running:
+                timeout = self.flush_interval if flush_at is None else max(0, flush_at - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = False
+                if item is None:
+                    running = False
+                elif item:
+                    if item[0] == RECORD_SAMPLE:
+                        if batch and item[3] != batch_context:
+                            self._write(segment, batch)
+                            flush_at = None
+                        batch_context = item[3]
+                    batch.append(item)
+                    if flush_at is None:
+                        flush_at = time.monotonic() + self.flush_interval
+                if batch and (not running or len(batch) >= self.batch_size or time.monotonic() >= flush_at):
+                    self._write(segment, batch)
+                    flush_at = None
+                if running and not batch and self._should_rotate(segment):
+                    segment = self._rotate(segment)
+        finally:
+            segment.close()
+            if self.segments is not None:
+                self.segments.close_segment(self.path, compress=False)
+
+    def close(self, timeout=5):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+structured_log = None
+
+@contextlib.contextmanager
+def map_segment(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as compressed:
+            yield compressed.read()
+        return
+    with open(path, "rb") as segment:
+        if os.fstat(segment.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+def read_legacy_blocks(data, contexts):
+    offset = len(LEGACY_SEGMENT_MAGIC)
+    end = len(data)
+    columns = {}
+    pending = 0
+    while True:
+        record_type = None
+        if offset + RECORD_LENGTH.size <= end:
+            length = RECORD_LENGTH.unpack_from(data, offset)[0]
+            body = offset + RECORD_LENGTH.size
+            offset = body + length
+            if offset <= end:
+                record_type = data[body]
+        if record_type == RECORD_SAMPLE:
+            ts_ns, metric_id, context_id, value = SAMPLE_BODY.unpack_from(data, body + 1)
+            columns.setdefault((metric_id, context_id), []).append((ts_ns, value))
+            pending += 1
+            if pending < STRUCTURED_LOG_BATCH_SIZE:
+                continue
+        for (metric_id, context_id), samples in columns.items():
+            yield (metric_id, contexts.get(context_id, contexts[0])) + sample_columns(samples)
+        columns.clear()
+        pending = 0
+        if record_type is None:
+            return
+        if record_type == RECORD_CONTEXT:
+            context_id = struct.unpack_from("<H", data, body + 1)[0]
+            contexts[context_id] = json.loads(bytes(data[body + 3:offset]).decode("utf-8"))
+
+def read_sample_blocks(path):
+    contexts = {0: {"operator": "Unknown", "network_type": "Unknown"}}
+    with map_segment(path) as data:
+        if not data:
+            return
+        if data[:len(LEGACY_SEGMENT_MAGIC)] == LEGACY_SEGMENT_MAGIC:
+            yield from read_legacy_blocks(data, contexts)
+            return
+        if data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"{path} is not an NTLS segment file")
+
+        with memoryview(data) as view:
+            offset = len(SEGMENT_MAGIC)
+            end = len(data)
+            while offset + BLOCK_HEADER.size <= end:
+                record_type, metric_id, context_id, count, size = BLOCK_HEADER.unpack_from(data, offset)
+                body = offset + BLOCK_HEADER.size
+                offset = body + size
+                if offset > end:
+                    break
+                if record_type == RECORD_SAMPLE:
+                    times, values = array("q"), array("d")
+                    times.frombytes(view[body:body + 8 * count])
+                    values.frombytes(view[body + 8 * count:body + 16 * count])
+                    if sys.byteorder == "big":
+                        times.byteswap()
+                        values.byteswap()
+                    yield metric_id, contexts.get(context_id, contexts[0]), times, values
+                elif record_type == RECORD_CONTEXT:
+                    contexts[context_id] = json.loads(bytes(view[body:body + count]).decode("utf-8"))
+
+def read_structured_log(path):
+    for metric_id, context, times, values in read_sample_blocks(path):
+        name = METRIC_NAMES.get(metric_id, str(metric_id))
+        for ts_ns, value in zip(times, values):
+            yield ts_ns, name, value, context
+
+def record_metric(name, value, store=None):
+    (store or metrics).add(name, value)
+    export_sample(name, value)
+    if structured_log is not None:
+        structured_log.record(name, math.nan if value is None else float(value))
+
 
 def get_local_ip_addresses():
     try:
@@ -87,19 +616,149 @@ def get_local_ip_addresses():
     except Exception:
         return ["N/A"]
 
-def get_public_ip():
+def read_default_routes():
+    routes = []
+    try:
+        with open("/proc/net/route") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == "00000000":
+                    routes.append((fields[0], fields[2]))
+    except OSError:
+        return None
+    with contextlib.suppress(OSError), open("/proc/net/ipv6_route") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 9 and fields[0] == "0" * 32 and fields[1] == "00" and fields[9] != "lo":
+                routes.append((fields[9], fields[4]))
+    return sorted(set(routes))
+
+def read_interface_states():
     try:
-        response = requests.get('https://api.ipify.org?format=json', timeout=5)
+        names = os.listdir("/sys/class/net")
+    except OSError:
+        return None
+    states = {}
+    for name in names:
+        if name == "lo":
+            continue
+        with contextlib.suppress(OSError), open(os.path.join("/sys/class/net", name, "operstate")) as f:
+            states[name] = f.read().strip()
+    return states
+
+def get_link_state():
+    return {"addresses": get_local_ip_addresses(), "routes": read_default_routes(), "interfaces": read_interface_states()}
+
+requests = None
+
+def load_requests():
+    global requests
+    if requests is None:
+        import requests.adapters
+    return requests
+
+def pooled_session(pool_connections, pool_maxsize):
+    load_requests()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+PUBLIC_IP_PROVIDERS = [
+    ("https://api.ipify.org?format=json", "json"),
+    ("https://checkip.amazonaws.com", "text"),
+    ("https://icanhazip.com", "text"),
+    ("https://ifconfig.me/ip", "text")
+]
+PUBLIC_IP_CACHE_TTL = 30
+PUBLIC_IP_TIMEOUT = 5
+
+class SystemClock:
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.now()
+
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.start = start
+        self.elapsed = 0.0
+
+    def time(self):
+        return self.start + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+    def advance(self, seconds):
+        self.elapsed += max(0.0, seconds)
+
+clock = SystemClock()
+
+class PublicIPService:
+    def __init__(self, providers=PUBLIC_IP_PROVIDERS, ttl=PUBLIC_IP_CACHE_TTL, timeout=PUBLIC_IP_TIMEOUT, clock=clock):
+        self.providers = providers
+        self.ttl = ttl
+        self.timeout = timeout
+        self.clock = clock
+        self.session = None
+        self.executor = ThreadPoolExecutor(max_workers=len(providers), thread_name_prefix="ntls-public-ip")
+        self.cached_ip = None
+        self.cached_at = 0.0
+        self.lock = threading.Lock()
+
+    def _fetch(self, url, kind):
+        response = self.session.get(url, timeout=self.timeout)
         response.raise_for_status()
-        return response.json().get('ip', 'N/A')
-    except requests.RequestException:
-        return "N/A"
+        ip = response.json().get("ip", "") if kind == "json" else response.text.strip()
+        return str(ipaddress.ip_address(ip))
+
+    def invalidate(self):
+        self.cached_at = 0.0
+
+    def lookup(self, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        with self.lock:
+            if self.cached_ip is not None and self.clock.monotonic() - self.cached_at < max_age:
+                return self.cached_ip
+
+            if self.session is None:
+                self.session = pooled_session(len(self.providers), 2)
+            futures = [self.executor.submit(self._fetch, url, kind) for url, kind in self.providers]
+            try:
+                for future in as_completed(futures, timeout=self.timeout + 1):
+                    try:
+                        ip = future.result()
+                    except (requests.RequestException, ValueError):
+                        continue
+                    self.cached_ip, self.cached_at = ip, self.clock.monotonic()
+                    return ip
+            except FutureTimeoutError:
+                pass
+            finally:
+                for future in futures:
+                    future.cancel()
+            return "N/A"
+
+public_ip_service = PublicIPService()
+
+def get_public_ip(max_age=None):
+    return public_ip_service.lookup(max_age)
 
 current_public_ip = "N/A"
 
-def log_session_start():
+def log_session_start(interactive=True):
     global current_public_ip
-    intro()
+    if interactive:
+        intro()
     start_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
     local_ips = get_local_ip_addresses()
     public_ip = get_public_ip()
@@ -124,428 +783,4043 @@ def log_session_start():
     sensitive_logger.info(f"Public IP: {public_ip}")
     sensitive_logger.info(f"Local IP(s): {', '.join(local_ips)}")
 
-def ping_dns(dns_server, timeout=2):
-    try:
-        command = ["ping", "-c", "1", "-W", str(timeout), dns_server]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+PROBE_METHODS = ("icmp", "udp", "tcp")
+PROBE_UDP_PORT = 53
+PROBE_TCP_PORT = 53
+PROBE_PAYLOAD = b"NTLSPROBE"
 
-        for line in result.stdout.splitlines():
-            if "time=" in line:
-                try:
-                    latency = float(line.split("time=")[1].split()[0])
-                    return latency
-                except (IndexError, ValueError):
-                    pass
-        return None
+def icmp_checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
 
-    except subprocess.CalledProcessError as e:
-        logging.getLogger(main_logger_name).warning(f"Ping command failed for {dns_server}: {e.stderr}")
-        return None
+def build_icmp_echo(family, sequence):
+    echo_type = 8 if family == socket.AF_INET else 128
+    header = struct.pack("!BBHHH", echo_type, 0, 0, 0, sequence)
+    checksum = icmp_checksum(header + PROBE_PAYLOAD) if family == socket.AF_INET else 0
+    return struct.pack("!BBHHH", echo_type, 0, checksum, 0, sequence) + PROBE_PAYLOAD
 
-    except FileNotFoundError:
-        logging.getLogger(main_logger_name).error(f"Ping command not found.")
-        return None
+def build_dns_probe(query_id):
+    return struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + b"\x00" + struct.pack("!HH", 2, 1)
 
-    except Exception as e:
-        logging.getLogger(main_logger_name).error(f"Error pinging {dns_server}: {e}")
+def parse_probe_reply(method, family, data):
+    if method == "icmp":
+        reply_type = 0 if family == socket.AF_INET else 129
+        if len(data) < 8 or data[0] != reply_type:
+            return None
+        return struct.unpack_from("!H", data, 6)[0]
+    if len(data) < 12 or not data[2] & 0x80:
         return None
+    return struct.unpack_from("!H", data, 0)[0]
 
-def check_packet_loss(dns_server, count=5, timeout=2):
-    try:
-        command = ["ping", "-c", str(count), "-W", str(timeout), dns_server]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if result.returncode == 0:
-            for line in result.stdout.splitlines():
-                if "packet loss" in line:
-                    try:
-                        packet_loss = int(line.split(", ")[2].split("%")[0])
-                        return packet_loss
-                    except (IndexError, ValueError):
-                        pass
-        return 100
-
-    except FileNotFoundError:
-        logging.getLogger(main_logger_name).error(f"Ping command not found for packet loss check.")
-        return 100
-
-    except Exception as e:
-        logging.getLogger(main_logger_name).error(f"Error checking packet loss for {dns_server}: {e}")
-        return 100
+class Prober:
+    def __init__(self, methods=PROBE_METHODS):
+        self.methods = tuple(methods)
+        self.unavailable = set()
+        self.addresses = {}
+        self.sockets = {}
+        self.sequences = {}
+        self.target_locks = {}
+        self.lock = threading.Lock()
 
-def test_web_connectivity(url="http://www.google.com", timeout=5):
-    try:
-        command = ["curl", "-I", "--max-time", str(timeout), url]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return result.returncode == 0
+    def _target_lock(self, key):
+        with self.lock:
+            return self.target_locks.setdefault(key, threading.Lock())
 
-    except FileNotFoundError:
-        logging.getLogger(main_logger_name).error(f"Curl command not found for web connectivity test.")
-        return False
-        
-    except Exception as e:
-        logging.getLogger(main_logger_name).error(f"Error testing web connectivity to {url}: {e}")
-        return False
+    def _resolve(self, target):
+        if target not in self.addresses:
+            family, _, _, _, sockaddr = socket.getaddrinfo(target, None, proto=socket.IPPROTO_UDP)[0]
+            self.addresses[target] = (family, sockaddr[0])
+        return self.addresses[target]
 
-def get_best_dns():
-    main_logger = logging.getLogger(main_logger_name)
-    dns_servers = [
-        {"name": "Google DNS", "ip": "8.8.8.8"},
-        {"name": "Quad9", "ip": "9.9.9.9"},
-        {"name": "Cloudflare DNS", "ip": "1.1.1.1"},
-        {"name": "OpenDNS", "ip": "208.67.222.222"}
-    ]
+    def _next_sequence(self, key):
+        sequence = (self.sequences.get(key, random.randrange(0x10000)) + 1) & 0xFFFF
+        self.sequences[key] = sequence
+        return sequence
 
-    emergency_dns = [
-        {"name": "Emergency DNS 1", "ip": "198.142.0.51"},
-        {"name": "Emergency DNS 2", "ip": "198.142.0.52"}
-    ]
+    def _socket(self, key, family, address, method, port):
+        sock = self.sockets.get(key)
+        if sock is not None:
+            return sock
 
-    results = {}
-    for server in dns_servers + emergency_dns:
-        latency = ping_dns(server["ip"], timeout=2)
-        if latency is not None:
-            results[server["ip"]] = (server, latency)
+        if method == "icmp":
+            proto = socket.IPPROTO_ICMP if family == socket.AF_INET else socket.IPPROTO_ICMPV6
+            sock = socket.socket(family, socket.SOCK_DGRAM, proto)
+        else:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            sock.setblocking(False)
+            sock.connect((address, port))
+        except OSError:
+            sock.close()
+            raise
+        self.sockets[key] = sock
+        return sock
 
-    if results:
-        best_dns = min(results.values(), key=lambda x: x[1])[0]
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        print(f"{LIGHT_GREEN}[{timestamp}] Best DNS: {best_dns['name']} ({best_dns['ip']}){RESET}")
-        main_logger.info(f"[{timestamp}] Best DNS: {best_dns['name']} ({best_dns['ip']})")
-        return best_dns["ip"]
+    def _collect(self, sock, method, family, sent, results, until):
+        while sent:
+            remaining = until - time.perf_counter()
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([sock], [], [], remaining)
+            if not ready:
+                break
+            try:
+                data = sock.recv(2048)
+            except BlockingIOError:
+                continue
+            except ConnectionRefusedError:
+                # A port unreachable reply still proves the host is up; it answers the oldest probe.
+                received = time.perf_counter()
+                entry = sent.pop(next(iter(sent)))
+            else:
+                received = time.perf_counter()
+                entry = sent.pop(parse_probe_reply(method, family, data), None)
+            if entry is not None:
+                index, started = entry
+                results[index] = round((received - started) * 1000, 3)
 
-    else:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        print(f"{RED}[{timestamp}] No functional DNS found.{RESET}")
-        main_logger.error(f"[{timestamp}] No functional DNS found.")
-        return None
+    def _probe_datagram(self, target, family, address, method, port, count, timeout, interval):
+        key = (target, method, port)
+        try:
+            sock = self._socket(key, family, address, method, port)
+        except OSError:
+            if method == "icmp":
+                self.unavailable.add(method)
+            raise
 
-def monitor_dns_latency():
-    global current_public_ip
-    main_logger = logging.getLogger(main_logger_name)
-    sensitive_logger = logging.getLogger(sensitive_logger_name)
-    max_failures, failure_count, current_dns = 5, 0, None
-    latencies = []
-    interval = 5
-    last_summary_time = datetime.now()
-    last_public_ip_check_time = datetime.now()
-    public_ip_check_interval = 60
+        results = [None] * count
+        sent = {}
+        for index in range(count):
+            sequence = self._next_sequence(key)
+            packet = build_icmp_echo(family, sequence) if method == "icmp" else build_dns_probe(sequence)
+            sent[sequence] = (index, time.perf_counter())
+            try:
+                sock.send(packet)
+            except OSError:
+                self.sockets.pop(key, None)
+                sock.close()
+                raise
+            if interval and index < count - 1:
+                self._collect(sock, method, family, sent, results, time.perf_counter() + interval)
 
-    while True:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        self._collect(sock, method, family, sent, results, time.perf_counter() + timeout)
+        return results
 
-        if (datetime.now() - last_public_ip_check_time).total_seconds() >= public_ip_check_interval:
-            new_public_ip = get_public_ip()
-            if new_public_ip != "N/A" and new_public_ip != current_public_ip:
-                print(f"{YELLOW}[ALERT] [{timestamp}] Public IP changed: {current_public_ip} -> {new_public_ip}{RESET}")
-                main_logger.warning(f"[{timestamp}] Public IP changed: {current_public_ip} -> {new_public_ip}")
-                sensitive_logger.warning(f"[{timestamp}] Public IP changed: {current_public_ip} -> {new_public_ip}")
-                current_public_ip = new_public_ip
-            last_public_ip_check_time = datetime.now()
+    def _probe_tcp(self, family, address, port, count, timeout, interval):
+        results = [None] * count
+        for index in range(count):
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            started = time.perf_counter()
+            try:
+                sock.connect((address, port))
+                results[index] = round((time.perf_counter() - started) * 1000, 3)
+            except ConnectionRefusedError:
+                results[index] = round((time.perf_counter() - started) * 1000, 3)
+            except OSError:
+                pass
+            finally:
+                sock.close()
+            if interval and index < count - 1:
+                time.sleep(interval)
+        return results
 
+    def probe(self, target, count=1, timeout=2, interval=0, method=None, port=None):
+        family, address = self._resolve(target)
+        last_error = None
 
-        if not current_dns:
-            current_dns = get_best_dns()
-            if not current_dns:
-                print(f"{YELLOW}Waiting for coverage...{RESET}")
-                threading.Event().wait(10)
+        for candidate in ((method,) if method else self.methods):
+            if candidate in self.unavailable:
                 continue
+            if candidate == "tcp":
+                return self._probe_tcp(family, address, port or PROBE_TCP_PORT, count, timeout, interval)
 
-        latency = ping_dns(current_dns)
-
-        if latency is not None:
-            failure_count = 0
-            latencies.append(latency)
-            main_logger.info(f"[{timestamp}] Ping to {current_dns}: {latency} ms")
-
-        else:
-            failure_count += 1
-            main_logger.info(f"[{timestamp}] Ping to {current_dns}: Failed")
-
-        if (datetime.now() - last_summary_time).total_seconds() >= interval:
-            avg_latency = sum(latencies) / len(latencies) if latencies else None
-            
-            status = "Unknown"
-            status_color = RED
-            if avg_latency is not None:
-                if avg_latency < 50:
-                    status = "Good"
-                    status_color = LIGHT_GREEN
-
-                elif avg_latency < 100:
-                    status = "Medium"
-                    status_color = BROWN
-                else:
-                    status = "Bad"
-                    status_color = RED
+            probe_port = 0 if candidate == "icmp" else (port or PROBE_UDP_PORT)
+            try:
+                with self._target_lock((target, candidate, probe_port)):
+                    return self._probe_datagram(target, family, address, candidate, probe_port, count, timeout, interval)
+            except OSError as e:
+                last_error = e
+                continue
 
-            print(f"{status_color}[{timestamp}] Ping summary: Average: {avg_latency:.1f} ms ({status}){RESET}" if avg_latency is not None else f"{RED}[{timestamp}] Ping failed.{RESET}")
-            main_logger.info(f"[{timestamp}] Ping summary: Average: {avg_latency:.1f} ms ({status})" if avg_latency is not None else f"[{timestamp}] Ping failed.")
+        raise last_error or OSError(f"No probe method available for {target}")
 
-            packet_loss = check_packet_loss(current_dns)
-            if packet_loss is not None and packet_loss > 50:
-                print(f"{RED}[ALERT] [{timestamp}] High packet loss ({packet_loss}%){RESET}")
-                main_logger.warning(f"[{timestamp}] High packet loss ({packet_loss}%)")
-            elif packet_loss is None:
-                 main_logger.warning(f"[{timestamp}] Packet loss check failed for {current_dns}")
+    def close(self):
+        with self.lock:
+            for sock in self.sockets.values():
+                sock.close()
+            self.sockets.clear()
 
+prober = Prober()
 
-            if not test_web_connectivity():
-                print(f"{RED}[ALERT] [{timestamp}] Web connectivity failed.{RESET}")
-                main_logger.warning(f"[{timestamp}] Web connectivity failed.")
+PING_CACHE_TTL = 0.5
+NEGATIVE_CACHE_TTL = 3600
+BATTERY_COMMAND = ["termux-battery-status"]
+BATTERY_CACHE_TTL = 30
+TELEPHONY_COMMAND = ["termux-telephony-deviceinfo"]
+TELEPHONY_CACHE_TTL = 10
 
-            latencies.clear()
-            last_summary_time = datetime.now()
+class ProbeCache:
+    def __init__(self, negative_ttl=NEGATIVE_CACHE_TTL, negative_errors=(FileNotFoundError,), clock=clock):
+        self.negative_ttl = negative_ttl
+        self.negative_errors = negative_errors
+        self.clock = clock
+        self.entries = {}
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.negative_hits = 0
 
-        if failure_count >= max_failures:
-            print(f"{RED}Too many failures. Reevaluating DNS...{RESET}")
-            main_logger.warning(f"[{timestamp}] Too many ping failures to {current_dns}. Reevaluating DNS.")
-            current_dns, failure_count = None, 0
-            latencies.clear()
+    def _begin(self, key, max_age):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, value, error = entry
+                age = self.clock.monotonic() - stored_at
+                if error is not None and age < self.negative_ttl:
+                    self.negative_hits += 1
+                    raise error
+                if error is None and age < max_age:
+                    self.hits += 1
+                    return value, None, False
 
-        threading.Event().wait(1)
+            future = self.inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return None, future, False
 
-def get_mobile_network_info():
-    main_logger = logging.getLogger(main_logger_name)
-    sensitive_logger = logging.getLogger(sensitive_logger_name)
-    previous_state = None
-    retry_delay = 5
+            self.misses += 1
+            future = self.inflight[key] = Future()
+            return None, future, True
 
-    while True:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        mobile_info_raw = None
-        success = False
+    def _finish(self, key, future, value=None, error=None):
+        with self.lock:
+            self.inflight.pop(key, None)
+            if error is None:
+                self.entries[key] = (self.clock.monotonic(), value, None)
+            elif isinstance(error, self.negative_errors):
+                self.entries[key] = (self.clock.monotonic(), None, error)
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
 
+    def get(self, key, max_age, func):
+        value, future, owner = self._begin(key, max_age)
+        if future is None:
+            return value
+        if not owner:
+            return future.result()
         try:
-            mobile_info_raw = subprocess.check_output(["termux-telephony-deviceinfo"], timeout=5).decode("utf-8")
-            success = True
-
-        except subprocess.TimeoutExpired:
-            main_logger.warning(f"[{timestamp}] Timeout getting mobile info. Retrying in {retry_delay} seconds...")
-            threading.Event().wait(retry_delay)
-            continue
-
-        except FileNotFoundError:
-             print(f"{RED}[{timestamp}] Error: 'termux-telephony-deviceinfo' command not found. Stopping mobile info checks.{RESET}")
-             main_logger.error(f"[{timestamp}] 'termux-telephony-deviceinfo' command not found. Stopping mobile info checks.")
-             success = False
-             break
-
+            value = func()
         except Exception as e:
-            main_logger.error(f"[{timestamp}] Error retrieving mobile info: {e}. Retrying in {retry_delay} seconds...")
-            threading.Event().wait(retry_delay)
-            continue
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, value)
+        return value
 
+    async def aget(self, key, max_age, coro_func):
+        value, future, owner = self._begin(key, max_age)
+        if future is None:
+            return value
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            value = await coro_func()
+        except asyncio.CancelledError as e:
+            self._finish(key, future, error=e)
+            raise
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, value)
+        return value
 
-        if success and mobile_info_raw:
-            try:
-                mobile_info = json.loads(mobile_info_raw)
-                operator = mobile_info.get("network_operator_name", "Unknown")
-                network_type = mobile_info.get("network_type", "Unknown").upper()
-                data_enabled = mobile_info.get("data_enabled", "Unknown")
-                sim_state = mobile_info.get("sim_state", "Unknown")
-
-                current_state = {
-                    "operator": operator,
-                    "network_type": network_type,
-                    "data_enabled": data_enabled,
-                    "sim_state": sim_state
-                }
-
-                if current_state != previous_state:
-                    print(f"{CYAN}[{timestamp}] Operator: {operator}, Network: {network_type}, Data: {data_enabled}, SIM: {sim_state}{RESET}")
-                    main_logger.info(f"[{timestamp}] Operator: {operator}, Network: {network_type}, Data: {data_enabled}, SIM: {sim_state}")
-                    previous_state = current_state
+    def is_negative(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[2] is not None and self.clock.monotonic() - entry[0] < self.negative_ttl
 
-            except json.JSONDecodeError as e:
-                 print(f"{RED}[{timestamp}] Error parsing mobile info JSON: {e}{RESET}")
-                 main_logger.error(f"[{timestamp}] Error parsing mobile info JSON: {e}. Raw data: {mobile_info_raw[:100]}...")
-            except Exception as e:
-                 print(f"{RED}[{timestamp}] Error processing mobile info: {e}{RESET}")
-                 main_logger.error(f"[{timestamp}] Error processing mobile info: {e}")
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
 
-        threading.Event().wait(60)
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "negative_hits": self.negative_hits,
+            "entries": len(self.entries)
+        }
 
-def evaluate_network_quality():
-    main_logger = logging.getLogger(main_logger_name)
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+probe_cache = ProbeCache()
 
-    dns_server = "8.8.8.8"
-    avg_latency = ping_dns(dns_server)
-    packet_loss = check_packet_loss(dns_server)
+async def run_helper(command, max_age, timeout=5, backends=None):
+    backends = backends or system_backends()
+    return await backends.probe_cache.aget(("command", *command), max_age, lambda: backends.run_command(command, timeout))
 
-    if avg_latency is not None:
-        latency_status = "Good" if avg_latency < 50 else "Bad"
-    print(f"{LIGHT_GREEN}[{timestamp}] Latency: {avg_latency:.1f} ms ({latency_status}){RESET}" if avg_latency is not None else f"{RED}[{timestamp}] Latency test failed.{RESET}")
-    main_logger.info(f"[{timestamp}] Latency test to {dns_server}: {avg_latency:.1f} ms ({latency_status})" if avg_latency is not None else f"[{timestamp}] Latency test to {dns_server} failed.")
+def helper_missing(command, backends=None):
+    return (backends or system_backends()).probe_cache.is_negative(("command", *command))
 
-    if packet_loss is not None:
-        packet_loss_status = "Good" if packet_loss < 10 else "Bad"
-    print(f"{LIGHT_GREEN if packet_loss < 10 else RED}[{timestamp}] Packet loss: {packet_loss}% ({packet_loss_status}){RESET}" if packet_loss is not None else f"{RED}[{timestamp}] Packet loss test failed.{RESET}")
-    main_logger.info(f"[{timestamp}] Packet loss test to {dns_server}: {packet_loss}% ({packet_loss_status})" if packet_loss is not None else f"[{timestamp}] Packet loss test to {dns_server} failed.")
+def ping_dns(dns_server, timeout=2, max_age=PING_CACHE_TTL, backends=None):
+    backends = backends or system_backends()
+    try:
+        return backends.probe_cache.get(("ping", dns_server), max_age, lambda: backends.prober.probe(dns_server, count=1, timeout=timeout)[0])
 
-    download_test_url = "http://speed.cloudflare.com/__down?bytes=100000"
-    speed_MBps, speed_Mbps = test_download_speed(download_test_url, timeout=10)
+    except OSError as e:
+        logging.getLogger(main_logger_name).warning(f"Ping failed for {dns_server}: {e}")
+        return None
 
-    print(f"{LIGHT_GREEN}[{timestamp}] Download speed: {speed_MBps:.2f} MB/s ({speed_Mbps:.2f} Mbps){RESET}" if speed_MBps is not None else f"{RED}[{timestamp}] Download test failed.{RESET}")
-    main_logger.info(f"[{timestamp}] Download speedtest: {speed_MBps:.2f} MB/s ({speed_Mbps:.2f} Mbps)" if speed_MBps is not None else f"[{timestamp}] Download speedtest failed.")
+    except Exception as e:
+        logging.getLogger(main_logger_name).error(f"Error pinging {dns_server}: {e}")
+        return None
 
-def test_download_speed(url="http://speed.cloudflare.com/__down?bytes=100000", timeout=10):
-    main_logger = logging.getLogger(main_logger_name)
-    null_device = '/dev/null' if os.path.exists('/dev/null') else 'NUL'
+def check_packet_loss(dns_server, count=5, timeout=2, interval=0.2):
     try:
-        start_time = datetime.now()
-        file_size_bytes = 100000
-
-        command = ["curl", "-o", null_device, "--max-time", str(timeout), url]
-        result = subprocess.run(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=True
-        )
-        end_time = datetime.now()
-
-        download_time_seconds = (end_time - start_time).total_seconds()
-        if download_time_seconds > 0:
-            speed_bytes_per_sec = file_size_bytes / download_time_seconds
-            speed_MBps = speed_bytes_per_sec / (1024 * 1024)
-            speed_Mbps = speed_MBps * 8
-            return speed_MBps, speed_Mbps
-        else:
-             return 0.0, 0.0
+        results = prober.probe(dns_server, count=count, timeout=timeout, interval=interval)
+        lost = sum(1 for latency in results if latency is None)
+        return int(round(lost * 100 / count))
 
-    except subprocess.CalledProcessError as e:
-        main_logger.error(f"Curl command failed during download test: {e.stderr}")
-        return None, None
-
-    except FileNotFoundError:
-        main_logger.error(f"Curl command not found for download speedtest.")
-        return None, None
+    except OSError as e:
+        logging.getLogger(main_logger_name).warning(f"Packet loss check failed for {dns_server}: {e}")
+        return 100
 
     except Exception as e:
-        main_logger.error(f"Download speedtest failed: {e}")
-        return None, None
+        logging.getLogger(main_logger_name).error(f"Error checking packet loss for {dns_server}: {e}")
+        return 100
 
-def get_battery_status():
-    main_logger = logging.getLogger(main_logger_name)
+async def run_command_async(command, timeout):
+    started = time.perf_counter()
     try:
-        result_raw = subprocess.check_output(["termux-battery-status"], timeout=5).decode("utf-8")
-        battery_info = json.loads(result_raw)
-        return battery_info
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    except OSError:
+        export_subprocess_errors.inc()
+        raise
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        export_subprocess_errors.inc()
+        process.kill()
+        await process.wait()
+        raise
+    export_subprocess_seconds.observe(time.perf_counter() - started)
+    return process.returncode, stdout, stderr
+
+async def test_web_connectivity(url="http://www.google.com", timeout=5, backends=None):
+    backends = backends or system_backends()
+    try:
+        returncode, _, _ = await backends.run_command(["curl", "-I", "--max-time", str(timeout), url], timeout + 1)
+        return returncode == 0
 
     except FileNotFoundError:
-        if not hasattr(get_battery_status, "logged_not_found"):
-            main_logger.error("'termux-battery-status' command not found. Battery monitoring disabled.")
-            get_battery_status.logged_not_found = True
-        return None
-        
-    except subprocess.TimeoutExpired:
-        main_logger.warning("Timeout getting battery status.")
-        return None
+        logging.getLogger(main_logger_name).error(f"Curl command not found for web connectivity test.")
+        return False
 
-    except json.JSONDecodeError:
-        main_logger.error("Error parsing battery status JSON.")
-        return None
+    except asyncio.TimeoutError:
+        return False
 
     except Exception as e:
-        main_logger.error(f"Error getting battery status: {e}")
-        return None
+        logging.getLogger(main_logger_name).error(f"Error testing web connectivity to {url}: {e}")
+        return False
 
-def monitor_battery():
-    global alerted_levels
-    main_logger = logging.getLogger(main_logger_name)
-    interval_seconds = 60
-    thresholds = [10, 20, 30, 40, 50, 60, 70, 80, 90]
+DNS_SERVERS = [
+    {"name": "Google DNS", "ip": "8.8.8.8", "doh": "https://dns.google/dns-query"},
+    {"name": "Quad9", "ip": "9.9.9.9", "doh": "https://dns.quad9.net/dns-query"},
+    {"name": "Cloudflare DNS", "ip": "1.1.1.1", "doh": "https://cloudflare-dns.com/dns-query"},
+    {"name": "OpenDNS", "ip": "208.67.222.222", "doh": "https://doh.opendns.com/dns-query"}
+]
 
-    while True:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-        battery_info = get_battery_status()
+EMERGENCY_DNS = [
+    {"name": "Emergency DNS 1", "ip": "198.142.0.51"},
+    {"name": "Emergency DNS 2", "ip": "198.142.0.52"}
+]
 
-        if battery_info:
-            percentage = battery_info.get("percentage")
-            status = battery_info.get("status", "UNKNOWN").upper()
+DNS_QUERY_NAME = "example.com"
+DNS_QUERY_TYPES = ("A", "AAAA")
+DNS_QUERY_TRANSPORT = "udp"
+DNS_QUERY_TRANSPORTS = ("udp", "tcp", "doh")
+DNS_QUERY_TIMEOUT = 2
+DNS_QUERY_PORT = 53
+DNS_CACHE_BUSTING = False
+DNS_RESOLUTION_WEIGHT = 1.0
+DNS_RESOLUTION_INTERVAL = 30
+DNS_TYPE_CODES = {"A": 1, "AAAA": 28}
+DNS_OK_RCODES = (0, 3)
+DOH_CONTENT_TYPE = "application/dns-message"
 
-            if percentage is not None:
-                main_logger.info(f"[{timestamp}] Battery: {percentage}% ({status})")
+def encode_dns_name(name):
+    labels = [label.encode("idna") for label in name.strip(".").split(".") if label]
+    return b"".join(bytes((len(label),)) + label for label in labels) + b"\x00"
 
-                if status == "DISCHARGING":
-                    for level in thresholds:
-                        if percentage <= level and level not in alerted_levels:
-                            print(f"{YELLOW}[ALERT] [{timestamp}] Battery level low: {percentage}% (Discharging){RESET}")
-                            main_logger.warning(f"[{timestamp}] Battery level low: {percentage}% (Discharging)")
-                            alerted_levels.add(level)
+def build_dns_query(query_id, name, qtype):
+    return struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0) + encode_dns_name(name) + struct.pack("!HH", DNS_TYPE_CODES[qtype], 1)
 
+def skip_dns_name(data, offset):
+    while offset < len(data):
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+    raise ValueError("Truncated DNS name")
 
-                levels_to_remove = set()
-                for alerted_level in alerted_levels:
-                    if percentage > alerted_level or status != "DISCHARGING":
-                        levels_to_remove.add(alerted_level)
-                        if status != "DISCHARGING":
-                            main_logger.info(f"[{timestamp}] Battery no longer discharging. Resetting alert for {alerted_level}%.")
-                        else:
-                            main_logger.info(f"[{timestamp}] Battery charged above {alerted_level}%. Resetting alert.")
+def parse_dns_response(data):
+    if len(data) < 12 or not data[2] & 0x80:
+        return None
+    query_id, flags, _, answers = struct.unpack_from("!HHHH", data, 0)
+    return query_id, flags & 0x000F, answers
 
+def cache_busting_name(name):
+    return f"ntls-{random.getrandbits(48):012x}.{name}"
 
-                alerted_levels -= levels_to_remove
+def resolver_endpoint(address, transport):
+    if transport != "doh":
+        return address
+    for server in DNS_SERVERS + EMERGENCY_DNS:
+        if server["ip"] == address:
+            return server.get("doh")
+    return None
 
-            else:
-                main_logger.warning(f"[{timestamp}] Could not determine battery percentage from status.")
-        else:
-             if hasattr(get_battery_status, "logged_not_found"):
-                 main_logger.info("Stopping battery monitoring thread due to missing command.")
-                 break
+class DnsQueryEngine:
+    def __init__(self, timeout=DNS_QUERY_TIMEOUT, doh_workers=4):
+        self.timeout = timeout
+        self.udp_sockets = {}
+        self.tcp_sockets = {}
+        self.server_locks = {}
+        self.lock = threading.Lock()
+        self.doh_workers = doh_workers
+        self.session = None
+        self.executor = ThreadPoolExecutor(max_workers=doh_workers, thread_name_prefix="ntls-doh")
 
-        threading.Event().wait(interval_seconds)
+    def _server_lock(self, key):
+        with self.lock:
+            return self.server_locks.setdefault(key, threading.Lock())
 
+    def _assign_ids(self, questions):
+        ids = random.sample(range(0x10000), len(questions))
+        return [(query_id, build_dns_query(query_id, name, qtype)) for query_id, (name, qtype) in zip(ids, questions)]
 
-def monitor_network():
-    setup_logger()
-    log_session_start()
-    main_logger = logging.getLogger(main_logger_name)
+    def _udp_socket(self, server, port):
+        key = (server, port)
+        sock = self.udp_sockets.get(key)
+        if sock is None:
+            family, _, _, _, sockaddr = socket.getaddrinfo(server, port, proto=socket.IPPROTO_UDP)[0]
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            try:
+                sock.setblocking(False)
+                sock.connect(sockaddr)
+            except OSError:
+                sock.close()
+                raise
+            self.udp_sockets[key] = sock
+        return sock
 
-    evaluate_network_quality()
+    def _query_udp(self, server, port, questions, timeout):
+        sock = self._udp_socket(server, port)
+        results = [None] * len(questions)
+        sent = {}
+        for index, (query_id, query) in enumerate(self._assign_ids(questions)):
+            sent[query_id] = (index, time.perf_counter())
+            try:
+                sock.send(query)
+            except OSError:
+                self.udp_sockets.pop((server, port), None)
+                sock.close()
+                raise
 
-    mobile_thread = threading.Thread(target=get_mobile_network_info, daemon=True)
-    dns_thread = threading.Thread(target=monitor_dns_latency, daemon=True)
-    battery_thread = threading.Thread(target=monitor_battery, daemon=True)
+        until = time.perf_counter() + timeout
+        while sent:
+            remaining = until - time.perf_counter()
+            if remaining <= 0:
+                break
+            ready, _, _ = select.select([sock], [], [], remaining)
+            if not ready:
+                break
+            try:
+                data = sock.recv(4096)
+            except (BlockingIOError, ConnectionRefusedError):
+                continue
+            received = time.perf_counter()
+            reply = parse_dns_response(data)
+            entry = sent.pop(reply[0], None) if reply else None
+            if entry is not None:
+                index, started = entry
+                results[index] = (round((received - started) * 1000, 3), reply[1])
+        return results
 
-    mobile_thread.start()
-    dns_thread.start()
-    battery_thread.start()
+    def _recv_exact(self, sock, size, until):
+        data = bytearray()
+        while len(data) < size:
+            remaining = until - time.perf_counter()
+            if remaining <= 0:
+                raise socket.timeout("DNS over TCP timed out")
+            sock.settimeout(remaining)
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("DNS server closed the connection")
+            data += chunk
+        return bytes(data)
 
-    while True:
-        try:
-            mobile_thread.join(timeout=1.0)
-            dns_thread.join(timeout=1.0)
-            battery_thread.join(timeout=1.0)
+    def _exchange_tcp(self, sock, questions, timeout):
+        results = [None] * len(questions)
+        sent = {}
+        messages = []
+        for index, (query_id, query) in enumerate(self._assign_ids(questions)):
+            sent[query_id] = index
+            messages.append(struct.pack("!H", len(query)) + query)
 
-            if not (mobile_thread.is_alive() and dns_thread.is_alive()):
-                 main_logger.error("A critical monitoring thread (Mobile or DNS) has unexpectedly stopped.")
+        started = time.perf_counter()
+        until = started + timeout
+        sock.settimeout(timeout)
+        sock.sendall(b"".join(messages))
+        while sent:
+            length = struct.unpack("!H", self._recv_exact(sock, 2, until))[0]
+            data = self._recv_exact(sock, length, until)
+            received = time.perf_counter()
+            reply = parse_dns_response(data)
+            index = sent.pop(reply[0], None) if reply else None
+            if index is not None:
+                results[index] = (round((received - started) * 1000, 3), reply[1])
+        return results
 
-            if not battery_thread.is_alive() and not hasattr(get_battery_status, "logged_not_found"):
-                 main_logger.warning("Battery monitoring thread has stopped unexpectedly.")
+    def _query_tcp(self, server, port, questions, timeout):
+        key = (server, port)
+        while True:
+            sock = self.tcp_sockets.get(key)
+            reused = sock is not None
+            if sock is None:
+                sock = socket.create_connection(key, timeout=timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.tcp_sockets[key] = sock
+            try:
+                return self._exchange_tcp(sock, questions, timeout)
+            except OSError as e:
+                self.tcp_sockets.pop(key, None)
+                sock.close()
+                if not (reused and isinstance(e, ConnectionError)):
+                    raise
 
-        except KeyboardInterrupt:
-             print(f"\n{RED}Monitoring stopping...{RESET}")
-             main_logger.info("KeyboardInterrupt received. Stopping monitoring.")
-             break
+    def _query_doh(self, url, name, qtype, timeout):
+        headers = {"Content-Type": DOH_CONTENT_TYPE, "Accept": DOH_CONTENT_TYPE}
+        started = time.perf_counter()
+        try:
+            response = self.session.post(url, data=build_dns_query(0, name, qtype), headers=headers, timeout=timeout)
+        except requests.RequestException:
+            return None
+        received = time.perf_counter()
+        reply = parse_dns_response(response.content) if response.status_code == 200 else None
+        return (round((received - started) * 1000, 3), reply[1]) if reply else None
 
-try:
-    if __name__ == "__main__":
-        monitor_network()
+    def resolve(self, server, transport=None, name=DNS_QUERY_NAME, qtypes=DNS_QUERY_TYPES, cache_busting=None, timeout=None, port=DNS_QUERY_PORT):
+        transport = transport or DNS_QUERY_TRANSPORT
+        cache_busting = DNS_CACHE_BUSTING if cache_busting is None else cache_busting
+        timeout = timeout or self.timeout
+        questions = [(cache_busting_name(name) if cache_busting else name, qtype) for qtype in qtypes]
+
+        try:
+            if transport == "doh":
+                with self.lock:
+                    if self.session is None:
+                        self.session = pooled_session(len(DNS_SERVERS), self.doh_workers)
+                futures = [self.executor.submit(self._query_doh, server, query_name, qtype, timeout) for query_name, qtype in questions]
+                results = [future.result() for future in futures]
+            else:
+                query = self._query_tcp if transport == "tcp" else self._query_udp
+                with self._server_lock((transport, server, port)):
+                    results = query(server, port, questions, timeout)
+        except OSError:
+            results = [None] * len(questions)
+
+        return [result[0] if result and result[1] in DNS_OK_RCODES else None for result in results]
+
+    def close(self):
+        with self.lock:
+            for sock in list(self.udp_sockets.values()) + list(self.tcp_sockets.values()):
+                sock.close()
+            self.udp_sockets.clear()
+            self.tcp_sockets.clear()
+        if self.session is not None:
+            self.session.close()
+        self.executor.shutdown(wait=False)
+
+dns_engine = DnsQueryEngine()
+
+DNS_PROBE_SAMPLES = 3
+DNS_PROBE_TIMEOUT = 2
+DNS_PROBE_QUORUM = 3
+DNS_SCORE_METRIC = "median"
+DNS_LOSS_PENALTY_MS = 500
+
+def percentile(values, pct, presorted=False):
+    if not values:
+        return None
+    ordered = values if presorted else sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def score_dns_candidate(latencies, sent, metric=DNS_SCORE_METRIC, loss_penalty=DNS_LOSS_PENALTY_MS):
+    if not latencies or sent <= 0:
+        return None
+    if metric == "p90":
+        base = percentile(latencies, 90)
+    elif metric == "mean":
+        base = sum(latencies) / len(latencies)
+    else:
+        base = percentile(latencies, 50)
+    loss = 1.0 - len(latencies) / sent
+    return base + loss * loss_penalty
+
+def score_resolver(latencies, resolutions, samples, queries, weight=DNS_RESOLUTION_WEIGHT):
+    rtt_score = score_dns_candidate(latencies, samples)
+    if not weight:
+        return rtt_score
+    resolution_score = score_dns_candidate(resolutions, queries)
+    if rtt_score is None and resolution_score is None:
+        return None
+    rtt_score = DNS_LOSS_PENALTY_MS if rtt_score is None else rtt_score
+    resolution_score = DNS_LOSS_PENALTY_MS if resolution_score is None else resolution_score
+    return rtt_score + weight * resolution_score
+
+def probe_latencies(ip, samples, timeout, backends=None):
+    try:
+        return [latency for latency in (backends or system_backends()).prober.probe(ip, count=samples, timeout=timeout, interval=0.05) if latency is not None]
+    except Exception as e:
+        logging.getLogger(main_logger_name).warning(f"Probe failed for {ip}: {e}")
+        return []
+
+def probe_resolutions(endpoint, timeout, backends=None):
+    try:
+        return [latency for latency in (backends or system_backends()).dns_engine.resolve(endpoint, timeout=timeout) if latency is not None]
+    except Exception as e:
+        logging.getLogger(main_logger_name).warning(f"Resolution failed for {endpoint}: {e}")
+        return []
+
+def probe_candidate(server, samples, timeout, backends=None):
+    backends = backends or system_backends()
+    ip = server["ip"]
+    endpoint = resolver_endpoint(ip, DNS_QUERY_TRANSPORT) if DNS_RESOLUTION_WEIGHT else None
+    if not endpoint:
+        return probe_latencies(ip, samples, timeout, backends), []
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ntls-resolve") as executor:
+        resolving = executor.submit(probe_resolutions, endpoint, timeout, backends)
+        return probe_latencies(ip, samples, timeout, backends), resolving.result()
+
+def probe_dns_candidates(candidates, samples=DNS_PROBE_SAMPLES, timeout=DNS_PROBE_TIMEOUT, quorum=DNS_PROBE_QUORUM, backends=None):
+    if not candidates:
+        return []
+
+    backends = backends or system_backends()
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = {executor.submit(probe_candidate, server, samples, timeout, backends): server for server in candidates}
+    ranked = []
+    pending = set(futures)
+    deadline = time.monotonic() + timeout + 1
+
+    try:
+        while pending and len(ranked) < quorum:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                server = futures[future]
+                latencies, resolutions = future.result()
+                score = score_resolver(latencies, resolutions, samples, len(DNS_QUERY_TYPES))
+                if score is not None:
+                    ranked.append((score, server, latencies))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    ranked.sort(key=lambda x: x[0])
+    return ranked
+
+def get_best_dns(backends=None):
+    backends = backends or system_backends()
+    main_logger = logging.getLogger(main_logger_name)
+    ranked = probe_dns_candidates(DNS_SERVERS + EMERGENCY_DNS, backends=backends)
+
+    if ranked:
+        score, best_dns, _ = ranked[0]
+        timestamp = backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        print(f"{LIGHT_GREEN}[{timestamp}] Best DNS: {best_dns['name']} ({best_dns['ip']}){RESET}")
+        main_logger.info(f"[{timestamp}] Best DNS: {best_dns['name']} ({best_dns['ip']})")
+        main_logger.info(f"[{timestamp}] DNS ranking ({DNS_SCORE_METRIC}, {DNS_PROBE_SAMPLES} samples, {DNS_QUERY_TRANSPORT} resolution x{DNS_RESOLUTION_WEIGHT:g}): " + ", ".join(f"{server['ip']}={s:.1f}" for s, server, _ in ranked))
+        return best_dns["ip"]
+
+    else:
+        timestamp = backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        print(f"{RED}[{timestamp}] No functional DNS found.{RESET}")
+        main_logger.error(f"[{timestamp}] No functional DNS found.")
+        return None
+
+METRICS_CAPACITY = 4096
+METRICS_WINDOW = 300
+METRIC_QUANTILES = (0.5, 0.9, 0.99)
+
+class RingBuffer:
+    def __init__(self, capacity=METRICS_CAPACITY):
+        self.capacity = capacity
+        self.times = array("d", [0.0]) * capacity
+        self.values = array("d", [0.0]) * capacity
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, value):
+        evicted = None
+        if self.count == self.capacity:
+            evicted = self.popleft()
+        index = (self.start + self.count) % self.capacity
+        self.times[index] = t
+        self.values[index] = value
+        self.count += 1
+        return evicted
+
+    def popleft(self):
+        if not self.count:
+            return None
+        item = (self.times[self.start], self.values[self.start])
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+        return item
+
+    def first_time(self):
+        return self.times[self.start] if self.count else None
+
+    def last(self):
+        if not self.count:
+            return None
+        index = (self.start + self.count - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+    def __iter__(self):
+        for offset in range(self.count):
+            index = (self.start + offset) % self.capacity
+            yield self.times[index], self.values[index]
+
+    def tail(self, n):
+        n = min(n, self.count)
+        end = (self.start + self.count) % self.capacity
+        if end >= n:
+            return self.values[end - n:end].tolist()
+        return self.values[self.capacity - (n - end):].tolist() + self.values[:end].tolist()
+
+    def clear(self):
+        self.start = 0
+        self.count = 0
+
+class P2Quantile:
+    def __init__(self, q):
+        self.q = q
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self.increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, x):
+        h = self.heights
+        if len(h) < 5:
+            h.append(x)
+            if len(h) == 5:
+                h.sort()
+            return
+
+        n = self.positions
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= h[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+                )
+                if h[i - 1] < candidate < h[i + 1]:
+                    h[i] = candidate
+                else:
+                    h[i] = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self):
+        if len(self.heights) < 5:
+            return percentile(self.heights, self.q * 100)
+        return self.heights[2]
+
+class MetricSeries:
+    def __init__(self, name, capacity=METRICS_CAPACITY, quantiles=METRIC_QUANTILES, clock=clock):
+        self.name = name
+        self.clock = clock
+        self.recent = RingBuffer(capacity)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sketches = {q: P2Quantile(q) for q in quantiles}
+
+    def add(self, value, t=None):
+        self.recent.append(self.clock.time() if t is None else t, value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for sketch in self.sketches.values():
+            sketch.add(value)
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def window(self, n=METRICS_WINDOW):
+        values = sorted(self.recent.tail(n))
+        return {
+            "samples": len(values),
+            "mean": sum(values) / len(values) if values else None,
+            "p50": percentile(values, 50, presorted=True),
+            "p90": percentile(values, 90, presorted=True)
+        }
+
+    def summary(self):
+        last = self.recent.last()
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "stddev": math.sqrt(self.variance()) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            **{f"p{round(q * 100):g}": sketch.value() for q, sketch in self.sketches.items()},
+            "last": last[1] if last else None,
+            **{f"recent_{key}": value for key, value in self.window().items()}
+        }
+
+class MetricsStore:
+    def __init__(self, names=(), capacity=METRICS_CAPACITY, clock=clock):
+        self.capacity = capacity
+        self.clock = clock
+        self.series = {}
+        for name in names:
+            self.get(name)
+
+    def get(self, name):
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = MetricSeries(name, self.capacity, clock=self.clock)
+        return series
+
+    def add(self, name, value, t=None):
+        if value is not None:
+            self.get(name).add(value, t)
+
+    def summary(self):
+        return {name: series.summary() for name, series in self.series.items()}
+
+    def windows(self, n=METRICS_WINDOW):
+        return {name: series.window(n) for name, series in self.series.items() if series.count}
+
+metrics = MetricsStore(("rtt", "loss", "download", "battery"))
+
+EXPORT_RTT_BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+EXPORT_LOSS_BUCKETS = (0, 1, 5, 10, 25, 50, 100)
+EXPORT_SPEED_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+EXPORT_SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+METRICS_EXPORT_HOST = "127.0.0.1"
+METRICS_EXPORT_PORT = None
+METRICS_SNAPSHOT_INTERVAL = 0
+METRICS_SNAPSHOT_FILE = "metrics_snapshots.jsonl"
+
+class Counter:
+    __slots__ = ("value",)
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class Gauge:
+    __slots__ = ("value",)
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = math.nan
+
+    def observe(self, value):
+        self.value = value
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+    kind = "histogram"
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def prometheus_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = {}
+
+    def _register(self, name, help_text, instrument, labels):
+        label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        self.families.setdefault(name, (instrument.kind, help_text, {}))[2][label_text] = instrument
+        return instrument
+
+    def counter(self, name, help_text, **labels):
+        return self._register(name, help_text, Counter(), labels)
+
+    def gauge(self, name, help_text, **labels):
+        return self._register(name, help_text, Gauge(), labels)
+
+    def histogram(self, name, help_text, buckets, **labels):
+        return self._register(name, help_text, Histogram(buckets), labels)
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, instruments) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for label_text, instrument in instruments.items():
+                labels = f"{{{label_text}}}" if label_text else ""
+                if kind != "histogram":
+                    lines.append(f"{name}{labels} {prometheus_value(instrument.value)}")
+                    continue
+                prefix = f"{label_text}," if label_text else ""
+                cumulative = 0
+                for bound, count in zip(instrument.bounds + (math.inf,), instrument.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{prometheus_value(float(bound))}"}} {cumulative}')
+                lines.append(f"{name}_sum{labels} {prometheus_value(instrument.sum)}")
+                lines.append(f"{name}_count{labels} {instrument.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        snapshot = {}
+        for name, (kind, _, instruments) in self.families.items():
+            for label_text, instrument in instruments.items():
+                key = f"{name}{{{label_text}}}" if label_text else name
+                if kind == "histogram":
+                    snapshot[key] = {"count": instrument.count, "sum": instrument.sum, "buckets": dict(zip(map(str, instrument.bounds + ("+Inf",)), instrument.counts))}
+                else:
+                    snapshot[key] = None if isinstance(instrument.value, float) and math.isnan(instrument.value) else instrument.value
+        return snapshot
+
+export_registry = MetricsRegistry()
+export_samples = {
+    "rtt": export_registry.histogram("ntls_probe_rtt_ms", "Round trip time of resolver probes in milliseconds.", EXPORT_RTT_BUCKETS),
+    "jitter": export_registry.histogram("ntls_probe_jitter_ms", "Interarrival jitter of resolver probes in milliseconds.", EXPORT_RTT_BUCKETS),
+    "loss": export_registry.histogram("ntls_probe_loss_percent", "Packet loss per summary window in percent.", EXPORT_LOSS_BUCKETS),
+    "dns_resolution": export_registry.histogram("ntls_dns_resolution_ms", "DNS lookup time against the active resolver in milliseconds.", EXPORT_RTT_BUCKETS),
+    "rtt_loaded_download": export_registry.histogram("ntls_loaded_rtt_ms", "Median round trip time while the link is loaded, in milliseconds.", EXPORT_RTT_BUCKETS, phase="download"),
+    "rtt_loaded_upload": export_registry.histogram("ntls_loaded_rtt_ms", "Median round trip time while the link is loaded, in milliseconds.", EXPORT_RTT_BUCKETS, phase="upload"),
+    "download": export_registry.histogram("ntls_throughput_mbps", "Measured throughput in Mbps.", EXPORT_SPEED_BUCKETS, direction="download"),
+    "upload": export_registry.histogram("ntls_throughput_mbps", "Measured throughput in Mbps.", EXPORT_SPEED_BUCKETS, direction="upload"),
+    "battery": export_registry.gauge("ntls_battery_percent", "Last reported battery level.")
+}
+export_failures = {
+    "rtt": export_registry.counter("ntls_probe_failures_total", "Probes that got no answer.", probe="ping"),
+    "dns_resolution": export_registry.counter("ntls_probe_failures_total", "Probes that got no answer.", probe="dns")
+}
+export_subprocess_seconds = export_registry.histogram("ntls_subprocess_seconds", "Wall time of helper commands (termux-*, curl).", EXPORT_SECONDS_BUCKETS)
+export_subprocess_errors = export_registry.counter("ntls_subprocess_errors_total", "Helper commands that were missing or timed out.")
+export_scheduler_lag = export_registry.histogram("ntls_scheduler_lag_seconds", "Delay between a task's due time and its start.", EXPORT_SECONDS_BUCKETS)
+export_scheduler_wakeups = export_registry.counter("ntls_scheduler_wakeups_total", "Scheduler loop wakeups.")
+export_task_failures = export_registry.counter("ntls_task_failures_total", "Scheduled task runs that raised.")
+export_task_timeouts = export_registry.counter("ntls_task_timeouts_total", "Scheduled task runs that exceeded their deadline.")
+export_failovers = export_registry.counter("ntls_dns_reevaluations_total", "Times the monitored resolver was dropped and reselected.")
+export_incidents = export_registry.counter("ntls_incidents_total", "Incidents raised by the incident engine.")
+
+def export_sample(name, value):
+    if value is None:
+        counter = export_failures.get(name)
+        if counter is not None:
+            counter.inc()
+        return
+    instrument = export_samples.get(name)
+    if instrument is not None:
+        instrument.observe(value)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/metrics":
+            self.send_error(404)
+            return
+        body = export_registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(host=METRICS_EXPORT_HOST, port=0):
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ntls-metrics-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/metrics"
+
+async def write_metrics_snapshot(log, store=None, clock=clock):
+    log.write({"time": clock.now().strftime('%Y-%m-%d %H:%M:%S'), "metrics": export_registry.snapshot(), "recent": (store or metrics).windows()})
+
+LINK_STATS_WINDOW = 30
+LINK_STATS_CAPACITY = 1024
+
+class LinkStats:
+    def __init__(self, window=LINK_STATS_WINDOW, capacity=LINK_STATS_CAPACITY, clock=clock):
+        self.window = window
+        self.clock = clock
+        self.samples = RingBuffer(capacity)
+        self.reset()
+
+    def reset(self):
+        self.samples.clear()
+        self.received = 0
+        self.lost = 0
+        self.latency_sum = 0.0
+        self.jitter = 0.0
+        self.last_latency = None
+
+    def add(self, latency, now=None):
+        now = self.clock.monotonic() if now is None else now
+        self._evict(self.samples.append(now, math.nan if latency is None else latency))
+        if latency is None:
+            self.lost += 1
+        else:
+            self.received += 1
+            self.latency_sum += latency
+            if self.last_latency is not None:
+                self.jitter += (abs(latency - self.last_latency) - self.jitter) / 16
+            self.last_latency = latency
+        self._expire(now)
+
+    def _evict(self, item):
+        if item is None:
+            return
+        latency = item[1]
+        if math.isnan(latency):
+            self.lost -= 1
+        else:
+            self.received -= 1
+            self.latency_sum -= latency
+
+    def _expire(self, now):
+        while self.samples and now - self.samples.first_time() > self.window:
+            self._evict(self.samples.popleft())
+
+    def snapshot(self, now=None):
+        self._expire(self.clock.monotonic() if now is None else now)
+        total = self.received + self.lost
+        latencies = [latency for _, latency in self.samples if not math.isnan(latency)]
+        return {
+            "samples": total,
+            "loss": self.lost * 100.0 / total if total else None,
+            "avg": self.latency_sum / self.received if self.received else None,
+            "min": min(latencies) if latencies else None,
+            "max": max(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "jitter": self.jitter if self.received > 1 else None
+        }
+
+DNS_MAX_FAILURES = 5
+PING_INTERVAL = 1
+SUMMARY_INTERVAL = 5
+PUBLIC_IP_CHECK_INTERVAL = 60
+MOBILE_INFO_INTERVAL = 60
+BATTERY_INTERVAL = 60
+COVERAGE_RETRY_DELAY = 10
+
+class LatencyMonitor:
+    def __init__(self, max_failures=DNS_MAX_FAILURES, targets=None, backends=None):
+        self.backends = backends or system_backends()
+        self.max_failures = max_failures
+        self.targets = targets
+        self.failure_count = 0
+        self.current_dns = None
+        self.failed_dns = None
+        self.link_stats = LinkStats(clock=self.backends.clock)
+
+    async def sample(self):
+        main_logger = logging.getLogger(main_logger_name)
+
+        if not self.current_dns and self.targets is not None:
+            self.current_dns = self.targets.failover(exclude=self.failed_dns)
+        if not self.current_dns:
+            self.current_dns = await asyncio.to_thread(get_best_dns, self.backends)
+            if not self.current_dns:
+                print(f"{YELLOW}Waiting for coverage...{RESET}")
+                return COVERAGE_RETRY_DELAY
+
+        current_dns = self.current_dns
+        latency = await asyncio.to_thread(ping_dns, current_dns, backends=self.backends)
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        self.link_stats.add(latency)
+        record_metric("rtt", latency, self.backends.metrics)
+        if self.targets is not None:
+            self.targets.record(current_dns, latency)
+        self.backends.incidents.observe("ping", latency is None)
+
+        if latency is not None:
+            self.failure_count = 0
+            if TEXT_SAMPLE_LOG:
+                main_logger.info(f"[{timestamp}] Ping to {current_dns}: {latency} ms")
+
+        else:
+            self.failure_count += 1
+            if TEXT_SAMPLE_LOG:
+                main_logger.info(f"[{timestamp}] Ping to {current_dns}: Failed")
+
+        if self.failure_count >= self.max_failures:
+            print(f"{RED}Too many failures. Reevaluating DNS...{RESET}")
+            main_logger.warning(f"[{timestamp}] Too many ping failures to {current_dns}. Reevaluating DNS.")
+            self.reevaluate("ping failures")
+            self.failed_dns = current_dns
+
+    def reevaluate(self, reason):
+        if self.current_dns:
+            timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            logging.getLogger(main_logger_name).info(f"[{timestamp}] Reevaluating DNS ({reason}).")
+            export_failovers.inc()
+        self.current_dns, self.failure_count, self.failed_dns = None, 0, None
+        self.link_stats.reset()
+
+    async def resolve(self):
+        current_dns = self.current_dns
+        endpoint = resolver_endpoint(current_dns, DNS_QUERY_TRANSPORT) if current_dns else None
+        if not endpoint:
+            return
+
+        resolutions = await asyncio.to_thread(self.backends.dns_engine.resolve, endpoint)
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        answered = [latency for latency in resolutions if latency is not None]
+        record_metric("dns_resolution", percentile(answered, 50), self.backends.metrics)
+        if TEXT_SAMPLE_LOG:
+            details = ", ".join(f"{qtype} {latency} ms" if latency is not None else f"{qtype} Failed" for qtype, latency in zip(DNS_QUERY_TYPES, resolutions))
+            logging.getLogger(main_logger_name).info(f"[{timestamp}] DNS resolution via {current_dns} ({DNS_QUERY_TRANSPORT}): {details}")
+        self.backends.incidents.observe("dns", not answered)
+
+    async def summary(self):
+        main_logger = logging.getLogger(main_logger_name)
+        if not self.current_dns:
+            return
+
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        stats = self.link_stats.snapshot()
+        avg_latency = stats["avg"]
+
+        status = "Unknown"
+        status_color = RED
+        if avg_latency is not None:
+            if avg_latency < 50:
+                status = "Good"
+                status_color = LIGHT_GREEN
+
+            elif avg_latency < 100:
+                status = "Medium"
+                status_color = BROWN
+            else:
+                status = "Bad"
+                status_color = RED
+
+        print(f"{status_color}[{timestamp}] Ping summary: Average: {avg_latency:.1f} ms ({status}){RESET}" if avg_latency is not None else f"{RED}[{timestamp}] Ping failed.{RESET}")
+        main_logger.info(f"[{timestamp}] Ping summary: Average: {avg_latency:.1f} ms ({status})" if avg_latency is not None else f"[{timestamp}] Ping failed.")
+
+        packet_loss = stats["loss"]
+        record_metric("loss", packet_loss, self.backends.metrics)
+        record_metric("jitter", stats["jitter"], self.backends.metrics)
+        if avg_latency is not None:
+            main_logger.info(f"[{timestamp}] Link stats: p50: {stats['p50']:.1f} ms, p90: {stats['p90']:.1f} ms, p99: {stats['p99']:.1f} ms, Jitter: {stats['jitter'] or 0.0:.1f} ms, Loss: {packet_loss:.0f}% ({stats['samples']} samples)")
+        self.backends.incidents.observe_value("loss", packet_loss)
+        self.backends.incidents.observe_value("latency", stats["p90"])
+        if packet_loss is None:
+             main_logger.warning(f"[{timestamp}] No latency samples for {self.current_dns} in the last {self.link_stats.window} seconds")
+
+        web_ok = self.targets.web_connectivity() if self.targets is not None else None
+        if web_ok is None:
+            web_ok = await test_web_connectivity(backends=self.backends)
+        self.backends.incidents.observe("web", not web_ok)
+        if not web_ok:
+            timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            main_logger.info(f"[{timestamp}] Web connectivity failed.")
+
+PROBE_BUDGET = 3
+TARGETS_SUMMARY_INTERVAL = 60
+WEB_TARGETS = [
+    {"name": "Google", "kind": "http", "address": "http://www.google.com"}
+]
+
+def default_monitor_targets():
+    targets = [dict(server, kind="ping", address=server["ip"], role="resolver") for server in DNS_SERVERS + EMERGENCY_DNS]
+    return targets + [dict(target, role="web") for target in WEB_TARGETS]
+
+def load_monitor_targets(path):
+    with open(path) as targets_file:
+        targets = json.load(targets_file)
+    for target in targets:
+        if "address" not in target:
+            raise ValueError(f"Target without address in {path}: {target}")
+        target.setdefault("name", target["address"])
+        target.setdefault("kind", "http" if target["address"].startswith(("http://", "https://")) else "ping")
+        target.setdefault("role", "resolver" if target["kind"] == "ping" else "web")
+    return targets
+
+class TargetMonitor:
+    def __init__(self, target, backends=None):
+        self.backends = backends or system_backends()
+        self.target = target
+        self.stats = LinkStats(clock=self.backends.clock)
+        self.last_latency = None
+        self.last_sample = None
+
+    async def probe(self):
+        kind = self.target["kind"]
+        address = self.target["address"]
+        if kind == "http":
+            latency = await asyncio.to_thread(http_probe, address)
+        elif kind == "tcp":
+            host, _, port = address.rpartition(":")
+            latency = (await asyncio.to_thread(self.backends.prober.probe, host, count=1, timeout=2, method="tcp", port=int(port)))[0]
+        else:
+            latency = await asyncio.to_thread(ping_dns, address, backends=self.backends)
+        self.record(latency)
+
+    def record(self, latency):
+        self.stats.add(latency)
+        self.last_latency = latency
+        self.last_sample = self.backends.clock.monotonic()
+
+    def score(self):
+        stats = self.stats.snapshot()
+        if stats["p50"] is None:
+            return None
+        return stats["p50"] + stats["loss"] / 100.0 * DNS_LOSS_PENALTY_MS
+
+class MultiTargetMonitor:
+    def __init__(self, targets, budget=PROBE_BUDGET, backends=None):
+        self.backends = backends or system_backends()
+        self.monitors = [TargetMonitor(target, self.backends) for target in targets]
+        self.by_address = {monitor.target["address"]: monitor for monitor in self.monitors}
+        self.budget = budget
+        self.next_index = 0
+        self.skip = None
+
+    def record(self, address, latency):
+        monitor = self.by_address.get(address)
+        if monitor is not None:
+            monitor.record(latency)
+        self.skip = address
+
+    async def tick(self):
+        candidates = [monitor for monitor in self.monitors if monitor.target["address"] != self.skip]
+        if not candidates:
+            return
+        selected = []
+        for _ in range(min(self.budget, len(candidates))):
+            selected.append(candidates[self.next_index % len(candidates)])
+            self.next_index += 1
+        await asyncio.gather(*(monitor.probe() for monitor in selected))
+
+    def failover(self, exclude=None):
+        ranked = []
+        for monitor in self.monitors:
+            if monitor.target.get("role") != "resolver" or monitor.target["address"] == exclude:
+                continue
+            score = monitor.score()
+            if score is not None and monitor.last_latency is not None:
+                ranked.append((score, monitor))
+        if not ranked:
+            return None
+
+        score, best = min(ranked, key=lambda x: x[0])
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        print(f"{LIGHT_GREEN}[{timestamp}] Best DNS: {best.target['name']} ({best.target['address']}){RESET}")
+        logging.getLogger(main_logger_name).info(f"[{timestamp}] Best DNS: {best.target['name']} ({best.target['address']}) from live stats, score {score:.1f}")
+        return best.target["address"]
+
+    def web_connectivity(self):
+        results = [monitor.last_latency is not None for monitor in self.monitors if monitor.target.get("role") == "web" and monitor.last_sample is not None]
+        if not results:
+            return None
+        return any(results)
+
+    async def summary(self):
+        main_logger = logging.getLogger(main_logger_name)
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        for monitor in self.monitors:
+            main_logger.info(f"[{timestamp}] Target {monitor.target['name']} ({monitor.target['address']}): {format_latency_stats(monitor.stats.snapshot())}")
+
+class PublicIPWatcher:
+    def __init__(self, public_ip="N/A", backends=None):
+        self.backends = backends or system_backends()
+        self.public_ip = public_ip
+
+    async def check(self):
+        main_logger = logging.getLogger(main_logger_name)
+        sensitive_logger = logging.getLogger(sensitive_logger_name)
+
+        new_public_ip = await asyncio.to_thread(self.backends.public_ip.lookup)
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        if new_public_ip != "N/A" and new_public_ip != self.public_ip:
+            print(f"{YELLOW}[ALERT] [{timestamp}] Public IP changed: {self.public_ip} -> {new_public_ip}{RESET}")
+            main_logger.warning(f"[{timestamp}] Public IP changed: {self.public_ip} -> {new_public_ip}")
+            sensitive_logger.warning(f"[{timestamp}] Public IP changed: {self.public_ip} -> {new_public_ip}")
+            if self.public_ip != "N/A":
+                report_incident("public IP change")
+                self.backends.incidents.note("public IP change")
+            self.public_ip = new_public_ip
+
+LOCAL_IP_CHECK_INTERVAL = 5
+
+class LocalAddressWatcher:
+    def __init__(self, backends=None):
+        self.backends = backends or system_backends()
+        self.local_ips = None
+
+    async def check(self):
+        local_ips = self.backends.local_addresses()
+        if self.local_ips is not None and local_ips != self.local_ips:
+            timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            print(f"{YELLOW}[{timestamp}] Local IP changed: {', '.join(self.local_ips)} -> {', '.join(local_ips)}{RESET}")
+            logging.getLogger(main_logger_name).info(f"[{timestamp}] Local IP changed: {', '.join(self.local_ips)} -> {', '.join(local_ips)}")
+            logging.getLogger(sensitive_logger_name).info(f"[{timestamp}] Local IP changed: {', '.join(self.local_ips)} -> {', '.join(local_ips)}")
+            request_public_ip_recheck("local IP change", self.backends)
+        self.local_ips = local_ips
+
+active_scheduler = None
+
+def request_public_ip_recheck(reason, backends=None):
+    (backends or system_backends()).public_ip.invalidate()
+    report_incident(reason)
+    if active_scheduler is not None:
+        active_scheduler.trigger("public_ip")
+
+class MobileInfoMonitor:
+    def __init__(self, retry_delay=5, backends=None):
+        self.backends = backends or system_backends()
+        self.retry_delay = retry_delay
+        self.previous_state = None
+
+    async def refresh(self):
+        main_logger = logging.getLogger(main_logger_name)
+
+        try:
+            _, stdout, _ = await run_helper(TELEPHONY_COMMAND, TELEPHONY_CACHE_TTL, backends=self.backends)
+            mobile_info_raw = stdout.decode("utf-8")
+
+        except asyncio.TimeoutError:
+            timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            main_logger.warning(f"[{timestamp}] Timeout getting mobile info. Retrying in {self.retry_delay} seconds...")
+            return self.retry_delay
+
+        except FileNotFoundError:
+             timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+             print(f"{RED}[{timestamp}] Error: 'termux-telephony-deviceinfo' command not found. Stopping mobile info checks.{RESET}")
+             main_logger.error(f"[{timestamp}] 'termux-telephony-deviceinfo' command not found. Stopping mobile info checks.")
+             return False
+
+        except Exception as e:
+            timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            main_logger.error(f"[{timestamp}] Error retrieving mobile info: {e}. Retrying in {self.retry_delay} seconds...")
+            return self.retry_delay
+
+        if not mobile_info_raw:
+            return
+
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        try:
+            mobile_info = json.loads(mobile_info_raw)
+            operator = mobile_info.get("network_operator_name", "Unknown")
+            network_type = mobile_info.get("network_type", "Unknown").upper()
+            data_enabled = mobile_info.get("data_enabled", "Unknown")
+            sim_state = mobile_info.get("sim_state", "Unknown")
+
+            current_state = {
+                "operator": operator,
+                "network_type": network_type,
+                "data_enabled": data_enabled,
+                "sim_state": sim_state
+            }
+            self.backends.incidents.observe("network_type", network_type in DEGRADED_NETWORK_TYPES)
+            self.backends.incidents.observe("mobile_data", str(data_enabled).lower() == "false")
+
+            if current_state != self.previous_state:
+                print(f"{CYAN}[{timestamp}] Operator: {operator}, Network: {network_type}, Data: {data_enabled}, SIM: {sim_state}{RESET}")
+                main_logger.info(f"[{timestamp}] Operator: {operator}, Network: {network_type}, Data: {data_enabled}, SIM: {sim_state}")
+                if self.previous_state is not None:
+                    if network_type != self.previous_state["network_type"]:
+                        request_public_ip_recheck(f"network change to {network_type}", self.backends)
+                    else:
+                        report_incident("mobile state change")
+                self.previous_state = current_state
+                if structured_log is not None:
+                    structured_log.set_context(operator, network_type)
+
+        except json.JSONDecodeError as e:
+             print(f"{RED}[{timestamp}] Error parsing mobile info JSON: {e}{RESET}")
+             main_logger.error(f"[{timestamp}] Error parsing mobile info JSON: {e}. Raw data: {mobile_info_raw[:100]}...")
+        except Exception as e:
+             print(f"{RED}[{timestamp}] Error processing mobile info: {e}{RESET}")
+             main_logger.error(f"[{timestamp}] Error processing mobile info: {e}")
+
+SPEEDTEST_DOWNLOAD_URL = "http://speed.cloudflare.com/__down?bytes={bytes}"
+SPEEDTEST_INITIAL_BYTES = 100000
+SPEEDTEST_MAX_BYTES = 50 * 1024 * 1024
+SPEEDTEST_MIN_DURATION = 2.0
+SPEEDTEST_STREAMS = 1
+SPEEDTEST_CHUNK_SIZE = 64 * 1024
+SPEEDTEST_PAYLOAD_BLOCK = bytes(SPEEDTEST_CHUNK_SIZE)
+
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+def connection_dropped(sock):
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+class ConnectionPool:
+    def __init__(self):
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url, timeout, reuse=True):
+        parsed = urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        with self.lock:
+            connections = self.idle.get(key) if reuse else None
+            while connections:
+                conn = connections.pop()
+                if conn.sock is None or connection_dropped(conn.sock):
+                    conn.close()
+                    continue
+                conn.timeout = timeout
+                conn.sock.settimeout(timeout)
+                return key, conn, 0.0
+
+        connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        conn = connection_class(parsed.hostname, parsed.port, timeout=timeout)
+        started = time.perf_counter()
+        conn.connect()
+        return key, conn, time.perf_counter() - started
+
+    def release(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for conn in connections:
+                    conn.close()
+            self.idle.clear()
+
+http_pool = ConnectionPool()
+
+def request_path(url):
+    parsed = urlsplit(url)
+    return (parsed.path or "/") + (f"?{parsed.query}" if parsed.query else "")
+
+def pooled_request(url, timeout, send):
+    for reuse in (True, False):
+        key, conn, connect_time = http_pool.acquire(url, timeout, reuse)
+        try:
+            started = time.perf_counter()
+            send(conn)
+            response = conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            if connect_time:
+                raise
+            continue
+        except Exception:
+            conn.close()
+            raise
+        return key, conn, connect_time, started, response
+
+def download_stream(url, timeout, buffer):
+    key, conn, connect_time, started, response = pooled_request(url, timeout, lambda conn: conn.request("GET", request_path(url), headers={"Accept-Encoding": "identity"}))
+    try:
+        first_byte = time.perf_counter()
+        if response.status != 200:
+            response.read()
+            raise http.client.HTTPException(f"HTTP {response.status} from {url}")
+
+        view = memoryview(buffer)
+        received = 0
+        while True:
+            count = response.readinto(view)
+            if not count:
+                break
+            received += count
+        finished = time.perf_counter()
+
+    except Exception:
+        conn.close()
+        raise
+
+    if response.will_close:
+        conn.close()
+    else:
+        http_pool.release(key, conn)
+
+    return {
+        "bytes": received,
+        "connect_s": connect_time,
+        "ttfb_s": first_byte - started,
+        "start": first_byte,
+        "end": finished
+    }
+
+def http_probe(url, timeout=5):
+    try:
+        key, conn, _, started, response = pooled_request(url, timeout, lambda conn: conn.request("HEAD", request_path(url)))
+    except (OSError, http.client.HTTPException):
+        return None
+    try:
+        response.read()
+        latency = round((time.perf_counter() - started) * 1000, 3)
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        return None
+
+    if response.will_close:
+        conn.close()
+    else:
+        http_pool.release(key, conn)
+    return latency if response.status < 500 else None
+
+SPEEDTEST_UPLOAD_URL = "http://speed.cloudflare.com/__up"
+
+def send_upload(conn, url, size):
+    conn.putrequest("POST", request_path(url), skip_accept_encoding=True)
+    conn.putheader("Content-Type", "application/octet-stream")
+    conn.putheader("Content-Length", str(size))
+    conn.endheaders()
+
+    view = memoryview(SPEEDTEST_PAYLOAD_BLOCK)
+    remaining = size
+    while remaining > 0:
+        chunk = min(remaining, len(view))
+        conn.send(view[:chunk])
+        remaining -= chunk
+
+def upload_stream(url, size, timeout):
+    key, conn, connect_time, started, response = pooled_request(url, timeout, lambda conn: send_upload(conn, url, size))
+    try:
+        response.read()
+        finished = time.perf_counter()
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status} from {url}")
+
+    except Exception:
+        conn.close()
+        raise
+
+    if response.will_close:
+        conn.close()
+    else:
+        http_pool.release(key, conn)
+
+    return {
+        "bytes": size,
+        "connect_s": connect_time,
+        "ttfb_s": 0.0,
+        "start": started,
+        "end": finished
+    }
+
+def run_streams(transfer, streams):
+    if streams == 1:
+        results = [transfer(0)]
+    else:
+        with ThreadPoolExecutor(max_workers=streams) as executor:
+            results = list(executor.map(transfer, range(streams)))
+
+    received = sum(result["bytes"] for result in results)
+    transfer_time = max(result["end"] for result in results) - min(result["start"] for result in results)
+    return {
+        "bytes": received,
+        "transfer_s": transfer_time,
+        "connect_ms": max(result["connect_s"] for result in results) * 1000,
+        "ttfb_ms": max(result["ttfb_s"] for result in results) * 1000,
+        "streams": streams
+    }
+
+def measure_throughput(transfer, adaptive, streams, timeout, min_duration, initial_bytes, max_bytes):
+    size = initial_bytes
+    deadline = time.monotonic() + timeout
+    connect_ms = 0.0
+
+    while True:
+        remaining = max(1.0, deadline - time.monotonic())
+        result = run_streams(lambda index: transfer(index, size, remaining), streams)
+        result["size"] = size if adaptive else result["bytes"] // streams
+        connect_ms = max(connect_ms, result["connect_ms"])
+        result["connect_ms"] = connect_ms
+        if not adaptive or result["transfer_s"] >= min_duration or size >= max_bytes:
+            break
+        if time.monotonic() + min_duration * 2 > deadline:
+            break
+        growth = min_duration / max(result["transfer_s"], 0.001) * 1.2
+        size = int(min(max_bytes, size * min(16, max(2, growth))))
+
+    result["bytes_per_s"] = result["bytes"] / result["transfer_s"] if result["transfer_s"] > 0 else 0.0
+    return result
+
+def measure_download_throughput(url=SPEEDTEST_DOWNLOAD_URL, streams=SPEEDTEST_STREAMS, timeout=10, min_duration=SPEEDTEST_MIN_DURATION, initial_bytes=SPEEDTEST_INITIAL_BYTES, max_bytes=SPEEDTEST_MAX_BYTES):
+    buffers = [bytearray(SPEEDTEST_CHUNK_SIZE) for _ in range(streams)]
+    adaptive = "{bytes}" in url
+    transfer = lambda index, size, remaining: download_stream(url.format(bytes=size) if adaptive else url, remaining, buffers[index])
+    return measure_throughput(transfer, adaptive, streams, timeout, min_duration, initial_bytes, max_bytes)
+
+def measure_upload_throughput(url=SPEEDTEST_UPLOAD_URL, streams=SPEEDTEST_STREAMS, timeout=10, min_duration=SPEEDTEST_MIN_DURATION, initial_bytes=SPEEDTEST_INITIAL_BYTES, max_bytes=SPEEDTEST_MAX_BYTES):
+    transfer = lambda index, size, remaining: upload_stream(url, size, remaining)
+    return measure_throughput(transfer, True, streams, timeout, min_duration, initial_bytes, max_bytes)
+
+def test_download_speed(url=SPEEDTEST_DOWNLOAD_URL, timeout=10, streams=SPEEDTEST_STREAMS):
+    main_logger = logging.getLogger(main_logger_name)
+    try:
+        result = measure_download_throughput(url, streams=streams, timeout=timeout)
+        speed_MBps = result["bytes_per_s"] / (1024 * 1024)
+        speed_Mbps = speed_MBps * 8
+        main_logger.info(f"Download detail: {result['bytes']} bytes in {result['transfer_s']:.3f} s, connect {result['connect_ms']:.1f} ms, TTFB {result['ttfb_ms']:.1f} ms, {result['streams']} stream(s)")
+        return speed_MBps, speed_Mbps
+
+    except (OSError, http.client.HTTPException) as e:
+        main_logger.error(f"Download speedtest failed: {e}")
+        return None, None
+
+    except Exception as e:
+        main_logger.error(f"Download speedtest failed: {e}")
+        return None, None
+
+QUALITY_TEST_MODE = "basic"
+LOADED_LATENCY_TARGET = "8.8.8.8"
+LOADED_LATENCY_INTERVAL = 0.2
+LOADED_LATENCY_MIN_SAMPLES = 10
+LOADED_LATENCY_MIN_DURATION = 2.0
+LOADED_LATENCY_GRACE = 3.0
+IDLE_LATENCY_SAMPLES = 10
+
+class LatencySampler:
+    def __init__(self, target, interval=LOADED_LATENCY_INTERVAL, timeout=1, min_samples=LOADED_LATENCY_MIN_SAMPLES, min_duration=LOADED_LATENCY_MIN_DURATION, grace=LOADED_LATENCY_GRACE):
+        self.target = target
+        self.interval = interval
+        self.timeout = timeout
+        self.min_samples = min_samples
+        self.min_duration = min_duration
+        self.grace = grace
+        self.count = 0
+        self.started = None
+        self.stopped = None
+        self.stats = LinkStats(window=3600)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="ntls-latency-sampler", daemon=True)
+
+    def _done(self):
+        if not self.stop_event.is_set():
+            return False
+        if self.count >= self.min_samples and time.monotonic() - self.started >= self.min_duration:
+            return True
+        return time.monotonic() - self.stopped >= self.grace
+
+    def _run(self):
+        while not self._done():
+            self.stats.add(ping_dns(self.target, timeout=self.timeout, max_age=0))
+            self.count += 1
+            if not self.stop_event.is_set():
+                self.stop_event.wait(self.interval)
+            elif not self._done():
+                time.sleep(self.interval)
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped = time.monotonic()
+        self.stop_event.set()
+        self.thread.join(self.grace + self.timeout + self.interval)
+        return False
+
+def measure_idle_latency(target, count=IDLE_LATENCY_SAMPLES, interval=0.1):
+    stats = LinkStats(window=3600)
+    try:
+        for latency in prober.probe(target, count=count, timeout=2, interval=interval):
+            stats.add(latency)
+    except OSError as e:
+        logging.getLogger(main_logger_name).warning(f"Idle latency test failed for {target}: {e}")
+    return stats.snapshot()
+
+def measure_under_load(target, measure, min_samples=LOADED_LATENCY_MIN_SAMPLES, **sampler_options):
+    with LatencySampler(target, min_samples=min_samples, **sampler_options) as sampler:
+        try:
+            result = measure()
+        except (OSError, http.client.HTTPException) as e:
+            logging.getLogger(main_logger_name).error(f"Loaded throughput test failed: {e}")
+            result = None
+    loaded = sampler.stats.snapshot()
+    loaded["rejected"] = loaded["samples"] < min_samples
+    if result is not None:
+        result["latency_samples"] = loaded["samples"]
+    return result, loaded
+
+def format_latency_stats(stats):
+    if stats["p50"] is None:
+        return "no replies"
+    return f"p50 {stats['p50']:.1f} ms, p90 {stats['p90']:.1f} ms, Jitter: {stats['jitter'] or 0.0:.1f} ms, Loss: {stats['loss']:.0f}% ({stats['samples']} samples)"
+
+def evaluate_loaded_quality(target=LOADED_LATENCY_TARGET, download_url=SPEEDTEST_DOWNLOAD_URL, upload_url=SPEEDTEST_UPLOAD_URL, streams=SPEEDTEST_STREAMS):
+    main_logger = logging.getLogger(main_logger_name)
+    idle = measure_idle_latency(target)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    print(f"{LIGHT_GREEN}[{timestamp}] Idle latency: {format_latency_stats(idle)}{RESET}")
+    main_logger.info(f"[{timestamp}] Idle latency to {target}: {format_latency_stats(idle)}")
+
+    phases = (
+        ("download", lambda: measure_download_throughput(download_url, streams=streams)),
+        ("upload", lambda: measure_upload_throughput(upload_url, streams=streams))
+    )
+    results = {"idle": idle}
+    for phase, measure in phases:
+        result, loaded = measure_under_load(target, measure)
+        results[phase] = {"throughput": result, "latency": loaded}
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+        if result is not None:
+            speed_MBps = result["bytes_per_s"] / (1024 * 1024)
+            speed_Mbps = speed_MBps * 8
+            record_metric(phase, speed_Mbps)
+            print(f"{LIGHT_GREEN}[{timestamp}] {phase.capitalize()} speed: {speed_MBps:.2f} MB/s ({speed_Mbps:.2f} Mbps){RESET}")
+            main_logger.info(f"[{timestamp}] {phase.capitalize()} speedtest: {speed_MBps:.2f} MB/s ({speed_Mbps:.2f} Mbps)")
+        else:
+            print(f"{RED}[{timestamp}] {phase.capitalize()} test failed.{RESET}")
+            main_logger.info(f"[{timestamp}] {phase.capitalize()} speedtest failed.")
+
+        if loaded["rejected"]:
+            print(f"{YELLOW}[{timestamp}] Loaded latency ({phase}): only {loaded['samples']} samples, result discarded{RESET}")
+            main_logger.info(f"[{timestamp}] Loaded latency ({phase}) to {target}: only {loaded['samples']} samples, result discarded")
+            continue
+        record_metric(f"rtt_loaded_{phase}", loaded["p50"])
+        increase = f" (+{loaded['p50'] - idle['p50']:.1f} ms over idle)" if loaded["p50"] is not None and idle["p50"] is not None else ""
+        color = YELLOW if increase and loaded["p50"] - idle["p50"] >= 100 else LIGHT_GREEN
+        print(f"{color}[{timestamp}] Loaded latency ({phase}): {format_latency_stats(loaded)}{increase}{RESET}")
+        main_logger.info(f"[{timestamp}] Loaded latency ({phase}) to {target}: {format_latency_stats(loaded)}{increase}")
+
+    return results
+
+class SpeedtestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        parsed = urlsplit(self.path)
+        if parsed.path != "/__down":
+            self.send_error(404)
+            return
+        try:
+            size = int(parse_qs(parsed.query).get("bytes", ["0"])[0])
+        except ValueError:
+            self.send_error(400)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        view = memoryview(SPEEDTEST_PAYLOAD_BLOCK)
+        while size > 0:
+            chunk = min(size, len(view))
+            self.wfile.write(view[:chunk])
+            size -= chunk
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == "/dns-query":
+            query = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+            try:
+                answer = build_dns_answer(query)
+            except (ValueError, struct.error):
+                self.send_error(400)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", DOH_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(answer)))
+            self.end_headers()
+            self.wfile.write(answer)
+            return
+        if path != "/__up":
+            self.send_error(404)
+            return
+        remaining = int(self.headers.get("Content-Length", "0"))
+        view = memoryview(bytearray(SPEEDTEST_CHUNK_SIZE))
+        while remaining > 0:
+            count = self.rfile.readinto(view[:min(remaining, len(view))])
+            if not count:
+                break
+            remaining -= count
+
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_local_speedtest_server(host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), SpeedtestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="ntls-speedtest-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+LOCAL_DNS_ANSWERS = {"A": "127.0.0.1", "AAAA": "::1"}
+
+def build_dns_answer(query, answers=LOCAL_DNS_ANSWERS):
+    query_id, flags, questions = struct.unpack_from("!HHH", query, 0)
+    if questions != 1:
+        raise ValueError("Expected a single question")
+    end = skip_dns_name(query, 12) + 4
+    qtype = struct.unpack_from("!H", query, end - 4)[0]
+    record = b""
+    for name, code in DNS_TYPE_CODES.items():
+        if code == qtype and answers.get(name):
+            rdata = socket.inet_pton(socket.AF_INET if name == "A" else socket.AF_INET6, answers[name])
+            record = struct.pack("!HHHIH", 0xC00C, qtype, 1, 60, len(rdata)) + rdata
+    header = struct.pack("!HHHHHH", query_id, 0x8080 | (flags & 0x0100), 1, 1 if record else 0, 0, 0)
+    return header + query[12:end] + record
+
+class LocalDnsUDPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        try:
+            sock.sendto(build_dns_answer(data, self.server.answers), self.client_address)
+        except (ValueError, struct.error):
+            pass
+
+class LocalDnsTCPHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        stream = self.request.makefile("rb")
+        while True:
+            prefix = stream.read(2)
+            if len(prefix) < 2:
+                break
+            data = stream.read(struct.unpack("!H", prefix)[0])
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            try:
+                answer = build_dns_answer(data, self.server.answers)
+            except (ValueError, struct.error):
+                break
+            self.request.sendall(struct.pack("!H", len(answer)) + answer)
+
+def start_local_dns_server(host="127.0.0.1", port=0, answers=LOCAL_DNS_ANSWERS, delay=0):
+    udp_server = socketserver.ThreadingUDPServer((host, port), LocalDnsUDPHandler)
+    port = udp_server.server_address[1]
+    tcp_server = socketserver.ThreadingTCPServer((host, port), LocalDnsTCPHandler)
+    for server, kind in ((udp_server, "udp"), (tcp_server, "tcp")):
+        server.daemon_threads = True
+        server.answers = answers
+        server.delay = delay
+        threading.Thread(target=server.serve_forever, name=f"ntls-dns-server-{kind}", daemon=True).start()
+    return (udp_server, tcp_server), port
+
+def evaluate_network_quality(mode=QUALITY_TEST_MODE, download_url=SPEEDTEST_DOWNLOAD_URL, upload_url=SPEEDTEST_UPLOAD_URL):
+    main_logger = logging.getLogger(main_logger_name)
+    dns_server = "8.8.8.8"
+    avg_latency = ping_dns(dns_server)
+    packet_loss = check_packet_loss(dns_server)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+    if avg_latency is not None:
+        latency_status = "Good" if avg_latency < 50 else "Bad"
+    print(f"{LIGHT_GREEN}[{timestamp}] Latency: {avg_latency:.1f} ms ({latency_status}){RESET}" if avg_latency is not None else f"{RED}[{timestamp}] Latency test failed.{RESET}")
+    main_logger.info(f"[{timestamp}] Latency test to {dns_server}: {avg_latency:.1f} ms ({latency_status})" if avg_latency is not None else f"[{timestamp}] Latency test to {dns_server} failed.")
+
+    if packet_loss is not None:
+        packet_loss_status = "Good" if packet_loss < 10 else "Bad"
+    print(f"{LIGHT_GREEN if packet_loss < 10 else RED}[{timestamp}] Packet loss: {packet_loss}% ({packet_loss_status}){RESET}" if packet_loss is not None else f"{RED}[{timestamp}] Packet loss test failed.{RESET}")
+    main_logger.info(f"[{timestamp}] Packet loss test to {dns_server}: {packet_loss}% ({packet_loss_status})" if packet_loss is not None else f"[{timestamp}] Packet loss test to {dns_server} failed.")
+
+    if mode == "loaded":
+        evaluate_loaded_quality(dns_server, download_url, upload_url)
+        return
+
+    speed_MBps, speed_Mbps = test_download_speed(download_url, timeout=10)
+    record_metric("download", speed_Mbps)
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+    print(f"{LIGHT_GREEN}[{timestamp}] Download speed: {speed_MBps:.2f} MB/s ({speed_Mbps:.2f} Mbps){RESET}" if speed_MBps is not None else f"{RED}[{timestamp}] Download test failed.{RESET}")
+    main_logger.info(f"[{timestamp}] Download speedtest: {speed_MBps:.2f} MB/s ({speed_Mbps:.2f} Mbps)" if speed_MBps is not None else f"[{timestamp}] Download speedtest failed.")
+
+async def get_battery_status(max_age=BATTERY_CACHE_TTL, backends=None):
+    main_logger = logging.getLogger(main_logger_name)
+    if helper_missing(BATTERY_COMMAND, backends):
+        return None
+    try:
+        _, stdout, _ = await run_helper(BATTERY_COMMAND, max_age, backends=backends)
+        battery_info = json.loads(stdout.decode("utf-8"))
+        return battery_info
+
+    except FileNotFoundError:
+        main_logger.error("'termux-battery-status' command not found. Battery monitoring disabled.")
+        return None
+
+    except asyncio.TimeoutError:
+        main_logger.warning("Timeout getting battery status.")
+        return None
+
+    except json.JSONDecodeError:
+        main_logger.error("Error parsing battery status JSON.")
+        return None
+
+    except Exception as e:
+        main_logger.error(f"Error getting battery status: {e}")
+        return None
+
+class BatteryMonitor:
+    def __init__(self, backends=None):
+        self.backends = backends or system_backends()
+        self.alerted_levels = set()
+
+    async def check(self):
+        main_logger = logging.getLogger(main_logger_name)
+        thresholds = [10, 20, 30, 40, 50, 60, 70, 80, 90]
+
+        battery_info = await get_battery_status(max_age=0, backends=self.backends)
+        timestamp = self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+        if battery_info:
+            percentage = battery_info.get("percentage")
+            status = battery_info.get("status", "UNKNOWN").upper()
+
+            if percentage is not None:
+                main_logger.info(f"[{timestamp}] Battery: {percentage}% ({status})")
+                record_metric("battery", percentage, self.backends.metrics)
+                if rate_controller is not None:
+                    rate_controller.note_battery(percentage, status)
+
+                if status == "DISCHARGING":
+                    for level in thresholds:
+                        if percentage <= level and level not in self.alerted_levels:
+                            print(f"{YELLOW}[ALERT] [{timestamp}] Battery level low: {percentage}% (Discharging){RESET}")
+                            main_logger.warning(f"[{timestamp}] Battery level low: {percentage}% (Discharging)")
+                            self.alerted_levels.add(level)
+
+
+                levels_to_remove = set()
+                for alerted_level in self.alerted_levels:
+                    if percentage > alerted_level or status != "DISCHARGING":
+                        levels_to_remove.add(alerted_level)
+                        if status != "DISCHARGING":
+                            main_logger.info(f"[{timestamp}] Battery no longer discharging. Resetting alert for {alerted_level}%.")
+                        else:
+                            main_logger.info(f"[{timestamp}] Battery charged above {alerted_level}%. Resetting alert.")
+
+
+                self.alerted_levels -= levels_to_remove
+
+            else:
+                main_logger.warning(f"[{timestamp}] Could not determine battery percentage from status.")
+        else:
+             if helper_missing(BATTERY_COMMAND, self.backends):
+                 main_logger.info("Stopping battery monitoring due to missing command.")
+                 return False
+
+SCHEDULER_COALESCE_WINDOW = 0.05
+
+class PeriodicTask:
+    def __init__(self, name, func, interval, deadline=None, jitter=0.0, initial_delay=0.0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.deadline = deadline or interval
+        self.jitter = jitter
+        self.initial_delay = initial_delay
+        self.next_run = None
+        self.running = None
+        self.stopped = False
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.lag = 0.0
+
+class Scheduler:
+    def __init__(self, coalesce_window=SCHEDULER_COALESCE_WINDOW):
+        self.coalesce_window = coalesce_window
+        self.tasks = {}
+        self.wakeup = None
+        self.loop = None
+        self.stopping = False
+        self.wakeups = 0
+
+    def add(self, name, func, interval, deadline=None, jitter=0.0, initial_delay=0.0):
+        task = self.tasks[name] = PeriodicTask(name, func, interval, deadline, jitter, initial_delay)
+        if self.loop is not None:
+            task.next_run = self.loop.time() + initial_delay
+            self.wakeup.set()
+        return task
+
+    def trigger(self, name):
+        task = self.tasks.get(name)
+        if task is None or task.stopped or self.loop is None:
+            return
+        task.next_run = min(task.next_run, self.loop.time())
+        self.wakeup.set()
+
+    async def _run_task(self, task):
+        main_logger = logging.getLogger(main_logger_name)
+        delay = None
+        try:
+            result = await asyncio.wait_for(task.func(), task.deadline)
+            if result is False:
+                task.stopped = True
+                main_logger.info(f"Task {task.name} stopped.")
+            elif isinstance(result, (int, float)) and not isinstance(result, bool):
+                delay = result
+
+        except asyncio.TimeoutError:
+            task.timeouts += 1
+            export_task_timeouts.inc()
+            main_logger.warning(f"Task {task.name} exceeded its {task.deadline} s deadline.")
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            task.failures += 1
+            export_task_failures.inc()
+            main_logger.error(f"Task {task.name} failed: {e}")
+
+        finally:
+            task.runs += 1
+            task.running = None
+            now = self.loop.time()
+            if delay is not None:
+                task.next_run = now + delay
+            else:
+                task.next_run = max(task.next_run + task.interval, now)
+            if task.jitter:
+                task.next_run += random.uniform(0, task.jitter)
+            self.wakeup.set()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        for task in self.tasks.values():
+            task.next_run = self.loop.time() + task.initial_delay
+
+        while not self.stopping:
+            now = self.loop.time()
+            waiting = []
+            for task in self.tasks.values():
+                if task.stopped or task.running is not None:
+                    continue
+                if task.next_run <= now + self.coalesce_window:
+                    task.lag = max(0.0, now - task.next_run)
+                    export_scheduler_lag.observe(task.lag)
+                    task.running = asyncio.create_task(self._run_task(task), name=f"ntls-{task.name}")
+                else:
+                    waiting.append(task.next_run)
+
+            self.wakeup.clear()
+            timeout = max(0.0, min(waiting) - self.loop.time()) if waiting else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeups += 1
+            export_scheduler_wakeups.inc()
+
+    def stop(self):
+        self.stopping = True
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def shutdown(self):
+        self.stopping = True
+        running = [task.running for task in self.tasks.values() if task.running is not None]
+        for running_task in running:
+            running_task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+RATE_LIMITS = {
+    "dns_latency": (0.5, 10),
+    "summary": (5, 30),
+    "public_ip": (15, 600),
+    "mobile_info": (15, 600),
+    "battery": (30, 600)
+}
+RATE_INCIDENT_FACTOR = 0.5
+RATE_STEADY_FACTOR = 2.0
+RATE_INCIDENT_HOLD = 120
+RATE_STEADY_AFTER = 600
+RATE_CONTROL_INTERVAL = 30
+BATTERY_LOW_PERCENT = 30
+BATTERY_CRITICAL_PERCENT = 15
+
+class RateController:
+    def __init__(self, scheduler, limits=RATE_LIMITS, backends=None):
+        self.backends = backends or system_backends()
+        self.scheduler = scheduler
+        self.limits = limits
+        self.base = {name: task.interval for name, task in scheduler.tasks.items() if name in limits}
+        self.started = self.backends.clock.monotonic()
+        self.last_incident = None
+        self.battery_factor = 1.0
+        self.mode = "normal"
+
+    def _mode(self, now):
+        if self.backends.incidents.current is not None or (self.last_incident is not None and now - self.last_incident < RATE_INCIDENT_HOLD):
+            return "incident"
+        if now - (self.last_incident if self.last_incident is not None else self.started) >= RATE_STEADY_AFTER:
+            return "steady"
+        return "normal"
+
+    def note_incident(self, reason):
+        self.last_incident = self.backends.clock.monotonic()
+        self.update(reason)
+
+    def note_battery(self, percentage, status):
+        if status in ("CHARGING", "FULL"):
+            factor = 1.0
+        elif percentage <= BATTERY_CRITICAL_PERCENT:
+            factor = 4.0
+        elif percentage <= BATTERY_LOW_PERCENT:
+            factor = 2.0
+        else:
+            factor = 1.0
+        if factor != self.battery_factor:
+            self.battery_factor = factor
+            self.update(f"battery {percentage}% ({status})")
+
+    def update(self, reason):
+        main_logger = logging.getLogger(main_logger_name)
+        now = self.backends.clock.monotonic()
+        self.mode = self._mode(now)
+        factor = self.battery_factor
+        if self.mode == "incident":
+            factor *= RATE_INCIDENT_FACTOR
+        elif self.mode == "steady":
+            factor *= RATE_STEADY_FACTOR
+
+        timestamp = None
+        for name, base in self.base.items():
+            task = self.scheduler.tasks.get(name)
+            if task is None or task.stopped:
+                continue
+            low, high = self.limits[name]
+            interval = min(high, max(low, base * factor))
+            if interval == task.interval:
+                continue
+
+            timestamp = timestamp or self.backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            main_logger.info(f"[{timestamp}] Rate: {name} {task.interval:g} s -> {interval:g} s ({self.mode}, {reason})")
+            previous, task.interval = task.interval, interval
+            if interval < previous and task.next_run is not None and self.scheduler.loop is not None:
+                task.next_run = min(task.next_run, self.scheduler.loop.time() + interval)
+                self.scheduler.wakeup.set()
+
+    async def tick(self):
+        if self._mode(self.backends.clock.monotonic()) != self.mode:
+            self.update("mode change")
+
+rate_controller = None
+
+def report_incident(reason):
+    if rate_controller is not None:
+        rate_controller.note_incident(reason)
+
+INCIDENT_SIGNALS = {
+    "ping": (3, 3, 3),
+    "mobile_data": (3, 1, 1),
+    "dns": (2, 2, 2),
+    "web": (2, 2, 2),
+    "loss": (2, 1, 2),
+    "latency": (1, 2, 2),
+    "network_type": (1, 1, 1)
+}
+INCIDENT_THRESHOLDS = {
+    "loss": (50, 10),
+    "latency": (300, 150)
+}
+INCIDENT_SEVERITIES = ("info", "minor", "major", "outage")
+INCIDENT_MERGE_WINDOW = 60
+INCIDENT_CHECK_INTERVAL = 5
+INCIDENT_MAX_NOTES = 10
+INCIDENT_LOG_FILE = "incidents.jsonl"
+DEGRADED_NETWORK_TYPES = {"GPRS", "EDGE", "CDMA", "1XRTT", "IDEN"}
+
+class IncidentSignal:
+    __slots__ = ("name", "severity", "raise_after", "clear_after", "active", "streak", "changed_at")
+
+    def __init__(self, name, severity, raise_after, clear_after):
+        self.name = name
+        self.severity = severity
+        self.raise_after = raise_after
+        self.clear_after = clear_after
+        self.active = False
+        self.streak = 0
+        self.changed_at = None
+
+    def update(self, bad, now):
+        if bad == self.active:
+            self.streak = 0
+            return False
+        self.streak += 1
+        if self.streak == 1:
+            self.changed_at = now
+        if self.streak < (self.clear_after if self.active else self.raise_after):
+            return False
+        self.active, self.streak = bad, 0
+        return True
+
+class IncidentEngine:
+    def __init__(self, signals=INCIDENT_SIGNALS, thresholds=INCIDENT_THRESHOLDS, merge_window=INCIDENT_MERGE_WINDOW, clock=clock.time):
+        self.signals = {name: IncidentSignal(name, *config) for name, config in signals.items()}
+        self.thresholds = thresholds
+        self.merge_window = merge_window
+        self.clock = clock
+        self.log = None
+        self.current = None
+        self.next_id = 1
+        self.first_seen = None
+        self.count = 0
+        self.total_duration = 0.0
+        self.downtime = 0.0
+        self.longest = 0.0
+        self.severity_counts = [0] * len(INCIDENT_SEVERITIES)
+
+    def start(self, log=None):
+        self.log = log
+
+    def _stamp(self, moment):
+        return datetime.fromtimestamp(moment).strftime('%Y-%m-%d %H:%M:%S')
+
+    def _outage(self):
+        return any(signal.active and signal.severity >= 3 for signal in self.signals.values())
+
+    def observe(self, name, bad, now=None):
+        now = self.clock() if now is None else now
+        if self.first_seen is None:
+            self.first_seen = now
+        signal = self.signals[name]
+        was_outage = self._outage()
+        if not signal.update(bad, now):
+            return
+        if signal.active:
+            self._raise(signal, was_outage, now)
+        else:
+            self._clear(signal, was_outage)
+
+    def observe_value(self, name, value, now=None):
+        if value is None:
+            return
+        raise_at, clear_at = self.thresholds[name]
+        if value >= raise_at:
+            self.observe(name, True, now)
+        elif value <= clear_at:
+            self.observe(name, False, now)
+
+    def note(self, text, now=None):
+        now = self.clock() if now is None else now
+        if self.current is not None and len(self.current["notes"]) < INCIDENT_MAX_NOTES:
+            self.current["notes"].append(f"{self._stamp(now)} {text}")
+
+    def _raise(self, signal, was_outage, now):
+        main_logger = logging.getLogger(main_logger_name)
+        incident = self.current
+        opened = incident is None
+        resumed = not opened and incident["cleared_at"] is not None
+        if opened:
+            incident = self.current = {"id": self.next_id, "start": signal.changed_at, "cleared_at": None, "severity": 0, "signals": [], "notes": [], "downtime": 0.0, "outage_since": None}
+            self.next_id += 1
+            export_incidents.inc()
+        incident["cleared_at"] = None
+
+        report_incident(f"{signal.name} incident")
+        if signal.name not in incident["signals"]:
+            incident["signals"].append(signal.name)
+        escalated = signal.severity > incident["severity"]
+        incident["severity"] = max(incident["severity"], signal.severity)
+        if not was_outage and signal.severity >= 3:
+            incident["outage_since"] = signal.changed_at
+
+        timestamp = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        since = self._stamp(signal.changed_at)
+        severity = INCIDENT_SEVERITIES[incident["severity"]]
+        if opened:
+            print(f"{RED}[INCIDENT] [{timestamp}] #{incident['id']} started: {signal.name} ({severity}), since {since}{RESET}")
+            main_logger.warning(f"[{timestamp}] Incident #{incident['id']} started: {signal.name} ({severity}), since {since}")
+        elif resumed or escalated:
+            print(f"{RED}[INCIDENT] [{timestamp}] #{incident['id']} {'resumed' if resumed else 'escalated'}: {signal.name} ({severity}), since {since}{RESET}")
+            main_logger.warning(f"[{timestamp}] Incident #{incident['id']} {'resumed' if resumed else 'escalated'}: {signal.name} ({severity}), since {since}")
+        else:
+            main_logger.info(f"[{timestamp}] Incident #{incident['id']} also affects {signal.name}, since {since}")
+
+    def _clear(self, signal, was_outage):
+        incident = self.current
+        if incident is None:
+            return
+        if was_outage and not self._outage() and incident["outage_since"] is not None:
+            incident["downtime"] += signal.changed_at - incident["outage_since"]
+            incident["outage_since"] = None
+        if not any(other.active for other in self.signals.values()):
+            incident["cleared_at"] = signal.changed_at
+
+    def tick(self, now=None):
+        now = self.clock() if now is None else now
+        incident = self.current
+        if incident is not None and incident["cleared_at"] is not None and now - incident["cleared_at"] >= self.merge_window:
+            self._close(incident["cleared_at"], ongoing=False, now=now)
+
+    def _close(self, end, ongoing, now):
+        incident, self.current = self.current, None
+        if incident["outage_since"] is not None:
+            incident["downtime"] += end - incident["outage_since"]
+        duration = max(0.0, end - incident["start"])
+        self.count += 1
+        self.total_duration += duration
+        self.downtime += incident["downtime"]
+        self.longest = max(self.longest, duration)
+        self.severity_counts[incident["severity"]] += 1
+
+        severity = INCIDENT_SEVERITIES[incident["severity"]]
+        timestamp = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        span = f"from {self._stamp(incident['start'])} to {self._stamp(end)}"
+        print(f"{LIGHT_GREEN if not ongoing else YELLOW}[INCIDENT] [{timestamp}] #{incident['id']} {'ended' if not ongoing else 'still open'} after {duration:.0f} s: {', '.join(incident['signals'])} ({severity}), {span}{RESET}")
+        logging.getLogger(main_logger_name).warning(f"[{timestamp}] Incident #{incident['id']} {'ended' if not ongoing else 'still open'} after {duration:.1f} s: {', '.join(incident['signals'])} ({severity}), downtime {incident['downtime']:.1f} s, {span}")
+
+        if self.log is not None:
+            self.log.write({
+                "id": incident["id"],
+                "start": self._stamp(incident["start"]),
+                "end": self._stamp(end),
+                "duration_s": round(duration, 3),
+                "downtime_s": round(incident["downtime"], 3),
+                "severity": severity,
+                "signals": incident["signals"],
+                "notes": incident["notes"],
+                "ongoing": ongoing
+            })
+
+    def close(self, now=None):
+        now = self.clock() if now is None else now
+        if self.current is not None:
+            self._close(self.current["cleared_at"] or now, ongoing=self.current["cleared_at"] is None, now=now)
+
+    def stats(self, now=None):
+        now = self.clock() if now is None else now
+        observed = now - self.first_seen if self.first_seen is not None else 0.0
+        open_duration = now - self.current["start"] if self.current is not None else 0.0
+        healthy = max(0.0, observed - self.total_duration - open_duration)
+        return {
+            "incidents": self.count,
+            "observed_s": round(observed, 1),
+            "incident_s": round(self.total_duration, 1),
+            "downtime_s": round(self.downtime, 1),
+            "longest_s": round(self.longest, 1),
+            "mtbf_s": round(healthy / self.count, 1) if self.count else None,
+            "mttr_s": round(self.total_duration / self.count, 1) if self.count else None,
+            "availability_pct": round(100.0 * (1 - self.downtime / observed), 3) if observed > 0 else None,
+            **{severity: count for severity, count in zip(INCIDENT_SEVERITIES[1:], self.severity_counts[1:])}
+        }
+
+    async def check(self):
+        self.tick()
+
+incident_engine = IncidentEngine()
+
+class Backends:
+    def __init__(self, clock, prober, dns_engine, public_ip, run_command, link_state, local_addresses, probe_cache, metrics, incidents):
+        self.clock = clock
+        self.prober = prober
+        self.dns_engine = dns_engine
+        self.public_ip = public_ip
+        self.run_command = run_command
+        self.link_state = link_state
+        self.local_addresses = local_addresses
+        self.probe_cache = probe_cache
+        self.metrics = metrics
+        self.incidents = incidents
+
+def system_backends():
+    return Backends(clock, prober, dns_engine, public_ip_service, run_command_async, get_link_state, get_local_ip_addresses, probe_cache, metrics, incident_engine)
+
+OUTBOX_DIR = os.path.join(NTLS_HOME, "ntls_outbox")
+OUTBOX_STATE_FILE = "outbox.json"
+UPLOAD_COLLECTOR_URL = None
+UPLOAD_SENSITIVE = False
+UPLOAD_INTERVAL = 300
+UPLOAD_MIN_AGE = 60
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_TIMEOUT = 20
+UPLOAD_BACKOFF_BASE = 30
+UPLOAD_BACKOFF_MAX = 3600
+UPLOAD_MIN_SAMPLES = 10
+UPLOAD_MAX_LOSS = 5
+UPLOAD_MAX_RTT_MS = 300
+
+def compress_file(source, destination):
+    if zstandard is not None:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+        return "zstd"
+    with open(source, "rb") as src, gzip.open(destination, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+    return "gzip"
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def open_log_files():
+    paths = set()
+    for name in (main_logger_name, sensitive_logger_name):
+        for handler in logging.getLogger(name).handlers:
+            if isinstance(handler, logging.FileHandler):
+                paths.add(os.path.abspath(handler.baseFilename))
+    if structured_log is not None:
+        paths.add(os.path.abspath(structured_log.path))
+    for segments in (log_segments, sensitive_log_segments):
+        if segments is not None:
+            with segments.lock:
+                paths.update(os.path.abspath(path) for path in segments.open_paths)
+    return paths
+
+class Uploader:
+    def __init__(self, collector_url, directory=OUTBOX_DIR, sources=None, link_stats=None, timeout=UPLOAD_TIMEOUT):
+        self.collector_url = collector_url.rstrip("/")
+        self.directory = directory
+        self.sources = sources if sources is not None else [LOG_DIR] + ([SENSITIVE_LOG_DIR] if UPLOAD_SENSITIVE else [])
+        self.link_stats = link_stats
+        self.timeout = timeout
+        self.state_path = os.path.join(directory, OUTBOX_STATE_FILE)
+        self.lock = threading.Lock()
+        self.uploaded = 0
+        os.makedirs(directory, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault("staged", {})
+        state.setdefault("items", {})
+        for name in list(state["items"]):
+            if not os.path.exists(os.path.join(self.directory, name)):
+                del state["items"][name]
+        return state
+
+    def _save_state(self):
+        temporary = self.state_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(temporary, self.state_path)
+
+    def stage(self):
+        skip = open_log_files()
+        now = time.time()
+        staged = 0
+        for directory in self.sources:
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                match = LOG_SEGMENT_PATTERN.match(name)
+                source = name[:-3] if match and match.group(4) else name
+                if not match or source in self.state["staged"] or os.path.abspath(path) in skip:
+                    continue
+                try:
+                    info = os.stat(path)
+                    if now - info.st_mtime < UPLOAD_MIN_AGE:
+                        continue
+                    if match.group(4):
+                        item, encoding = name, "gzip"
+                        temporary = os.path.join(self.directory, item + ".tmp")
+                        shutil.copyfile(path, temporary)
+                    else:
+                        item = f"{name}.{'zst' if zstandard is not None else 'gz'}"
+                        temporary = os.path.join(self.directory, item + ".tmp")
+                        encoding = compress_file(path, temporary)
+                except OSError:
+                    continue
+
+                os.replace(temporary, os.path.join(self.directory, item))
+                self.state["items"][item] = {"id": file_sha256(os.path.join(self.directory, item)), "source": source, "encoding": encoding, "attempts": 0, "next_attempt": 0}
+                self.state["staged"][source] = {"size": info.st_size, "mtime": int(info.st_mtime)}
+                staged += 1
+        present = {name[:-3] if name.endswith(".gz") else name for directory in self.sources if os.path.isdir(directory) for name in os.listdir(directory)}
+        gone = [name for name in self.state["staged"] if name not in present]
+        for name in gone:
+            del self.state["staged"][name]
+        if staged or gone:
+            self._save_state()
+        return staged
+
+    def link_ready(self):
+        if rate_controller is not None and rate_controller.battery_factor > 1.0:
+            return False, "battery low"
+        if self.link_stats is None:
+            return True, None
+        stats = self.link_stats.snapshot()
+        if stats["samples"] < UPLOAD_MIN_SAMPLES:
+            return False, "not enough link samples"
+        if stats["loss"] > UPLOAD_MAX_LOSS:
+            return False, f"loss {stats['loss']:.1f}%"
+        if stats["p90"] is None or stats["p90"] > UPLOAD_MAX_RTT_MS:
+            return False, "latency too high"
+        return True, None
+
+    def _request(self, method, url, body=None, headers=None):
+        for _ in range(2):
+            key, conn, connect_time = http_pool.acquire(url, self.timeout)
+            try:
+                conn.request(method, request_path(url), body=body, headers=headers or {})
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if connect_time:
+                    raise
+                continue
+            if response.will_close:
+                conn.close()
+            else:
+                http_pool.release(key, conn)
+            return response
+        raise ConnectionError(f"Could not reach {url}")
+
+    def _upload_item(self, name, entry):
+        path = os.path.join(self.directory, name)
+        size = os.path.getsize(path)
+        url = f"{self.collector_url}/{entry['id']}"
+        response = self._request("HEAD", url)
+        if response.status == 404:
+            offset = 0
+        elif response.status == 200:
+            offset = int(response.getheader("X-NTLS-Offset", "0"))
+            if response.getheader("X-NTLS-Complete") == "1":
+                return
+        else:
+            raise http.client.HTTPException(f"HTTP {response.status} from {url}")
+
+        with open(path, "rb") as f:
+            while True:
+                f.seek(offset)
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                final = offset + len(chunk) >= size
+                headers = {
+                    "Content-Type": "application/octet-stream",
+                    "X-NTLS-Name": name,
+                    "X-NTLS-Source": entry["source"],
+                    "X-NTLS-Encoding": entry["encoding"],
+                    "X-NTLS-Offset": str(offset),
+                    "X-NTLS-Final": "1" if final else "0"
+                }
+                response = self._request("POST", url, chunk, headers)
+                if response.status == 409:
+                    offset = int(response.getheader("X-NTLS-Offset", "0"))
+                    continue
+                if response.status not in (200, 201):
+                    raise http.client.HTTPException(f"HTTP {response.status} from {url}")
+                offset = int(response.getheader("X-NTLS-Offset", str(offset + len(chunk))))
+                if final:
+                    return
+
+    def flush(self):
+        with self.lock:
+            now = time.time()
+            sent = failed = 0
+            backoff = None
+            for name, entry in sorted(self.state["items"].items()):
+                if entry["next_attempt"] > now:
+                    backoff = min(backoff or math.inf, entry["next_attempt"] - now)
+                    continue
+                try:
+                    self._upload_item(name, entry)
+                except (OSError, ValueError, http.client.HTTPException) as e:
+                    entry["attempts"] += 1
+                    delay = min(UPLOAD_BACKOFF_MAX, UPLOAD_BACKOFF_BASE * 2 ** (entry["attempts"] - 1)) * random.uniform(0.8, 1.2)
+                    entry["next_attempt"] = now + delay
+                    backoff = min(backoff or math.inf, delay)
+                    failed += 1
+                    logging.getLogger(main_logger_name).warning(f"Upload of {name} failed (attempt {entry['attempts']}): {e}. Retrying in {delay:.0f} s.")
+                    break
+                del self.state["items"][name]
+                os.remove(os.path.join(self.directory, name))
+                sent += 1
+                self.uploaded += 1
+            if sent or failed:
+                self._save_state()
+            return sent, failed, backoff
+
+    async def run(self):
+        main_logger = logging.getLogger(main_logger_name)
+        staged = await asyncio.to_thread(self.stage)
+        if not self.state["items"]:
+            return
+        ready, reason = self.link_ready()
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        if not ready:
+            main_logger.info(f"[{timestamp}] Upload deferred ({reason}), {len(self.state['items'])} item(s) in outbox.")
+            return
+
+        sent, failed, backoff = await asyncio.to_thread(self.flush)
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        if sent or failed or staged:
+            main_logger.info(f"[{timestamp}] Upload: {staged} staged, {sent} sent, {failed} failed, {len(self.state['items'])} pending.")
+        if failed and backoff is not None:
+            return backoff
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _upload_id(self):
+        upload_id = urlsplit(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+        return upload_id if re.fullmatch(r"[0-9a-f]{64}", upload_id) else None
+
+    def _reply(self, status, offset=None, complete=False):
+        self.send_response(status)
+        if offset is not None:
+            self.send_header("X-NTLS-Offset", str(offset))
+        if complete:
+            self.send_header("X-NTLS-Complete", "1")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _status(self, upload_id):
+        done = [name for name in os.listdir(self.server.directory) if name.startswith(upload_id + "-")]
+        if done:
+            return os.path.getsize(os.path.join(self.server.directory, done[0])), True
+        partial = os.path.join(self.server.directory, upload_id + ".part")
+        return (os.path.getsize(partial), False) if os.path.exists(partial) else (None, False)
+
+    def do_HEAD(self):
+        upload_id = self._upload_id()
+        if upload_id is None:
+            self._reply(400)
+            return
+        with self.server.lock:
+            offset, complete = self._status(upload_id)
+        if offset is None:
+            self._reply(404)
+        else:
+            self._reply(200, offset, complete)
+
+    def do_POST(self):
+        upload_id = self._upload_id()
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        if upload_id is None:
+            self._reply(400)
+            return
+        offset = int(self.headers.get("X-NTLS-Offset", "0"))
+        name = os.path.basename(self.headers.get("X-NTLS-Name", "upload"))
+        with self.server.lock:
+            current, complete = self._status(upload_id)
+            current = current or 0
+            if complete:
+                self._reply(200, current, True)
+                return
+            if offset != current:
+                self._reply(409, current)
+                return
+            partial = os.path.join(self.server.directory, upload_id + ".part")
+            with open(partial, "ab") as f:
+                f.write(body)
+            current += len(body)
+            if self.headers.get("X-NTLS-Final") == "1":
+                os.replace(partial, os.path.join(self.server.directory, f"{upload_id}-{name}"))
+                self.server.completed += 1
+        self._reply(201 if self.headers.get("X-NTLS-Final") == "1" else 200, current)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_local_collector(directory, host="127.0.0.1", port=0):
+    os.makedirs(directory, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), CollectorHandler)
+    server.daemon_threads = True
+    server.directory = directory
+    server.lock = threading.Lock()
+    server.completed = 0
+    threading.Thread(target=server.serve_forever, name="ntls-collector", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/upload"
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+NETLINK_GROUPS = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE
+NETLINK_MESSAGE_TYPES = {
+    16: "RTM_NEWLINK",
+    17: "RTM_DELLINK",
+    20: "RTM_NEWADDR",
+    21: "RTM_DELADDR",
+    24: "RTM_NEWROUTE",
+    25: "RTM_DELROUTE"
+}
+NETLINK_HEADER = struct.Struct("=LHHLL")
+NETLINK_DEBOUNCE = 0.5
+NETLINK_PUBLIC_IP_INTERVAL = 300
+NETLINK_LOCAL_IP_INTERVAL = 60
+
+def parse_netlink_messages(data):
+    events = []
+    offset = 0
+    while offset + NETLINK_HEADER.size <= len(data):
+        length, message_type, _, _, _ = NETLINK_HEADER.unpack_from(data, offset)
+        if length < NETLINK_HEADER.size:
+            break
+        name = NETLINK_MESSAGE_TYPES.get(message_type)
+        if name is not None:
+            events.append(name)
+        offset += (length + 3) & ~3
+    return events
+
+class NetlinkWatcher:
+    def __init__(self, on_change, debounce=NETLINK_DEBOUNCE):
+        self.on_change = on_change
+        self.debounce = debounce
+        self.sock = None
+        self.loop = None
+        self.pending = set()
+        self.flush_handle = None
+
+    def start(self, loop):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        except (AttributeError, OSError) as e:
+            logging.getLogger(main_logger_name).info(f"Netlink link-change events unavailable ({e}). Falling back to polling.")
+            return False
+        try:
+            sock.bind((0, NETLINK_GROUPS))
+            sock.setblocking(False)
+        except OSError as e:
+            sock.close()
+            logging.getLogger(main_logger_name).info(f"Netlink link-change events unavailable ({e}). Falling back to polling.")
+            return False
+
+        self.sock = sock
+        self.loop = loop
+        loop.add_reader(sock.fileno(), self._readable)
+        return True
+
+    def _readable(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                logging.getLogger(main_logger_name).warning(f"Netlink read failed: {e}")
+                break
+            self.pending.update(parse_netlink_messages(data))
+
+        if self.pending and self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.debounce, self._flush)
+
+    def _flush(self):
+        self.flush_handle = None
+        events, self.pending = self.pending, set()
+        if events:
+            self.on_change(sorted(events))
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+async def run_monitor(targets=None, duration=None, watch_links=True, max_failures=DNS_MAX_FAILURES, incident_log=None, backends=None, log_dir=None, public_ip=None):
+    backends = backends or system_backends()
+    incidents = backends.incidents
+    target_monitor = MultiTargetMonitor(targets, backends=backends) if targets else None
+    latency_monitor = LatencyMonitor(max_failures=max_failures, targets=target_monitor, backends=backends)
+    mobile_monitor = MobileInfoMonitor(backends=backends)
+    public_ip_watcher = PublicIPWatcher(current_public_ip if public_ip is None else public_ip, backends)
+    battery_monitor = BatteryMonitor(backends)
+    scheduler = Scheduler()
+
+    scheduler.add("dns_latency", latency_monitor.sample, PING_INTERVAL, deadline=15)
+    scheduler.add("dns_resolution", latency_monitor.resolve, DNS_RESOLUTION_INTERVAL, deadline=10, initial_delay=PING_INTERVAL)
+    scheduler.add("summary", latency_monitor.summary, SUMMARY_INTERVAL, deadline=10, initial_delay=SUMMARY_INTERVAL)
+    scheduler.add("public_ip", public_ip_watcher.check, PUBLIC_IP_CHECK_INTERVAL, deadline=10, initial_delay=PUBLIC_IP_CHECK_INTERVAL)
+    scheduler.add("mobile_info", mobile_monitor.refresh, MOBILE_INFO_INTERVAL, deadline=10)
+    scheduler.add("battery", battery_monitor.check, BATTERY_INTERVAL, deadline=10, jitter=1.0)
+    if target_monitor is not None:
+        scheduler.add("targets", target_monitor.tick, PING_INTERVAL, deadline=10)
+        scheduler.add("targets_summary", target_monitor.summary, TARGETS_SUMMARY_INTERVAL, initial_delay=TARGETS_SUMMARY_INTERVAL)
+
+    local_watcher = LocalAddressWatcher(backends)
+    scheduler.add("local_ip", local_watcher.check, LOCAL_IP_CHECK_INTERVAL)
+
+    link_state = backends.link_state()
+
+    def on_link_change(events):
+        nonlocal link_state
+        state = backends.link_state()
+        changed = [key for key, value in state.items() if value != link_state[key]]
+        link_state = state
+        if not changed:
+            return
+
+        timestamp = backends.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        print(f"{YELLOW}[{timestamp}] Link change: {', '.join(events)} ({', '.join(changed)} changed){RESET}")
+        logging.getLogger(main_logger_name).info(f"[{timestamp}] Link change: {', '.join(events)} ({', '.join(changed)} changed)")
+        latency_monitor.reevaluate("link change")
+        scheduler.trigger("dns_latency")
+        scheduler.trigger("local_ip")
+        scheduler.trigger("mobile_info")
+        request_public_ip_recheck("link change", backends)
+        incidents.note(f"link change: {', '.join(events)}")
+
+    netlink_watcher = NetlinkWatcher(on_link_change)
+    if watch_links and netlink_watcher.start(asyncio.get_running_loop()):
+        scheduler.tasks["public_ip"].interval = NETLINK_PUBLIC_IP_INTERVAL
+        scheduler.tasks["local_ip"].interval = NETLINK_LOCAL_IP_INTERVAL
+
+    global rate_controller, active_scheduler
+    active_scheduler = scheduler
+    rate_controller = RateController(scheduler, backends=backends)
+    scheduler.add("rate_control", rate_controller.tick, RATE_CONTROL_INTERVAL, initial_delay=RATE_CONTROL_INTERVAL)
+    if UPLOAD_COLLECTOR_URL:
+        uploader = Uploader(UPLOAD_COLLECTOR_URL, link_stats=latency_monitor.link_stats)
+        scheduler.add("upload", uploader.run, UPLOAD_INTERVAL, initial_delay=UPLOAD_MIN_AGE)
+    snapshot_log = None
+    if METRICS_SNAPSHOT_INTERVAL:
+        snapshot_log = open_json_log(METRICS_SNAPSHOT_FILE, log_dir)
+        scheduler.add("metrics_snapshot", lambda: write_metrics_snapshot(snapshot_log, backends.metrics, backends.clock), METRICS_SNAPSHOT_INTERVAL, initial_delay=METRICS_SNAPSHOT_INTERVAL)
+    incident_log = incident_log or open_json_log(INCIDENT_LOG_FILE, log_dir)
+    incidents.start(incident_log)
+    scheduler.add("incidents", incidents.check, INCIDENT_CHECK_INTERVAL, initial_delay=INCIDENT_CHECK_INTERVAL)
+    if duration is not None:
+        async def stop():
+            scheduler.stop()
+            return False
+        scheduler.add("stop", stop, duration, initial_delay=duration)
+
+    try:
+        await scheduler.run()
+    finally:
+        netlink_watcher.close()
+        await scheduler.shutdown()
+        incidents.close()
+        incident_log.close()
+        if snapshot_log is not None:
+            snapshot_log.close()
+        stats = incidents.stats()
+        logging.getLogger(main_logger_name).info(f"Incident summary: {json.dumps(stats)}")
+        rate_controller = None
+        active_scheduler = None
+
+def monitor_network(quality_mode=QUALITY_TEST_MODE, download_url=SPEEDTEST_DOWNLOAD_URL, upload_url=SPEEDTEST_UPLOAD_URL, targets=None, interactive=True):
+    setup_logger()
+    log_session_start(interactive)
+    main_logger = logging.getLogger(main_logger_name)
+
+    metrics_server = None
+    if METRICS_EXPORT_PORT is not None:
+        metrics_server, metrics_url = start_metrics_server(METRICS_EXPORT_HOST, METRICS_EXPORT_PORT)
+        print(f"{CYAN}Metrics endpoint: {metrics_url}{RESET}")
+        main_logger.info(f"Metrics endpoint: {metrics_url}")
+
+    if quality_mode != "none":
+        evaluate_network_quality(quality_mode, download_url, upload_url)
+
+    try:
+        asyncio.run(run_monitor(targets))
+
+    except KeyboardInterrupt:
+         print(f"\n{RED}Monitoring stopping...{RESET}")
+         main_logger.info("KeyboardInterrupt received. Stopping monitoring.")
+
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+
+ONCE_SAMPLES = 5
+ONCE_TIMEOUT = 2
+
+async def read_helper_json(command, timeout=ONCE_TIMEOUT + 1):
+    try:
+        _, stdout, _ = await run_helper(command, 0, timeout)
+        return json.loads(stdout.decode("utf-8"))
+    except (OSError, asyncio.TimeoutError, ValueError):
+        return None
+
+def round_optional(value, digits=3):
+    return round(value, digits) if value is not None else None
+
+def summarize_samples(answered, sent):
+    ordered = sorted(answered)
+    return {
+        "sent": sent,
+        "received": len(ordered),
+        "loss_pct": round((sent - len(ordered)) * 100.0 / sent, 1) if sent else None,
+        "p50_ms": round_optional(percentile(ordered, 50, presorted=True)),
+        "p90_ms": round_optional(percentile(ordered, 90, presorted=True)),
+        "max_ms": ordered[-1] if ordered else None
+    }
+
+async def quality_snapshot(samples=ONCE_SAMPLES, timeout=ONCE_TIMEOUT, download_url=None, public_ip=True):
+    started = time.perf_counter()
+    probes = asyncio.gather(*(asyncio.to_thread(probe_candidate, server, samples, timeout) for server in DNS_SERVERS), return_exceptions=True)
+    web = asyncio.gather(*(asyncio.to_thread(http_probe, target["address"], timeout) for target in WEB_TARGETS), return_exceptions=True)
+    lookups = [
+        probes,
+        web,
+        asyncio.to_thread(get_local_ip_addresses),
+        asyncio.to_thread(public_ip_service.lookup) if public_ip else asyncio.sleep(0, "N/A"),
+        read_helper_json(BATTERY_COMMAND),
+        read_helper_json(TELEPHONY_COMMAND)
+    ]
+    if download_url:
+        lookups.append(asyncio.to_thread(measure_download_throughput, download_url, timeout=timeout + 8))
+    results = await asyncio.gather(*lookups, return_exceptions=True)
+    probe_results, web_results, local_ips, public_address, battery, telephony = results[:6]
+
+    resolvers = []
+    for server, probe_result in zip(DNS_SERVERS, probe_results):
+        if isinstance(probe_result, Exception):
+            logging.getLogger(main_logger_name).warning(f"Probe failed for {server['ip']}: {probe_result}")
+            probe_result = [], []
+        latencies, resolutions = probe_result
+        resolvers.append({
+            "name": server["name"],
+            "ip": server["ip"],
+            "score": round_optional(score_resolver(latencies, resolutions, samples, len(DNS_QUERY_TYPES))),
+            "rtt": summarize_samples(latencies, samples),
+            "resolution": summarize_samples(resolutions, len(DNS_QUERY_TYPES))
+        })
+    ranked = sorted((resolver for resolver in resolvers if resolver["score"] is not None), key=lambda resolver: resolver["score"])
+
+    snapshot = {
+        "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "best_dns": ranked[0]["ip"] if ranked else None,
+        "resolvers": resolvers,
+        "web": [{"name": target["name"], "url": target["address"], "latency_ms": latency if not isinstance(latency, Exception) else None} for target, latency in zip(WEB_TARGETS, web_results)],
+        "local_ips": local_ips if isinstance(local_ips, list) else ["N/A"],
+        "public_ip": public_address if isinstance(public_address, str) else "N/A",
+        "battery": {"percentage": battery.get("percentage"), "status": battery.get("status")} if isinstance(battery, dict) else None,
+        "network": {"operator": telephony.get("network_operator_name"), "network_type": telephony.get("network_type", "").upper() or None, "data_enabled": telephony.get("data_enabled")} if isinstance(telephony, dict) else None
+    }
+    if download_url:
+        download = results[6]
+        snapshot["download_mbps"] = round(download["bytes_per_s"] * 8 / (1024 * 1024), 2) if isinstance(download, dict) else None
+    snapshot["elapsed_s"] = round(time.perf_counter() - started, 3)
+    return snapshot
+
+def run_once(args):
+    snapshot = asyncio.run(quality_snapshot(args.samples, args.timeout, args.download_url if args.download else None, not args.no_public_ip))
+    if args.json:
+        json.dump(snapshot, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0 if snapshot["best_dns"] else 1
+
+    for resolver in snapshot["resolvers"]:
+        rtt = resolver["rtt"]
+        resolution = resolver["resolution"]
+        color = LIGHT_GREEN if resolver["ip"] == snapshot["best_dns"] else (LIGHT_GRAY if resolver["score"] is not None else RED)
+        p50 = f"{rtt['p50_ms']:.1f} ms" if rtt["p50_ms"] is not None else "N/A"
+        lookup = f"{resolution['p50_ms']:.1f} ms" if resolution["p50_ms"] is not None else "N/A"
+        print(f"{color}{resolver['name']} ({resolver['ip']}): ping {p50}, loss {rtt['loss_pct']:.0f}%, lookup {lookup}{RESET}")
+    for target in snapshot["web"]:
+        latency = f"{target['latency_ms']:.1f} ms" if target["latency_ms"] is not None else "Failed"
+        print(f"{LIGHT_GREEN if target['latency_ms'] is not None else RED}Web {target['name']}: {latency}{RESET}")
+    if "download_mbps" in snapshot:
+        download = f"{snapshot['download_mbps']:.2f} Mbps" if snapshot["download_mbps"] is not None else "Failed"
+        print(f"{LIGHT_GREEN if snapshot['download_mbps'] is not None else RED}Download: {download}{RESET}")
+    if snapshot["network"]:
+        print(f"{CYAN}Operator: {snapshot['network']['operator']}, Network: {snapshot['network']['network_type']}{RESET}")
+    if snapshot["battery"]:
+        print(f"{CYAN}Battery: {snapshot['battery']['percentage']}% ({snapshot['battery']['status']}){RESET}")
+    print(f"{CYAN}Local IP(s): {', '.join(snapshot['local_ips'])}, Public IP: {snapshot['public_ip']} ({snapshot['elapsed_s']:.2f} s){RESET}")
+    return 0 if snapshot["best_dns"] else 1
+
+BENCH_DURATION = 1.0
+BENCH_MIN_OPS = 20
+BENCH_SCHEDULER_TASKS = 20
+BENCH_SCHEDULER_INTERVAL = 0.01
+BENCH_REGRESSION_THRESHOLD = 0.2
+BENCH_COMMAND_OUTPUTS = {
+    "termux-battery-status": b'{"health": "GOOD", "percentage": 64, "plugged": "UNPLUGGED", "status": "DISCHARGING", "temperature": 31.2}',
+    "termux-telephony-deviceinfo": b'{"data_enabled": "true", "network_operator_name": "Bench", "network_type": "lte", "sim_state": "ready"}',
+    "curl": b"HTTP/1.1 200 OK\r\n\r\n"
+}
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+async def stub_command_runner(command, timeout):
+    return 0, BENCH_COMMAND_OUTPUTS.get(os.path.basename(command[0]), b""), b""
+
+def bench_result(name, samples, elapsed, cpu):
+    ordered = sorted(samples)
+    return {
+        "name": name,
+        "ops": len(ordered),
+        "ops_per_s": round(len(ordered) / elapsed, 1) if elapsed > 0 else None,
+        "p50_us": round(percentile(ordered, 50, presorted=True), 2),
+        "p99_us": round(percentile(ordered, 99, presorted=True), 2),
+        "cpu_us_per_op": round(cpu * 1e6 / len(ordered), 2),
+        "rss_kb": current_rss_kb()
+    }
+
+def bench_run(name, func, duration=BENCH_DURATION):
+    samples = array("d")
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    until = started + duration
+    while True:
+        op_started = time.perf_counter()
+        func()
+        op_finished = time.perf_counter()
+        samples.append((op_finished - op_started) * 1e6)
+        if op_finished >= until and len(samples) >= BENCH_MIN_OPS:
+            break
+    return bench_result(name, samples, time.perf_counter() - started, time.process_time() - cpu_started)
+
+async def bench_run_async(name, func, duration=BENCH_DURATION):
+    samples = array("d")
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    until = started + duration
+    while True:
+        op_started = time.perf_counter()
+        await func()
+        op_finished = time.perf_counter()
+        samples.append((op_finished - op_started) * 1e6)
+        if op_finished >= until and len(samples) >= BENCH_MIN_OPS:
+            break
+    return bench_result(name, samples, time.perf_counter() - started, time.process_time() - cpu_started)
+
+async def bench_scheduler(duration=BENCH_DURATION, tasks=BENCH_SCHEDULER_TASKS, interval=BENCH_SCHEDULER_INTERVAL):
+    scheduler = Scheduler()
+    lags = array("d")
+
+    def make_tick(name):
+        async def tick():
+            lags.append(scheduler.tasks[name].lag * 1e6)
+        return tick
+
+    for index in range(tasks):
+        name = f"bench_{index}"
+        scheduler.add(name, make_tick(name), interval, jitter=interval)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    runner = asyncio.create_task(scheduler.run())
+    await asyncio.sleep(duration)
+    await scheduler.shutdown()
+    runner.cancel()
+    await asyncio.gather(runner, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    result = bench_result("scheduler_lag", lags, elapsed, time.process_time() - cpu_started)
+    result["wakeups_per_s"] = round(scheduler.wakeups / elapsed, 1)
+    return result
+
+@contextlib.contextmanager
+def bench_environment():
+    global prober, PROBE_UDP_PORT, run_command_async
+    servers, port = start_local_dns_server()
+    saved = prober, PROBE_UDP_PORT, run_command_async
+    prober, PROBE_UDP_PORT, run_command_async = Prober(methods=("udp",)), port, stub_command_runner
+    try:
+        yield "127.0.0.1", port
+    finally:
+        prober.close()
+        prober, PROBE_UDP_PORT, run_command_async = saved
+        for server in servers:
+            server.shutdown()
+            server.server_close()
 
-except KeyboardInterrupt:
-    print(f"\n{RED}Monitoring stopped by user (outer block){RESET}")
-    logging.getLogger(main_logger_name).info("Monitoring stopped by user (outer block).")
-    logging.getLogger(sensitive_logger_name).info("--- SESSION END ---")
+def run_benchmarks(duration=BENCH_DURATION, only=None):
+    real_command_runner = run_command_async
+    results = []
 
-finally:
+    def selected(name):
+        return not only or name in only
+
+    with tempfile.TemporaryDirectory(prefix="ntls-bench-") as workdir, bench_environment() as (target, port):
+        engine = DnsQueryEngine()
+        bench_logger = logging.getLogger("ntls_bench")
+        bench_logger.propagate = False
+        bench_logger.setLevel(logging.INFO)
+        handler = logging.FileHandler(os.path.join(workdir, "bench_logs.txt"))
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        bench_logger.addHandler(handler)
+        bench_log = StructuredLog(os.path.join(workdir, "bench_metrics.ntlsb"))
+        bench_log.start()
+
+        def text_log():
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            bench_logger.info(f"[{timestamp}] Ping to {target}: 12.345 ms")
+
+        sync_benches = [
+            ("ping_dns", lambda: ping_dns(target, timeout=1, max_age=0)),
+            ("ping_dns_cached", lambda: ping_dns(target, timeout=1)),
+            ("check_packet_loss", lambda: check_packet_loss(target, count=5, timeout=1, interval=0)),
+            ("dns_resolution_udp", lambda: engine.resolve(target, transport="udp", port=port, timeout=1)),
+            ("dns_resolution_tcp", lambda: engine.resolve(target, transport="tcp", port=port, timeout=1)),
+            ("text_log", text_log),
+            ("structured_log", lambda: bench_log.record("rtt", 12.345))
+        ]
+        async_benches = [
+            ("battery_helper", lambda: get_battery_status(max_age=0)),
+            ("web_connectivity", lambda: test_web_connectivity("http://bench.invalid", timeout=1)),
+            ("subprocess_spawn", lambda: real_command_runner(["true"], 5))
+        ]
+
+        try:
+            for name, func in sync_benches:
+                if selected(name):
+                    results.append(bench_run(name, func, duration))
+
+            async def run_async():
+                for name, func in async_benches:
+                    if not selected(name):
+                        continue
+                    try:
+                        results.append(await bench_run_async(name, func, duration))
+                    except FileNotFoundError:
+                        print(f"{YELLOW}Skipping {name}: command not found.{RESET}")
+                if selected("scheduler_lag"):
+                    results.append(await bench_scheduler(duration))
+
+            asyncio.run(run_async())
+
+        finally:
+            bench_log.close()
+            engine.close()
+            bench_logger.removeHandler(handler)
+            handler.close()
+
+    return results
+
+def compare_benchmarks(results, baseline, threshold=BENCH_REGRESSION_THRESHOLD):
+    previous = baseline.get("results", {})
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if not before or not before.get("ops_per_s") or not result["ops_per_s"]:
+            continue
+        change = result["ops_per_s"] / before["ops_per_s"] - 1
+        result["change"] = round(change * 100, 1)
+        if change < -threshold:
+            regressions.append(result["name"])
+    return regressions
+
+def run_bench(args):
+    only = set(args.only) if args.only else None
+    print(f"{CYAN}Running benchmarks ({args.duration:g} s each)...{RESET}")
+    results = run_benchmarks(args.duration, only)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_benchmarks(results, json.load(f))
+
+    print(f"{'benchmark':<20} {'ops/s':>12} {'p50 us':>10} {'p99 us':>10} {'cpu us/op':>10} {'rss KB':>8} {'change':>8}")
+    for result in results:
+        change = f"{result['change']:+.1f}%" if "change" in result else ""
+        color = RED if result["name"] in regressions else LIGHT_GREEN
+        print(f"{color}{result['name']:<20} {result['ops_per_s']:>12.1f} {result['p50_us']:>10.2f} {result['p99_us']:>10.2f} {result['cpu_us_per_op']:>10.2f} {result['rss_kb'] or 0:>8} {change:>8}{RESET}")
+        if "wakeups_per_s" in result:
+            print(f"{'':<20} {result['wakeups_per_s']:>12.1f} wakeups/s (p50/p99 are scheduling lag)")
+
+    if args.save:
+        report = {
+            "created": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "duration": args.duration,
+            "results": {result["name"]: result for result in results}
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"{CYAN}Baseline saved to {args.save}{RESET}")
+
+    if regressions:
+        print(f"{RED}Regressions over {BENCH_REGRESSION_THRESHOLD:.0%}: {', '.join(regressions)}{RESET}")
+        return 1
+    return 0
+
+ANALYZE_OUTAGE_MIN_FAILURES = 3
+
+LOG_HOUR_PATTERN = re.compile(rb"^\[(\d{4}-\d\d-\d\d \d\d):", re.M)
+LOG_CONTEXT_PATTERN = re.compile(rb"^\[[^\]\n]+\] Operator: ([^,\n]*), Network: ([^,\n]*),", re.M)
+LOG_PING_PATTERN = re.compile(rb"\] Ping to \S+: ([\d.]+) ms$", re.M)
+LOG_FAILED_PATTERN = re.compile(rb"^\[([^\]\n]+)\] Ping to \S+: Failed$", re.M)
+LOG_SUCCESS_PATTERN = re.compile(rb"^\[([^\]\n]+)\] Ping to \S+: [\d.]+ ms$", re.M)
+LOG_DOWNLOAD_PATTERN = re.compile(rb"\] Download speedtest: [\d.]+ MB/s \(([\d.]+) Mbps\)")
+LOG_BATTERY_PATTERN = re.compile(rb"^\[[^\]\n]+\] Battery: (\d+)% \(([^)\n]*)\)$", re.M)
+
+def parse_time_bound(value, end=False):
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            moment = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if end and fmt == "%Y-%m-%d":
+            moment += timedelta(days=1)
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+    raise argparse.ArgumentTypeError(f"invalid time '{value}', expected YYYY-MM-DD[ HH:MM[:SS]]")
+
+def segment_span(directory, name, match, index):
+    entry = index.get(name) or {}
+    start = entry.get("start") or datetime.strptime(match.group(2), '%Y-%m-%d_%H-%M-%S').strftime('%Y-%m-%d %H:%M:%S')
+    end = entry.get("end")
+    if end is None and name in index:
+        end = "9999-12-31 23:59:59"
+    elif end is None:
+        end = datetime.fromtimestamp(os.path.getmtime(os.path.join(directory, name))).strftime('%Y-%m-%d %H:%M:%S')
+    return start, end
+
+def find_log_files(paths, since=None, until=None):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            index = load_segment_index(path)
+            segments = []
+            for name in sorted(os.listdir(path)):
+                match = LOG_SEGMENT_PATTERN.match(name)
+                if not match or match.group(1) == "sens_network_logs" or match.group(3) == "jsonl":
+                    continue
+                start, end = segment_span(path, name, match, index)
+                if since and end < since:
+                    continue
+                if until and start >= until:
+                    continue
+                segments.append((name, match.group(3), start, end))
+
+            structured = [(start, end) for _, kind, start, end in segments if kind == "ntlsb"]
+            for name, kind, start, end in segments:
+                if kind == "txt" and any(other_start == start or (other_start < end and start < other_end) for other_start, other_end in structured):
+                    continue
+                files.append(os.path.join(path, name))
+        elif os.path.exists(path):
+            files.append(path)
+    return files
+
+def parse_log_stamp(stamp):
+    if isinstance(stamp, int):
+        return datetime.fromtimestamp(stamp / 1e9)
+    stamp = stamp.decode("ascii")
+    return datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S.%f" if "." in stamp else "%Y-%m-%d %H:%M:%S")
+
+class LogAnalysis:
+    def __init__(self, outage_min_failures=ANALYZE_OUTAGE_MIN_FAILURES):
+        self.outage_min_failures = outage_min_failures
+        self.cells = {}
+        self.outages = []
+        self.files = 0
+        self.bytes = 0
+
+    def _cell(self, hour, context):
+        cell = self.cells.get((hour, context))
+        if cell is None:
+            cell = self.cells[(hour, context)] = {"rtt": array("d"), "lost": 0, "download": array("d")}
+        return cell
+
+    def add_outage(self, start, end, failures, ongoing=False):
+        if failures < self.outage_min_failures:
+            return
+        start, end = parse_log_stamp(start), parse_log_stamp(end)
+        self.outages.append({
+            "start": start.strftime('%Y-%m-%d %H:%M:%S'),
+            "end": end.strftime('%Y-%m-%d %H:%M:%S'),
+            "duration_s": round((end - start).total_seconds(), 3),
+            "failures": failures,
+            "ongoing": ongoing
+        })
+
+    def _hour_segments(self, data, start, end):
+        position = start
+        while position < end:
+            match = LOG_HOUR_PATTERN.search(data, position, end)
+            if match is None:
+                return
+            hour = match.group(1)
+            low, high = match.end(), end
+            while low < high:
+                mid = (low + high) // 2
+                probe = LOG_HOUR_PATTERN.search(data, mid, end)
+                if probe is None or probe.group(1) > hour:
+                    high = mid
+                else:
+                    low = mid + 1
+            probe = LOG_HOUR_PATTERN.search(data, low, end)
+            segment_end = probe.start() if probe else end
+            # Lines stamped before an await can land in a later hour; split the segment at them.
+            foreign = re.compile(rb"\n\[(?!" + re.escape(hour) + rb")\d{4}-").search(data, position, segment_end - 1)
+            if foreign:
+                segment_end = foreign.start() + 1
+            yield hour.decode("ascii"), position, segment_end
+            position = segment_end
+
+    def _failed_pings(self, data, size):
+        position = data.find(b": Failed\n")
+        while position != -1:
+            line_start = data.rfind(b"\n", 0, position) + 1
+            match = LOG_FAILED_PATTERN.match(data, line_start, size)
+            if match:
+                yield match
+            position = data.find(b": Failed\n", position + 1)
+
+    def add_text_log(self, path):
+        with map_segment(path) as data:
+            size = len(data)
+            if size:
+                self.files += 1
+                self.bytes += size
+                context = ("Unknown", "Unknown")
+
+                for hour, start, end in self._hour_segments(data, 0, size):
+                    boundaries = [(start, context)]
+                    position = data.find(b"] Operator: ", start, end)
+                    while position != -1:
+                        line_start = data.rfind(b"\n", 0, position) + 1
+                        match = LOG_CONTEXT_PATTERN.match(data, line_start, end)
+                        if match:
+                            context = (match.group(1).decode("utf-8", "replace"), match.group(2).decode("utf-8", "replace"))
+                            boundaries.append((line_start, context))
+                        position = data.find(b"] Operator: ", position + 1, end)
+                    boundaries.append((end, context))
+
+                    for (chunk_start, chunk_context), (chunk_end, _) in zip(boundaries, boundaries[1:]):
+                        chunk = data[chunk_start:chunk_end]
+                        latencies = array("d", map(float, LOG_PING_PATTERN.findall(chunk)))
+                        downloads = array("d", map(float, LOG_DOWNLOAD_PATTERN.findall(chunk)))
+                        lost = chunk.count(b": Failed\n")
+                        if not (latencies or downloads or lost):
+                            continue
+                        cell = self._cell(hour, chunk_context)
+                        cell["rtt"].extend(latencies)
+                        cell["download"].extend(downloads)
+                        cell["lost"] += lost
+
+                run_start, run_last, run_end, run_failures, run_until = None, None, None, 0, -1
+                for failure in self._failed_pings(data, size):
+                    if failure.start() > run_until:
+                        if run_failures:
+                            self.add_outage(run_start, run_end or run_last, run_failures, run_end is None)
+                        success = LOG_SUCCESS_PATTERN.search(data, failure.end())
+                        run_start, run_failures = failure.group(1), 0
+                        run_until = success.start() if success else size
+                        run_end = success.group(1) if success else None
+                    run_failures += 1
+                    run_last = failure.group(1)
+                if run_failures:
+                    self.add_outage(run_start, run_end or run_last, run_failures, run_end is None)
+
+    def add_structured_log(self, path):
+        self.files += 1
+        self.bytes += os.path.getsize(path)
+        hour_start, hour_end, hour = 0, 0, None
+        run_start, run_last, run_failures = None, None, 0
+        rtt_id, download_id = METRIC_IDS["rtt"], METRIC_IDS["download"]
+
+        for metric_id, context, times, values in read_sample_blocks(path):
+            if metric_id != rtt_id and metric_id != download_id:
+                continue
+            context = (context.get("operator", "Unknown"), context.get("network_type", "Unknown"))
+            position, count = 0, len(times)
+            while position < count:
+                if not hour_start <= times[position] < hour_end:
+                    moment = datetime.fromtimestamp(times[position] / 1e9).replace(minute=0, second=0, microsecond=0)
+                    hour = moment.strftime('%Y-%m-%d %H')
+                    hour_start = int(moment.timestamp() * 1e9)
+                    hour_end = hour_start + 3600 * 10**9
+                stop = count if times[-1] < hour_end else bisect_left(times, hour_end, position)
+                cell = self._cell(hour, context)
+                if position or stop < count:
+                    block_times, block_values = times[position:stop], values[position:stop]
+                else:
+                    block_times, block_values = times, values
+                position = stop
+
+                if metric_id == download_id:
+                    cell["download"].extend(value for value in block_values if value == value)
+                    continue
+                total = sum(block_values)
+                if total == total:
+                    cell["rtt"].extend(block_values)
+                    if run_failures:
+                        self.add_outage(run_start, block_times[0], run_failures)
+                        run_failures = 0
+                    continue
+                lost = [index for index, value in enumerate(block_values) if value != value]
+                cell["lost"] += len(lost)
+                previous = -1
+                for index in lost:
+                    if index > previous + 1:
+                        cell["rtt"].extend(block_values[previous + 1:index])
+                        if run_failures:
+                            self.add_outage(run_start, block_times[previous + 1], run_failures)
+                            run_failures = 0
+                    if not run_failures:
+                        run_start = block_times[index]
+                    run_failures += 1
+                    previous = index
+                run_last = block_times[previous]
+                if previous + 1 < len(block_times):
+                    cell["rtt"].extend(block_values[previous + 1:])
+                    self.add_outage(run_start, block_times[previous + 1], run_failures)
+                    run_failures = 0
+
+        if run_failures:
+            self.add_outage(run_start, run_last, run_failures, True)
+
+    def add(self, path):
+        if path.endswith((".ntlsb", ".ntlsb.gz")):
+            self.add_structured_log(path)
+        else:
+            self.add_text_log(path)
+
+    def _summarize(self, cells):
+        if len(cells) == 1:
+            latencies, downloads = cells[0]["rtt"], cells[0]["download"]
+        else:
+            latencies, downloads = [], []
+            for cell in cells:
+                latencies.extend(cell["rtt"])
+                downloads.extend(cell["download"])
+            latencies.sort()
+            downloads.sort()
+        lost = sum(cell["lost"] for cell in cells)
+        samples = len(latencies) + lost
+        return {
+            "samples": samples,
+            "lost": lost,
+            "loss_pct": round(lost * 100.0 / samples, 2) if samples else None,
+            "rtt_mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "rtt_p50": percentile(latencies, 50, presorted=True),
+            "rtt_p90": percentile(latencies, 90, presorted=True),
+            "rtt_p99": percentile(latencies, 99, presorted=True),
+            "downloads": len(downloads),
+            "download_p10_mbps": percentile(downloads, 10, presorted=True),
+            "download_p50_mbps": percentile(downloads, 50, presorted=True),
+            "download_p90_mbps": percentile(downloads, 90, presorted=True)
+        }
+
+    def results(self):
+        hours, networks = {}, {}
+        for (hour, context), cell in self.cells.items():
+            cell["rtt"], cell["download"] = sorted(cell["rtt"]), sorted(cell["download"])
+            hours.setdefault(hour, []).append(cell)
+            networks.setdefault(context, []).append(cell)
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "hours": {hour: self._summarize(cells) for hour, cells in sorted(hours.items())},
+            "networks": {f"{operator} / {network_type}": self._summarize(cells) for (operator, network_type), cells in sorted(networks.items())},
+            "outages": sorted(self.outages, key=lambda outage: outage["start"]),
+            "downtime_s": round(sum(outage["duration_s"] for outage in self.outages), 3)
+        }
+
+def export_analysis_csv(results, output):
+    fields = ["group_type", "group", "samples", "lost", "loss_pct", "rtt_mean", "rtt_p50", "rtt_p90", "rtt_p99", "downloads", "download_p10_mbps", "download_p50_mbps", "download_p90_mbps"]
+    writer = csv.DictWriter(output, fieldnames=fields)
+    writer.writeheader()
+    for group_type in ("hours", "networks"):
+        for group, summary in results[group_type].items():
+            writer.writerow({"group_type": group_type[:-1], "group": group, **summary})
+
+def open_output(path):
+    return contextlib.nullcontext(sys.stdout) if path == "-" else open(path, "w", newline="")
+
+def analyze_logs(args):
+    report = sys.stderr if "-" in (args.csv, args.json) else sys.stdout
+    files = find_log_files(args.paths, args.since, args.until)
+    if not files:
+        print(f"{RED}No log files found in {', '.join(args.paths)}{RESET}", file=report)
+        return 1
+
+    analysis = LogAnalysis(outage_min_failures=args.outage_min_failures)
+    started = time.perf_counter()
+    for path in files:
+        try:
+            analysis.add(path)
+        except (OSError, ValueError) as e:
+            print(f"{RED}Skipping {path}: {e}{RESET}", file=report)
+    elapsed = time.perf_counter() - started
+    results = analysis.results()
+
+    print(f"{CYAN}Analyzed {results['files']} file(s), {results['bytes'] / (1024 * 1024):.1f} MB in {elapsed:.2f} s{RESET}", file=report)
+    for group_type in ("hours", "networks"):
+        for group, summary in results[group_type].items():
+            p50 = f"{summary['rtt_p50']:.1f} ms" if summary["rtt_p50"] is not None else "N/A"
+            p90 = f"{summary['rtt_p90']:.1f} ms" if summary["rtt_p90"] is not None else "N/A"
+            loss = f"{summary['loss_pct']:.1f}%" if summary["loss_pct"] is not None else "N/A"
+            print(f"{LIGHT_GRAY}{group}: p50 {p50}, p90 {p90}, loss {loss}, samples {summary['samples']}, downloads {summary['downloads']}{RESET}", file=report)
+    print(f"{YELLOW}Outages: {len(results['outages'])}, total downtime {results['downtime_s']:.0f} s{RESET}", file=report)
+
+    if args.csv:
+        with open_output(args.csv) as output:
+            export_analysis_csv(results, output)
+    if args.json:
+        with open_output(args.json) as output:
+            json.dump(results, output, indent=2)
+    return 0
+
+REPLAY_DIR = os.path.join(NTLS_HOME, "ntls_replay")
+VIRTUAL_CLOCK_RESOLUTION = 1e-6
+REPLAY_LOG_FILE = "replay_log.txt"
+REPLAY_METRIC_FIELDS = {"rtt": "rtt", "dns_resolution": "dns", "battery": "battery"}
+REPLAY_PUBLIC_IP = "192.0.2.1"
+REPLAY_LOCAL_IP = "10.0.0.2"
+REPLAY_INTERFACE = "rmnet_data0"
+REPLAY_SYNTHETIC_STEP = 1.0
+REPLAY_SYNTHETIC_START = datetime(2024, 1, 1).timestamp()
+REPLAY_SYNTHETIC_OUTAGE_EVERY = 6 * 3600
+REPLAY_SYNTHETIC_OUTAGE_LENGTH = 120
+REPLAY_SYNTHETIC_DOWNGRADE_EVERY = 4 * 3600
+REPLAY_SYNTHETIC_DOWNGRADE_LENGTH = 600
+REPLAY_SYNTHETIC_RESOLVER_FAILURE_EVERY = 12 * 3600
+REPLAY_SYNTHETIC_RESOLVER_FAILURE_LENGTH = 900
+
+class Trace:
+    def __init__(self):
+        self.times = {}
+        self.values = {}
+        self.unordered = set()
+        self.start = None
+        self.end = None
+
+    def add(self, t, field, value):
+        times = self.times.get(field)
+        if times is None:
+            times = self.times[field] = array("d")
+            numeric = value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+            self.values[field] = array("d") if numeric else []
+        if times and t < times[-1]:
+            self.unordered.add(field)
+        times.append(t)
+        values = self.values[field]
+        values.append(math.nan if value is None and isinstance(values, array) else value)
+        self.start = t if self.start is None else min(self.start, t)
+        self.end = t if self.end is None else max(self.end, t)
+
+    def finish(self):
+        for field in self.unordered:
+            order = sorted(range(len(self.times[field])), key=self.times[field].__getitem__)
+            values = self.values[field]
+            self.times[field] = array("d", (self.times[field][index] for index in order))
+            self.values[field] = array("d", (values[index] for index in order)) if isinstance(values, array) else [values[index] for index in order]
+        self.unordered.clear()
+        return self
+
+    def has(self, field):
+        return field in self.times
+
+    def value(self, field, t, default=None):
+        times = self.times.get(field)
+        if not times:
+            return default
+        index = bisect_right(times, t) - 1
+        if index < 0:
+            return default
+        value = self.values[field][index]
+        return None if isinstance(value, float) and math.isnan(value) else value
+
+    def samples(self):
+        return sum(len(times) for times in self.times.values())
+
+def load_trace_file(path):
+    trace = Trace()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            t = event.pop("t")
+            for field, value in event.items():
+                trace.add(t, field, value)
+    return trace.finish()
+
+def read_text_log(path):
+    minutes = {}
+    with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+        for line in f:
+            if not line.startswith(b"[") or b"] " not in line:
+                continue
+            stamp, text = line[1:].split(b"] ", 1)
+            if text.startswith(b"Ping to "):
+                failed = LOG_FAILED_PATTERN.match(line)
+                success = None if failed else LOG_PING_PATTERN.search(line)
+                if not (failed or success):
+                    continue
+                values = [("rtt", None if failed else float(success.group(1)))]
+            elif text.startswith(b"Operator: "):
+                match = LOG_CONTEXT_PATTERN.match(line)
+                if not match:
+                    continue
+                values = [("operator", match.group(1).decode("utf-8", "replace")), ("network_type", match.group(2).decode("utf-8", "replace"))]
+            elif text.startswith(b"Battery: "):
+                match = LOG_BATTERY_PATTERN.match(line)
+                if not match:
+                    continue
+                values = [("battery", int(match.group(1))), ("battery_status", match.group(2).decode("utf-8", "replace"))]
+            else:
+                continue
+
+            minute = minutes.get(stamp[:16])
+            try:
+                if minute is None:
+                    minute = minutes[stamp[:16]] = parse_log_stamp(stamp[:16] + b":00").timestamp()
+                t = minute + float(stamp[17:])
+            except ValueError:
+                continue
+            for field, value in values:
+                yield t, field, value
+
+def load_recorded_trace(paths, since=None, until=None):
+    trace = Trace()
+    since_t = datetime.strptime(since, '%Y-%m-%d %H:%M:%S').timestamp() if since else None
+    until_t = datetime.strptime(until, '%Y-%m-%d %H:%M:%S').timestamp() if until else None
+    context = None
+    for path in find_log_files(paths, since, until):
+        if path.endswith((".txt", ".txt.gz")):
+            for t, field, value in read_text_log(path):
+                if (since_t and t < since_t) or (until_t and t >= until_t):
+                    continue
+                trace.add(t, field, value)
+            continue
+        if not path.endswith((".ntlsb", ".ntlsb.gz")):
+            continue
+        for ts_ns, name, value, sample_context in read_structured_log(path):
+            t = ts_ns / 1e9
+            field = REPLAY_METRIC_FIELDS.get(name)
+            if field is None or (since_t and t < since_t) or (until_t and t >= until_t):
+                continue
+            if sample_context is not context:
+                context = sample_context
+                trace.add(t, "operator", context.get("operator", "Unknown"))
+                trace.add(t, "network_type", context.get("network_type", "Unknown"))
+            if math.isnan(value) and field != "rtt":
+                continue
+            trace.add(t, field, None if math.isnan(value) else round(value, 3))
+    return trace.finish()
+
+def synthetic_trace(duration, seed=None, start=REPLAY_SYNTHETIC_START, step=REPLAY_SYNTHETIC_STEP):
+    rng = random.Random(seed)
+    trace = Trace()
+    resolvers = [server["ip"] for server in DNS_SERVERS + EMERGENCY_DNS]
+    for ip in resolvers:
+        trace.add(start, f"offset:{ip}", round(rng.uniform(0, 40), 1))
+    trace.add(start, "operator", "Synthetic")
+    trace.add(start, "network_type", "LTE")
+    trace.add(start, "data_enabled", True)
+    trace.add(start, "public_ip", REPLAY_PUBLIC_IP)
+    trace.add(start, "local_ip", REPLAY_LOCAL_IP)
+
+    def schedule(every):
+        return start + rng.expovariate(1 / every)
+
+    end = start + duration
+    next_outage = schedule(REPLAY_SYNTHETIC_OUTAGE_EVERY)
+    next_downgrade = schedule(REPLAY_SYNTHETIC_DOWNGRADE_EVERY)
+    next_resolver_failure = schedule(REPLAY_SYNTHETIC_RESOLVER_FAILURE_EVERY)
+    outage_until = downgrade_until = resolver_until = 0.0
+    failed_resolver = None
+    battery, charging = 100.0, False
+    public_ips = 0
+    t = start
+    while t < end:
+        if t >= next_outage:
+            outage_until = t + rng.expovariate(1 / REPLAY_SYNTHETIC_OUTAGE_LENGTH)
+            next_outage = outage_until + rng.expovariate(1 / REPLAY_SYNTHETIC_OUTAGE_EVERY)
+            public_ips += 1
+            trace.add(outage_until, "public_ip", f"203.0.113.{public_ips % 254 + 1}")
+            trace.add(outage_until, "local_ip", f"10.0.{public_ips % 254}.2")
+        if t >= next_downgrade:
+            downgrade_until = t + rng.expovariate(1 / REPLAY_SYNTHETIC_DOWNGRADE_LENGTH)
+            next_downgrade = downgrade_until + rng.expovariate(1 / REPLAY_SYNTHETIC_DOWNGRADE_EVERY)
+            trace.add(t, "network_type", "EDGE")
+            trace.add(downgrade_until, "network_type", "LTE")
+        if t >= next_resolver_failure:
+            failed_resolver = rng.choice(resolvers)
+            resolver_until = t + rng.expovariate(1 / REPLAY_SYNTHETIC_RESOLVER_FAILURE_LENGTH)
+            next_resolver_failure = resolver_until + rng.expovariate(1 / REPLAY_SYNTHETIC_RESOLVER_FAILURE_EVERY)
+            restore = trace.value(f"offset:{failed_resolver}", t)
+            trace.add(t, f"offset:{failed_resolver}", None)
+            trace.add(resolver_until, f"offset:{failed_resolver}", restore)
+
+        if t < outage_until:
+            rtt = None
+        elif t < downgrade_until:
+            rtt = None if rng.random() < 0.3 else round(rng.lognormvariate(math.log(250), 0.4), 1)
+        else:
+            rtt = None if rng.random() < 0.005 else round(rng.lognormvariate(math.log(40), 0.3), 1)
+        trace.add(t, "rtt", rtt)
+
+        if int(t - start) % 60 == 0:
+            battery += 1.0 if charging else -0.1
+            if battery <= 20:
+                charging = True
+            elif battery >= 100:
+                battery, charging = 100.0, False
+            trace.add(t, "battery", round(battery))
+            trace.add(t, "battery_status", "CHARGING" if charging else "DISCHARGING")
+        t += step
+    return trace.finish()
+
+class TraceBackend:
+    def __init__(self, trace, clock):
+        self.trace = trace
+        self.clock = clock
+
+    def _rtt(self, host):
+        t = self.clock.time()
+        rtt = self.trace.value("rtt", t)
+        if rtt is None:
+            return None
+        if self.trace.has(f"offset:{host}"):
+            offset = self.trace.value(f"offset:{host}", t)
+            return None if offset is None else round(rtt + offset, 3)
+        return rtt
+
+    def probe(self, target, count=1, timeout=2, interval=0, method=None, port=None):
+        return [self._rtt(target)] * count
+
+    def resolve(self, server, transport=None, name=DNS_QUERY_NAME, qtypes=DNS_QUERY_TYPES, cache_busting=None, timeout=None, port=DNS_QUERY_PORT):
+        latency = self.trace.value("dns", self.clock.time()) if self.trace.has("dns") else self._rtt(server)
+        return [latency] * len(qtypes)
+
+    def local_addresses(self):
+        return [self.trace.value("local_ip", self.clock.time(), REPLAY_LOCAL_IP)]
+
+    def link_state(self):
+        up = str(self.trace.value("data_enabled", self.clock.time(), True)).lower() != "false"
+        return {"addresses": self.local_addresses(), "routes": [(REPLAY_INTERFACE, "00000000")] if up else [], "interfaces": {REPLAY_INTERFACE: "up" if up else "down"}}
+
+    def invalidate(self):
+        pass
+
+    def lookup(self, max_age=None):
+        if self.trace.value("rtt", self.clock.time()) is None:
+            return "N/A"
+        return self.trace.value("public_ip", self.clock.time(), REPLAY_PUBLIC_IP)
+
+    async def run_command(self, command, timeout):
+        t = self.clock.time()
+        name = os.path.basename(command[0])
+        if name == "curl":
+            web = self.trace.value("web", t)
+            return (0 if (web if web is not None else self.trace.value("rtt", t) is not None) else 7), b"", b""
+        if name == "termux-battery-status" and self.trace.has("battery"):
+            info = {"percentage": self.trace.value("battery", t), "status": self.trace.value("battery_status", t, "DISCHARGING")}
+        elif name == "termux-telephony-deviceinfo" and self.trace.has("network_type"):
+            data_enabled = self.trace.value("data_enabled", t, True)
+            info = {"network_operator_name": self.trace.value("operator", t, "Unknown"), "network_type": self.trace.value("network_type", t, "Unknown").lower(), "data_enabled": str(data_enabled).lower(), "sim_state": "ready"}
+        else:
+            raise FileNotFoundError(command[0])
+        return 0, json.dumps(info).encode("utf-8"), b""
+
+    def close(self):
+        pass
+
+class VirtualSelector:
+    def __init__(self, selector, virtual_clock):
+        self.selector = selector
+        self.virtual_clock = virtual_clock
+
+    def select(self, timeout=None):
+        events = self.selector.select(None if timeout is None else 0)
+        if not events and timeout:
+            self.virtual_clock.advance(timeout)
+        return events
+
+    def __getattr__(self, name):
+        return getattr(self.selector, name)
+
+class SimulatedEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, virtual_clock):
+        self.virtual_clock = virtual_clock
+        super().__init__(VirtualSelector(selectors.DefaultSelector(), virtual_clock))
+        self._clock_resolution = VIRTUAL_CLOCK_RESOLUTION
+
+    def time(self):
+        return self.virtual_clock.monotonic()
+
+    def run_in_executor(self, executor, func, *args):
+        future = self.create_future()
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+@contextlib.contextmanager
+def replay_environment(trace, virtual_clock, directory=REPLAY_DIR, merge_window=INCIDENT_MERGE_WINDOW, verbose=False):
+    os.makedirs(directory, exist_ok=True)
+    for name in (INCIDENT_LOG_FILE, METRICS_SNAPSHOT_FILE):
+        if os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+
+    backend = TraceBackend(trace, virtual_clock)
+    backends = Backends(
+        clock=virtual_clock,
+        prober=backend,
+        dns_engine=backend,
+        public_ip=backend,
+        run_command=backend.run_command,
+        link_state=backend.link_state,
+        local_addresses=backend.local_addresses,
+        probe_cache=ProbeCache(clock=virtual_clock),
+        metrics=MetricsStore(("rtt", "loss", "battery"), clock=virtual_clock),
+        incidents=IncidentEngine(merge_window=merge_window, clock=virtual_clock.time)
+    )
+
+    main_logger = logging.getLogger(main_logger_name)
+    sensitive_logger = logging.getLogger(sensitive_logger_name)
+    main_handler = logging.FileHandler(os.path.join(directory, REPLAY_LOG_FILE), mode="w", encoding="utf-8")
+    main_handler.setFormatter(logging.Formatter("%(message)s"))
+    sensitive_handler = logging.NullHandler()
+    level = main_logger.level
+    main_logger.setLevel(logging.INFO)
+    main_logger.addHandler(main_handler)
+    sensitive_logger.addHandler(sensitive_handler)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if verbose else devnull):
+            yield backends
+    finally:
+        main_logger.removeHandler(main_handler)
+        main_handler.close()
+        main_logger.setLevel(level)
+        sensitive_logger.removeHandler(sensitive_handler)
+
+def replay_trace(trace, directory=REPLAY_DIR, max_failures=DNS_MAX_FAILURES, merge_window=INCIDENT_MERGE_WINDOW, verbose=False):
+    virtual_clock = VirtualClock(trace.start)
+    loop = SimulatedEventLoop(virtual_clock)
+    failovers = export_failovers.value
+    started = time.perf_counter()
+    with replay_environment(trace, virtual_clock, directory, merge_window, verbose) as backends:
+        try:
+            loop.run_until_complete(run_monitor(duration=trace.end - trace.start, watch_links=False, max_failures=max_failures, backends=backends, log_dir=directory, public_ip="N/A"))
+        finally:
+            loop.close()
+        elapsed = time.perf_counter() - started
+        simulated = virtual_clock.time() - trace.start
+        return {
+            "start": datetime.fromtimestamp(trace.start).strftime('%Y-%m-%d %H:%M:%S'),
+            "end": datetime.fromtimestamp(trace.end).strftime('%Y-%m-%d %H:%M:%S'),
+            "trace_samples": trace.samples(),
+            "simulated_s": round(simulated, 1),
+            "elapsed_s": round(elapsed, 3),
+            "speedup": round(simulated / elapsed, 1) if elapsed > 0 else None,
+            "dns_reevaluations": export_failovers.value - failovers,
+            "incidents": backends.incidents.stats(),
+            "rtt": backends.metrics.summary()["rtt"],
+            "incident_log": os.path.join(directory, INCIDENT_LOG_FILE)
+        }
+
+def run_replay(args):
+    if args.synthetic:
+        trace = synthetic_trace(args.synthetic * 86400, seed=args.seed)
+    elif len(args.paths) == 1 and args.paths[0].endswith((".json", ".jsonl")):
+        trace = load_trace_file(args.paths[0])
+    else:
+        trace = load_recorded_trace(args.paths, args.since, args.until)
+    if trace.start is None or trace.end <= trace.start:
+        print(f"{RED}No samples to replay in {', '.join(args.paths)}{RESET}")
+        return 1
+
+    results = replay_trace(trace, args.output, args.max_failures, args.merge_window, args.verbose)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    incidents = results["incidents"]
+    print(f"{CYAN}Replayed {results['start']} - {results['end']} ({results['trace_samples']} trace samples) in {results['elapsed_s']:.2f} s ({results['speedup']}x real time){RESET}")
+    print(f"{LIGHT_GRAY}DNS reevaluations: {results['dns_reevaluations']}, incidents: {incidents['incidents']} (minor {incidents['minor']}, major {incidents['major']}, outage {incidents['outage']}){RESET}")
+    mtbf = f"{incidents['mtbf_s']:.0f} s" if incidents["mtbf_s"] is not None else "N/A"
+    availability = f"{incidents['availability_pct']:.3f}%" if incidents["availability_pct"] is not None else "N/A"
+    print(f"{YELLOW}Downtime: {incidents['downtime_s']:.0f} s, MTBF: {mtbf}, availability: {availability}{RESET}")
+    print(f"{LIGHT_GRAY}Incident log: {results['incident_log']}, monitor log: {os.path.join(args.output, REPLAY_LOG_FILE)}{RESET}")
+    return 0
+
+def main(argv=None):
+    global DNS_QUERY_TRANSPORT, DNS_CACHE_BUSTING, METRICS_EXPORT_PORT, METRICS_SNAPSHOT_INTERVAL, UPLOAD_COLLECTOR_URL, UPLOAD_SENSITIVE
+    parser = argparse.ArgumentParser(prog="ntls", description="Network Test and Log System")
+    subparsers = parser.add_subparsers(dest="command")
+    monitor_parser = subparsers.add_parser("monitor", help="run the network monitor (default)")
+    monitor_parser.add_argument("--quality", choices=("basic", "loaded", "none"), default=QUALITY_TEST_MODE, help="initial quality test: idle ping and download, upload/download with loaded latency, or none to start monitoring right away")
+    monitor_parser.add_argument("--download-url", default=SPEEDTEST_DOWNLOAD_URL, help="download endpoint, '{bytes}' is replaced by the payload size")
+    monitor_parser.add_argument("--upload-url", default=SPEEDTEST_UPLOAD_URL, help="upload endpoint accepting POST bodies")
+    monitor_parser.add_argument("--multi-target", action="store_true", help="keep rolling stats for every resolver and web target and fail over from live data")
+    monitor_parser.add_argument("--targets-file", help="JSON list of targets ({name, kind: ping|tcp|http, address, role}) for --multi-target")
+    monitor_parser.add_argument("--dns-transport", choices=DNS_QUERY_TRANSPORTS, default=DNS_QUERY_TRANSPORT, help="transport used to time A/AAAA lookups against resolvers")
+    monitor_parser.add_argument("--cache-busting", action="store_true", help="query random subdomains so every lookup misses the resolver cache")
+    monitor_parser.add_argument("--collector", default=UPLOAD_COLLECTOR_URL, help=f"upload finished log segments to this HTTP collector through the {OUTBOX_DIR}/ outbox")
+    monitor_parser.add_argument("--upload-sensitive", action="store_true", help=f"also upload {SENSITIVE_LOG_DIR}/ (contains IP addresses)")
+    monitor_parser.add_argument("--metrics-port", type=int, default=METRICS_EXPORT_PORT, help=f"serve Prometheus metrics on {METRICS_EXPORT_HOST}:PORT/metrics")
+    monitor_parser.add_argument("--metrics-snapshot-interval", type=float, default=METRICS_SNAPSHOT_INTERVAL, help="append a JSON metrics snapshot to the metrics_snapshots_*.jsonl log segments every N seconds (0 disables)")
+
+    once_parser = subparsers.add_parser("once", help="take a single concurrent quality snapshot and exit")
+    once_parser.add_argument("--json", action="store_true", help="print the snapshot as JSON")
+    once_parser.add_argument("--samples", type=int, default=ONCE_SAMPLES, help="probes per resolver")
+    once_parser.add_argument("--timeout", type=float, default=ONCE_TIMEOUT, help="per-probe timeout in seconds")
+    once_parser.add_argument("--download", action="store_true", help="include a download throughput test")
+    once_parser.add_argument("--download-url", default=SPEEDTEST_DOWNLOAD_URL, help="download endpoint for --download")
+    once_parser.add_argument("--no-public-ip", action="store_true", help="skip the public IP lookup")
+
+    analyze_parser = subparsers.add_parser("analyze", help="summarize collected logs")
+    analyze_parser.add_argument("paths", nargs="*", default=[LOG_DIR], help="log files or directories")
+    analyze_parser.add_argument("--csv", help="write per-hour and per-network stats as CSV ('-' for stdout)")
+    analyze_parser.add_argument("--json", help="write the full report as JSON ('-' for stdout)")
+    analyze_parser.add_argument("--outage-min-failures", type=int, default=ANALYZE_OUTAGE_MIN_FAILURES)
+    analyze_parser.add_argument("--since", type=parse_time_bound, help="skip segments that ended before this time (YYYY-MM-DD[ HH:MM[:SS]], uses the segment index)")
+    analyze_parser.add_argument("--until", type=lambda value: parse_time_bound(value, end=True), help="skip segments that started after this time")
+
+    bench_parser = subparsers.add_parser("bench", help="microbenchmark the monitor's hot paths against a local fake network")
+    bench_parser.add_argument("--duration", type=float, default=BENCH_DURATION, help="seconds per benchmark")
+    bench_parser.add_argument("--only", nargs="+", metavar="NAME", help="run only the named benchmarks")
+    bench_parser.add_argument("--save", help="write the results as a JSON baseline")
+    bench_parser.add_argument("--baseline", help="compare against a saved JSON baseline and fail on regressions")
+
+    replay_parser = subparsers.add_parser("replay", help="replay recorded logs or a synthetic trace through the monitor on a simulated clock")
+    replay_parser.add_argument("paths", nargs="*", default=[LOG_DIR], help="log files or directories, or a JSON lines trace file")
+    replay_parser.add_argument("--synthetic", type=float, metavar="DAYS", help="replay a generated trace of this many days instead of logs")
+    replay_parser.add_argument("--seed", type=int, help="random seed for --synthetic")
+    replay_parser.add_argument("--since", type=parse_time_bound, help="replay samples from this time (YYYY-MM-DD[ HH:MM[:SS]])")
+    replay_parser.add_argument("--until", type=lambda value: parse_time_bound(value, end=True), help="replay samples before this time")
+    replay_parser.add_argument("--output", default=REPLAY_DIR, help="directory for the replay's monitor log and incident log")
+    replay_parser.add_argument("--max-failures", type=int, default=DNS_MAX_FAILURES, help="consecutive ping failures before the resolver is reselected")
+    replay_parser.add_argument("--merge-window", type=float, default=INCIDENT_MERGE_WINDOW, help="seconds a cleared incident stays open to absorb related signals")
+    replay_parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    replay_parser.add_argument("--verbose", action="store_true", help="show the monitor's console output while replaying")
+
+    args = parser.parse_args(argv)
+    if args.command == "analyze":
+        return analyze_logs(args)
+    if args.command == "bench":
+        return run_bench(args)
+    if args.command == "replay":
+        return run_replay(args)
+    if args.command == "once":
+        return run_once(args)
+    if args.command == "monitor":
+        DNS_QUERY_TRANSPORT = args.dns_transport
+        DNS_CACHE_BUSTING = DNS_CACHE_BUSTING or args.cache_busting
+        METRICS_EXPORT_PORT = args.metrics_port
+        METRICS_SNAPSHOT_INTERVAL = args.metrics_snapshot_interval
+        UPLOAD_COLLECTOR_URL = args.collector
+        UPLOAD_SENSITIVE = UPLOAD_SENSITIVE or args.upload_sensitive
+        targets = None
+        if args.multi_target or args.targets_file:
+            targets = load_monitor_targets(args.targets_file) if args.targets_file else default_monitor_targets()
+        monitor_network(args.quality, args.download_url, args.upload_url, targets, interactive=False)
+    else:
+        monitor_network()
+    return 0
+
+def shutdown():
     main_logger = logging.getLogger(main_logger_name)
     sensitive_logger = logging.getLogger(sensitive_logger_name)
-    if main_logger.hasHandlers():
+    monitored = main_logger.hasHandlers()
+    if monitored:
+         for name, summary in metrics.summary().items():
+             if summary["count"]:
+                 main_logger.info(f"Long-term {name}: " + ", ".join(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}" for key, value in summary.items()))
+         main_logger.info("Probe cache: " + ", ".join(f"{key}: {value}" for key, value in probe_cache.stats().items()))
          main_logger.info("--- MONITORING ENDED ---")
 
+    dns_engine.close()
+    if structured_log is not None:
+         structured_log.close()
+    for segments in (log_segments, sensitive_log_segments):
+        if segments is not None:
+            segments.close()
+
     if sensitive_logger.hasHandlers():
          sensitive_logger.info("--- SESSION END ---")
-    print(f"{CYAN}Monitoring finished.{RESET}")
+    if monitored:
+        print(f"{CYAN}Monitoring finished.{RESET}")
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+
+    except KeyboardInterrupt:
+        print(f"\n{RED}Monitoring stopped by user (outer block){RESET}")
+        logging.getLogger(main_logger_name).info("Monitoring stopped by user (outer block).")
+        logging.getLogger(sensitive_logger_name).info("--- SESSION END ---")
+
+    finally:
+        shutdown()
@@ -14,6 +14,10 @@ echo "Installing Python dependencies (pyfiglet and requests)"
 pip install pyfiglet requests
 echo "Installing Curl"
 pkg install curl > /dev/null 2>&1
+echo "Installing the ntls launcher"
+NTLS_HOME="$(pwd)"
+printf '#!/data/data/com.termux/files/usr/bin/sh\nexec python3 "%s/ntls.py" "$@"\n' "$NTLS_HOME" > "$PREFIX/bin/ntls"
+chmod +x "$PREFIX/bin/ntls"
 echo "Starting NAX-NTLS | v1.0.0"
 python3 ntls.py
 cd
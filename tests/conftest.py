@@ -0,0 +1,45 @@
+import asyncio
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ntls
+
+
+@pytest.fixture
+def log_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(ntls, "LOG_DIR", str(tmp_path / "ntls_logs"))
+    monkeypatch.setattr(ntls, "SENSITIVE_LOG_DIR", str(tmp_path / "ntls_sensitive_logs"))
+    monkeypatch.setattr(ntls, "log_segments", None)
+    monkeypatch.setattr(ntls, "sensitive_log_segments", None)
+    monkeypatch.setattr(ntls, "structured_log", None)
+    yield tmp_path
+    for name in (ntls.main_logger_name, ntls.sensitive_logger_name):
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
+
+@pytest.fixture
+def monitor_run(log_dirs, monkeypatch):
+    def run(duration=4):
+        monkeypatch.setattr(ntls, "DNS_SERVERS", [{"name": "Local DNS", "ip": "127.0.0.1"}])
+        monkeypatch.setattr(ntls, "EMERGENCY_DNS", [])
+        monkeypatch.setattr(ntls, "DNS_RESOLUTION_WEIGHT", 0)
+        monkeypatch.setattr(ntls, "incident_engine", ntls.IncidentEngine())
+        with ntls.bench_environment():
+            ntls.setup_logger()
+            try:
+                asyncio.run(ntls.run_monitor(duration=duration, watch_links=False))
+            finally:
+                if ntls.structured_log is not None:
+                    ntls.structured_log.close()
+                ntls.log_segments.close()
+                ntls.sensitive_log_segments.close()
+        return log_dirs / "ntls_logs"
+    return run
@@ -0,0 +1,121 @@
+import json
+import os
+
+import ntls
+
+
+def analyze(paths):
+    analysis = ntls.LogAnalysis()
+    for path in ntls.find_log_files(paths):
+        analysis.add(path)
+    return analysis.results()
+
+
+def test_monitor_run_is_counted_once(monitor_run):
+    log_dir = monitor_run()
+    files = ntls.find_log_files([str(log_dir)])
+    assert [path for path in files if ".ntlsb" in path]
+    assert not [path for path in files if ".txt" in path]
+
+    text_pings = 0
+    for name in os.listdir(log_dir):
+        if name.startswith("network_logs_"):
+            text_pings += (log_dir / name).read_text().count("] Ping to ")
+    results = analyze([str(log_dir)])
+    samples = sum(group["samples"] for group in results["hours"].values())
+    assert text_pings > 0
+    assert samples == text_pings
+
+
+def test_text_segments_used_without_structured_log(monitor_run, monkeypatch):
+    monkeypatch.setattr(ntls, "STRUCTURED_LOG", False)
+    log_dir = monitor_run()
+    files = ntls.find_log_files([str(log_dir)])
+    assert files and all(".txt" in path for path in files)
+    results = analyze([str(log_dir)])
+    assert sum(group["samples"] for group in results["hours"].values()) > 0
+
+
+def test_json_to_stdout_is_parseable(monitor_run, capsys):
+    log_dir = monitor_run()
+    capsys.readouterr()
+    assert ntls.main(["analyze", str(log_dir), "--json", "-"]) == 0
+    captured = capsys.readouterr()
+    results = json.loads(captured.out)
+    assert results["files"] >= 1
+    assert "Analyzed" in captured.err
+
+
+def test_out_of_order_lines_keep_their_hour(tmp_path):
+    start = ntls.datetime(2024, 1, 1, 12, 58)
+    lines = []
+    for second in range(300):
+        moment = start + ntls.timedelta(seconds=second)
+        lines.append(f"[{moment.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}] Ping to 8.8.8.8: 20.0 ms")
+        if moment.strftime('%H:%M:%S') == "13:00:30":
+            lines.append("[2024-01-01 12:59:59.000] Battery: 80% (DISCHARGING)")
+    path = tmp_path / "network_logs_2024-01-01_12-58-00.txt"
+    path.write_text("\n".join(lines) + "\n")
+
+    results = analyze([str(path)])
+    assert {hour: group["samples"] for hour, group in results["hours"].items()} == {"2024-01-01 12": 120, "2024-01-01 13": 180}
+
+
+def test_block_segments_match_legacy_records(tmp_path):
+    start = int(ntls.datetime(2024, 1, 1, 12, 59).timestamp() * 1e9)
+    samples = []
+    for step in range(240):
+        context = ("Operator A", "LTE") if step < 150 else ("Operator B", "NR")
+        rtt = ntls.math.nan if 10 <= step % 40 < 14 or step in (95, 96, 97) else 20.0 + step % 7
+        samples.append((start + step * 500_000_000, "rtt", rtt, context))
+        if step % 60 == 0:
+            samples.append((start + step * 500_000_000 + 1, "download", 50.0 + step, context))
+
+    path = str(tmp_path / "network_metrics_2024-01-01_12-59-00.ntlsb")
+    log = ntls.StructuredLog(path, batch_size=16)
+    log.start()
+    legacy = bytearray(ntls.LEGACY_SEGMENT_MAGIC)
+    contexts = {}
+    for ts_ns, name, value, context in samples:
+        if context not in contexts:
+            contexts[context] = len(contexts) + 1
+            body = json.dumps({"operator": context[0], "network_type": context[1]}).encode("utf-8")
+            legacy += ntls.struct.pack("<HBH", 3 + len(body), ntls.RECORD_CONTEXT, contexts[context]) + body
+        log.set_context(*context)
+        log.record(name, value, ts_ns)
+        legacy += ntls.struct.pack("<HBqHHd", 1 + ntls.SAMPLE_BODY.size, ntls.RECORD_SAMPLE, ts_ns, ntls.METRIC_IDS[name], contexts[context], value)
+    log.close()
+    legacy_path = tmp_path / "network_metrics_2024-01-01_12-58-00.ntlsb"
+    legacy_path.write_bytes(bytes(legacy))
+
+    with open(path, "rb") as f:
+        assert f.read(len(ntls.SEGMENT_MAGIC)) == ntls.SEGMENT_MAGIC
+    for segment in (path, str(legacy_path)):
+        decoded = [(ts_ns, name, value, (context["operator"], context["network_type"])) for ts_ns, name, value, context in ntls.read_structured_log(segment)]
+        assert sorted(map(repr, decoded)) == sorted(map(repr, samples))
+
+    results, legacy_results = analyze([path]), analyze([str(legacy_path)])
+    assert results["hours"] == legacy_results["hours"]
+    assert results["networks"] == legacy_results["networks"]
+    assert results["outages"] == legacy_results["outages"]
+    assert results["hours"]["2024-01-01 12"]["samples"] == 120
+    assert results["hours"]["2024-01-01 12"]["downloads"] == 2
+    assert [outage["failures"] for outage in results["outages"]] == [4, 4, 4, 3, 4, 4, 4]
+    assert os.path.getsize(path) < len(legacy)
+
+
+def test_context_change_does_not_block_on_full_queue(tmp_path):
+    path = str(tmp_path / "network_metrics_2024-01-01_00-00-00.ntlsb")
+    log = ntls.StructuredLog(path, queue_size=2)
+    log.record("rtt", 10.0, 1)
+    log.record("rtt", 11.0, 2)
+    log.set_context("Operator A", "LTE")
+    assert log.dropped == 1
+
+    log.start()
+    while log.queue.qsize():
+        ntls.time.sleep(0.01)
+    log.record("rtt", 12.0, 3)
+    log.close()
+    contexts = [context.get("operator") for _, _, _, context in ntls.read_structured_log(path)]
+    assert contexts == ["Unknown", "Unknown", "Operator A"]
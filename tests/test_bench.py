@@ -0,0 +1,32 @@
+import json
+
+import ntls
+
+
+def test_compare_flags_only_regressions():
+    results = [
+        {"name": "ping_dns", "ops_per_s": 700.0},
+        {"name": "text_log", "ops_per_s": 1300.0},
+        {"name": "structured_log", "ops_per_s": 950.0},
+        {"name": "new_bench", "ops_per_s": 10.0}
+    ]
+    baseline = {"results": {"ping_dns": {"ops_per_s": 1000.0}, "text_log": {"ops_per_s": 1000.0}, "structured_log": {"ops_per_s": 1000.0}}}
+    assert ntls.compare_benchmarks(results, baseline, threshold=0.2) == ["ping_dns"]
+    assert [result.get("change") for result in results] == [-30.0, 30.0, -5.0, None]
+
+
+def test_bench_saves_and_compares_baselines(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    assert ntls.main(["bench", "--duration", "0.05", "--only", "structured_log", "battery_helper", "--save", str(baseline)]) == 0
+    with open(baseline) as f:
+        report = json.load(f)
+    assert set(report["results"]) == {"structured_log", "battery_helper"}
+    for result in report["results"].values():
+        assert result["ops"] >= ntls.BENCH_MIN_OPS
+        assert result["ops_per_s"] > 0 and result["p50_us"] <= result["p99_us"]
+
+    report["results"]["structured_log"]["ops_per_s"] *= 1000
+    with open(baseline, "w") as f:
+        json.dump(report, f)
+    assert ntls.main(["bench", "--duration", "0.05", "--only", "structured_log", "--baseline", str(baseline)]) == 1
+    assert "Regressions over" in capsys.readouterr().out
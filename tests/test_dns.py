@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+import ntls
+
+
+@pytest.fixture
+def dns_server():
+    servers, port = ntls.start_local_dns_server()
+    yield port
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def engine():
+    engine = ntls.DnsQueryEngine()
+    yield engine
+    engine.close()
+
+
+@pytest.mark.parametrize("transport", ["udp", "tcp"])
+def test_resolve_over_local_server(dns_server, engine, transport):
+    for _ in range(2):
+        latencies = engine.resolve("127.0.0.1", transport=transport, port=dns_server, timeout=1)
+        assert len(latencies) == len(ntls.DNS_QUERY_TYPES)
+        assert all(latency is not None and latency < 1000 for latency in latencies)
+    if transport == "tcp":
+        assert len(engine.tcp_sockets) == 1
+
+
+def test_resolve_over_doh(engine):
+    server, url = ntls.start_local_speedtest_server()
+    try:
+        latencies = engine.resolve(f"{url}/dns-query", transport="doh", timeout=2)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(latencies) == len(ntls.DNS_QUERY_TYPES)
+    assert None not in latencies
+
+
+@pytest.mark.parametrize("transport", ["udp", "tcp"])
+def test_slow_server_times_out(engine, transport):
+    servers, port = ntls.start_local_dns_server(delay=0.5)
+    try:
+        started = time.perf_counter()
+        latencies = engine.resolve("127.0.0.1", transport=transport, port=port, timeout=0.2)
+        elapsed = time.perf_counter() - started
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    assert latencies == [None] * len(ntls.DNS_QUERY_TYPES)
+    assert elapsed < 0.45
+
+
+class SlowProbes:
+    def probe(self, target, count=1, timeout=2, interval=0, method=None, port=None):
+        time.sleep(0.3)
+        return [10.0] * count
+
+    def resolve(self, server, timeout=None, **kwargs):
+        time.sleep(0.3)
+        return [20.0] * len(ntls.DNS_QUERY_TYPES)
+
+
+def test_ping_and_resolve_run_together(monkeypatch):
+    monkeypatch.setattr(ntls, "prober", SlowProbes())
+    monkeypatch.setattr(ntls, "dns_engine", SlowProbes())
+    started = time.perf_counter()
+    latencies, resolutions = ntls.probe_candidate({"name": "Test", "ip": "192.0.2.1"}, 3, 1)
+    assert time.perf_counter() - started < 0.5
+    assert latencies == [10.0] * 3
+    assert resolutions == [20.0] * len(ntls.DNS_QUERY_TYPES)
+
+
+class StubProbes:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def probe(self, target, count=1, timeout=2, interval=0, method=None, port=None):
+        delay, latency = self.replies[target]
+        time.sleep(delay)
+        if isinstance(latency, Exception):
+            raise latency
+        return [latency] * count
+
+    def resolve(self, server, timeout=None, **kwargs):
+        return [5.0] * len(ntls.DNS_QUERY_TYPES)
+
+
+def probe_stubbed(replies, **kwargs):
+    backends = ntls.system_backends()
+    backends.prober = backends.dns_engine = StubProbes(replies)
+    candidates = [{"name": ip, "ip": ip} for ip in replies]
+    started = time.perf_counter()
+    ranked = ntls.probe_dns_candidates(candidates, backends=backends, **kwargs)
+    return [server["ip"] for _, server, _ in ranked], time.perf_counter() - started
+
+
+def test_probe_returns_at_quorum():
+    replies = {"192.0.2.1": (0, 30.0), "192.0.2.2": (0, 10.0), "192.0.2.3": (0, 20.0), "192.0.2.4": (2, 1.0)}
+    ranked, elapsed = probe_stubbed(replies, quorum=3, timeout=2)
+    assert ranked == ["192.0.2.2", "192.0.2.3", "192.0.2.1"]
+    assert elapsed < 0.5
+
+
+def test_probe_is_bounded_by_timeout():
+    replies = {"192.0.2.1": (0, 30.0), "192.0.2.2": (3, 10.0), "192.0.2.3": (3, 20.0)}
+    ranked, elapsed = probe_stubbed(replies, quorum=3, timeout=0.2)
+    assert ranked == ["192.0.2.1"]
+    assert elapsed < 0.2 + 1.5
+
+
+def test_failed_candidates_are_not_ranked(monkeypatch):
+    monkeypatch.setattr(ntls, "DNS_RESOLUTION_WEIGHT", 0)
+    replies = {"192.0.2.1": (0, OSError("network unreachable")), "192.0.2.2": (0, None), "192.0.2.3": (0, 20.0)}
+    ranked, _ = probe_stubbed(replies, quorum=3, timeout=1)
+    assert ranked == ["192.0.2.3"]
@@ -0,0 +1,70 @@
+import socket
+import threading
+
+import pytest
+
+import ntls
+
+
+@pytest.fixture
+def closing_server():
+    """Answers one keep-alive request per connection, then closes it."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    connections = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                return
+            connections.append(conn)
+            request = b""
+            while b"\r\n\r\n" not in request:
+                data = conn.recv(4096)
+                if not data:
+                    break
+                request += data
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: keep-alive\r\n\r\n")
+            conn.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    ntls.http_pool.close()
+    yield f"http://127.0.0.1:{listener.getsockname()[1]}/"
+    listener.close()
+    ntls.http_pool.close()
+    assert len(connections) >= 1
+
+
+def test_dropped_idle_connection_is_not_reused(closing_server):
+    assert ntls.http_probe(closing_server) is not None
+    assert ntls.http_probe(closing_server) is not None
+
+
+def test_stale_connection_is_retried_once(closing_server, monkeypatch):
+    monkeypatch.setattr(ntls, "connection_dropped", lambda sock: False)
+    for _ in range(3):
+        assert ntls.http_probe(closing_server) is not None
+
+
+def test_download_retries_stale_connection(closing_server, monkeypatch):
+    monkeypatch.setattr(ntls, "connection_dropped", lambda sock: False)
+    for _ in range(3):
+        assert ntls.download_stream(closing_server, 2, bytearray(1024))["bytes"] == 0
+
+
+def test_http_targets_report_no_false_loss(closing_server):
+    monitor = ntls.MultiTargetMonitor([{"name": "Local web", "kind": "http", "address": closing_server, "role": "web"}])
+
+    async def ticks():
+        for _ in range(5):
+            await monitor.tick()
+
+    ntls.asyncio.run(ticks())
+    stats = monitor.monitors[0].stats.snapshot()
+    assert stats["samples"] == 5
+    assert stats["loss"] == 0
+    assert monitor.web_connectivity() is True
@@ -0,0 +1,52 @@
+import ntls
+
+
+class FakeTime:
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+def test_injected_clock():
+    now = FakeTime(1000.0)
+    engine = ntls.IncidentEngine(clock=now)
+    for _ in range(3):
+        engine.observe("ping", True)
+        now.t += 1
+    assert engine.current["start"] == 1000.0
+    for _ in range(3):
+        engine.observe("ping", False)
+        now.t += 1
+    assert engine.current["cleared_at"] == 1003.0
+
+    now.t += engine.merge_window
+    engine.tick()
+    assert engine.current is None
+    stats = engine.stats()
+    assert stats["incidents"] == 1
+    assert stats["incident_s"] == 3.0
+    assert stats["observed_s"] == now.t - 1000.0
+
+
+def test_incident_lines_keep_log_order(caplog):
+    caplog.set_level("INFO", logger=ntls.main_logger_name)
+    now = FakeTime(1000.0)
+    engine = ntls.IncidentEngine(clock=now)
+    logger = ntls.logging.getLogger(ntls.main_logger_name)
+    for bad in [True] * 4 + [False] * 4:
+        timestamp = ntls.datetime.fromtimestamp(now.t).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        logger.info(f"[{timestamp}] Ping to 127.0.0.1: {'Failed' if bad else '10.0 ms'}")
+        engine.observe("ping", bad)
+        now.t += 1
+    now.t += engine.merge_window
+    engine.tick()
+
+    messages = [record.getMessage() for record in caplog.records]
+    stamps = [message[1:message.index("]")] for message in messages]
+    assert stamps == sorted(stamps)
+    started = next(message for message in messages if "started" in message)
+    assert started.endswith(f"since {engine._stamp(1000.0)}")
+    ended = next(message for message in messages if "ended" in message)
+    assert ended.endswith(f"from {engine._stamp(1000.0)} to {engine._stamp(1004.0)}")
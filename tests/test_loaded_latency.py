@@ -0,0 +1,42 @@
+import pytest
+
+import ntls
+
+
+@pytest.fixture
+def speedtest():
+    server, url = ntls.start_local_speedtest_server()
+    ntls.http_pool.close()
+    with ntls.bench_environment() as (target, _):
+        yield target, url
+    ntls.http_pool.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_sampling_outlasts_a_short_transfer(speedtest):
+    target, url = speedtest
+    measure = lambda: ntls.measure_download_throughput(url + "/__down?bytes={bytes}", timeout=5, min_duration=0, max_bytes=ntls.SPEEDTEST_INITIAL_BYTES)
+    result, loaded = ntls.measure_under_load(target, measure, min_samples=8, interval=0.05, min_duration=0.3)
+    assert result["bytes"] == ntls.SPEEDTEST_INITIAL_BYTES
+    assert loaded["samples"] >= 8
+    assert result["latency_samples"] == loaded["samples"]
+    assert not loaded["rejected"]
+    assert loaded["p50"] is not None
+
+
+def test_too_few_samples_are_rejected(speedtest, monkeypatch):
+    target, url = speedtest
+    measure_under_load = ntls.measure_under_load
+    monkeypatch.setattr(ntls, "measure_under_load", lambda target, measure: measure_under_load(target, measure, min_samples=1000, grace=0.2))
+    monkeypatch.setattr(ntls, "measure_idle_latency", lambda target: ntls.LinkStats(window=3600).snapshot())
+    recorded = []
+    monkeypatch.setattr(ntls, "record_metric", lambda name, value: recorded.append(name))
+    monkeypatch.setattr(ntls, "measure_download_throughput", lambda *args, **kwargs: {"bytes": 1, "bytes_per_s": 1.0})
+    monkeypatch.setattr(ntls, "measure_upload_throughput", lambda *args, **kwargs: {"bytes": 1, "bytes_per_s": 1.0})
+
+    results = ntls.evaluate_loaded_quality(target, url, url)
+    for phase in ("download", "upload"):
+        assert results[phase]["latency"]["rejected"]
+        assert 0 < results[phase]["latency"]["samples"] < 1000
+    assert recorded == ["download", "upload"]
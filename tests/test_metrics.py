@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import ntls
+
+
+def test_ring_buffer_wraps():
+    ring = ntls.RingBuffer(4)
+    evicted = [ring.append(t, t * 10.0) for t in range(6)]
+    assert evicted[:4] == [None] * 4
+    assert evicted[4:] == [(0.0, 0.0), (1.0, 10.0)]
+    assert len(ring) == 4
+    assert list(ring) == [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0), (5.0, 50.0)]
+    assert ring.last() == (5.0, 50.0)
+    assert ring.tail(3) == [30.0, 40.0, 50.0]
+    assert ring.tail(10) == [20.0, 30.0, 40.0, 50.0]
+    assert ring.first_time() == 2.0
+
+
+def test_window_reads_only_recent_samples():
+    series = ntls.MetricSeries("rtt", capacity=8)
+    for value in range(100):
+        series.add(float(value), t=value)
+    assert len(series.recent) == 8
+
+    window = series.window(5)
+    assert window == {"samples": 5, "mean": 97.0, "p50": 97.0, "p90": pytest.approx(98.6)}
+    assert series.window()["samples"] == 8
+
+    summary = series.summary()
+    assert summary["count"] == 100
+    assert summary["mean"] == pytest.approx(49.5)
+    assert summary["min"] == 0.0 and summary["max"] == 99.0
+    assert summary["last"] == 99.0
+    assert summary["recent_samples"] == 8
+    assert summary["recent_mean"] == pytest.approx(95.5)
+
+
+def test_snapshot_includes_recent_window(tmp_path, monkeypatch):
+    store = ntls.MetricsStore(("rtt", "loss"))
+    monkeypatch.setattr(ntls, "metrics", store)
+    for value in (10.0, 20.0, 30.0):
+        store.add("rtt", value)
+    path = tmp_path / "snapshots.jsonl"
+    ntls.asyncio.run(ntls.write_metrics_snapshot(ntls.JsonLinesLog(str(path))))
+    snapshot = ntls.json.loads(path.read_text())
+    assert snapshot["recent"] == {"rtt": {"samples": 3, "mean": 20.0, "p50": 20.0, "p90": 28.0}}
+
+
+def test_json_logs_rotate_under_retention(tmp_path, monkeypatch):
+    segments = ntls.LogSegments(str(tmp_path))
+    segments.start()
+    log = ntls.SegmentedJsonLog(segments, "incidents", max_bytes=200)
+    for index in range(20):
+        log.write({"id": index, "signals": ["ping"], "notes": ["x" * 40]})
+    log.close()
+    monkeypatch.setattr(ntls, "LOG_RETENTION_BYTES", 400)
+    segments.jobs.put(("retention", None))
+    segments.close()
+
+    names = sorted(segments.index)
+    assert len(names) >= 2
+    assert all(ntls.LOG_SEGMENT_PATTERN.match(name).group(1) == "incidents" for name in names)
+    assert sum(entry["bytes"] for entry in segments.index.values()) <= 400
+    assert sorted(name for name in os.listdir(tmp_path) if name != ntls.LOG_INDEX_FILE) == names
+    assert ntls.find_log_files([str(tmp_path)]) == []
+
+    records = []
+    for name in sorted(names, key=ntls.segment_counter):
+        with ntls.gzip.open(tmp_path / name, "rt") if name.endswith(".gz") else open(tmp_path / name) as f:
+            records += [ntls.json.loads(line)["id"] for line in f]
+    assert records == list(range(20 - len(records), 20))
+
+
+def test_monitor_snapshots_are_log_segments(monitor_run, monkeypatch):
+    monkeypatch.setattr(ntls, "METRICS_SNAPSHOT_INTERVAL", 1)
+    log_dir = monitor_run()
+    index = ntls.load_segment_index(str(log_dir))
+    snapshots = [name for name in index if name.startswith("metrics_snapshots_")]
+    assert len(snapshots) == 1
+    assert index[snapshots[0]]["end"] is not None
+    assert not (log_dir / ntls.METRICS_SNAPSHOT_FILE).exists()
+    with open(log_dir / snapshots[0]) as f:
+        assert [ntls.json.loads(line)["recent"]["rtt"]["samples"] for line in f]
+    assert not [path for path in ntls.find_log_files([str(log_dir)]) if os.path.basename(path).startswith("metrics_snapshots_")]
@@ -0,0 +1,68 @@
+import asyncio
+import socket
+
+import pytest
+
+import ntls
+
+
+def netlink_message(message_type, payload=b"\x00" * 6):
+    return ntls.NETLINK_HEADER.pack(ntls.NETLINK_HEADER.size + len(payload), message_type, 0, 0, 0) + payload + b"\x00" * (-len(payload) % 4)
+
+
+@pytest.fixture
+def simulated():
+    virtual_clock = ntls.VirtualClock()
+    loop = ntls.SimulatedEventLoop(virtual_clock)
+    yield virtual_clock, loop
+    loop.close()
+
+
+@pytest.fixture
+def kernel(simulated):
+    virtual_clock, loop = simulated
+    changes = []
+    watcher = ntls.NetlinkWatcher(lambda events: changes.append((virtual_clock.monotonic(), events)), debounce=0.5)
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    ours.setblocking(False)
+    watcher.sock, watcher.loop = ours, loop
+    loop.add_reader(ours.fileno(), watcher._readable)
+    yield loop, theirs, changes
+    watcher.close()
+    theirs.close()
+
+
+def test_parse_skips_unknown_and_padding():
+    data = netlink_message(20) + netlink_message(3, b"\x01") + netlink_message(25, b"\x00" * 9)
+    assert ntls.parse_netlink_messages(data) == ["RTM_NEWADDR", "RTM_DELROUTE"]
+    assert ntls.parse_netlink_messages(ntls.NETLINK_HEADER.pack(4, 20, 0, 0, 0)) == []
+
+
+def test_bursts_are_debounced(kernel):
+    loop, theirs, changes = kernel
+
+    async def scenario():
+        theirs.send(netlink_message(20))
+        theirs.send(netlink_message(24))
+        loop.call_later(0.2, theirs.send, netlink_message(21))
+        loop.call_later(0.3, theirs.send, netlink_message(20))
+        await asyncio.sleep(2)
+        theirs.send(netlink_message(16))
+        await asyncio.sleep(2)
+
+    loop.run_until_complete(scenario())
+    assert [events for _, events in changes] == [["RTM_DELADDR", "RTM_NEWADDR", "RTM_NEWROUTE"], ["RTM_NEWLINK"]]
+    assert [t for t, _ in changes] == pytest.approx([0.5, 2.5], abs=0.01)
+
+
+def test_falls_back_to_polling_without_netlink(monkeypatch, simulated):
+    _, loop = simulated
+
+    def unsupported(*args):
+        raise OSError("Address family not supported by protocol")
+
+    watcher = ntls.NetlinkWatcher(lambda events: None)
+    monkeypatch.setattr(ntls.socket, "socket", unsupported)
+    assert watcher.start(loop) is False
+    assert watcher.sock is None
+    watcher.close()
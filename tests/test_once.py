@@ -0,0 +1,38 @@
+import json
+
+import ntls
+
+
+def test_once_json_snapshot(monkeypatch, capsys):
+    server, url = ntls.start_local_speedtest_server()
+    monkeypatch.setattr(ntls, "DNS_SERVERS", [{"name": "Local DNS", "ip": "127.0.0.1"}, {"name": "Broken", "ip": "192.0.2.1"}])
+    monkeypatch.setattr(ntls, "DNS_RESOLUTION_WEIGHT", 0)
+    monkeypatch.setattr(ntls, "WEB_TARGETS", [{"name": "Local", "address": f"{url}/"}])
+    probe_candidate = ntls.probe_candidate
+
+    def failing(server, samples, timeout, backends=None):
+        if server["ip"] == "192.0.2.1":
+            raise OSError("probe crashed")
+        return probe_candidate(server, samples, timeout, backends)
+
+    monkeypatch.setattr(ntls, "probe_candidate", failing)
+    try:
+        with ntls.bench_environment():
+            status = ntls.main(["once", "--json", "--no-public-ip", "--samples", "2", "--timeout", "0.5"])
+    finally:
+        server.shutdown()
+        server.server_close()
+        ntls.http_pool.close()
+
+    snapshot = json.loads(capsys.readouterr().out)
+    assert status == 0
+    assert set(snapshot) == {"time", "best_dns", "resolvers", "web", "local_ips", "public_ip", "battery", "network", "elapsed_s"}
+    assert snapshot["best_dns"] == "127.0.0.1"
+    local, broken = snapshot["resolvers"]
+    assert local["rtt"]["received"] == 2 and local["score"] is not None
+    assert broken["score"] is None
+    assert broken["rtt"] == {"sent": 2, "received": 0, "loss_pct": 100.0, "p50_ms": None, "p90_ms": None, "max_ms": None}
+    assert snapshot["web"][0]["latency_ms"] is not None
+    assert snapshot["public_ip"] == "N/A"
+    assert snapshot["battery"] == {"percentage": 64, "status": "DISCHARGING"}
+    assert snapshot["network"] == {"operator": "Bench", "network_type": "LTE", "data_enabled": "true"}
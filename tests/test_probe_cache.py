@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import ntls
+
+
+@pytest.fixture
+def virtual_clock():
+    return ntls.VirtualClock()
+
+
+def test_concurrent_callers_share_one_helper_run(virtual_clock):
+    cache = ntls.ProbeCache(clock=virtual_clock)
+    calls = []
+
+    async def helper():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        first = asyncio.create_task(cache.aget("battery", 60, helper))
+        await asyncio.sleep(0)
+        joined = [cache.aget("battery", 0, helper) for _ in range(3)]
+        return await asyncio.gather(first, *joined)
+
+    assert asyncio.run(main()) == [1, 1, 1, 1]
+    assert calls == [1]
+    assert cache.stats() == {"hits": 0, "misses": 1, "coalesced": 3, "negative_hits": 0, "entries": 1}
+
+
+def test_threads_share_one_probe(virtual_clock):
+    cache = ntls.ProbeCache(clock=virtual_clock)
+    release = threading.Event()
+    calls = []
+
+    def probe():
+        calls.append(1)
+        release.wait(5)
+        return 12.5
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(("ping", "192.0.2.1"), 1, probe))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while cache.coalesced < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [12.5] * 4
+    assert calls == [1]
+
+
+def test_results_expire_by_max_age(virtual_clock):
+    cache = ntls.ProbeCache(clock=virtual_clock)
+    values = iter([1, 2, 3])
+    assert cache.get("key", 10, lambda: next(values)) == 1
+    virtual_clock.advance(5)
+    assert cache.get("key", 10, lambda: next(values)) == 1
+    assert cache.get("key", 0, lambda: next(values)) == 2
+    virtual_clock.advance(11)
+    assert cache.get("key", 10, lambda: next(values)) == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_missing_command_is_cached_negatively(virtual_clock):
+    cache = ntls.ProbeCache(negative_ttl=3600, clock=virtual_clock)
+    calls = []
+
+    def missing():
+        calls.append(1)
+        raise FileNotFoundError("termux-battery-status")
+
+    for _ in range(3):
+        with pytest.raises(FileNotFoundError):
+            cache.get("battery", 0, missing)
+    assert calls == [1]
+    assert cache.is_negative("battery")
+    assert cache.negative_hits == 2
+
+    virtual_clock.advance(3601)
+    assert not cache.is_negative("battery")
+    assert cache.get("battery", 0, lambda: "installed") == "installed"
+
+
+def test_other_errors_are_not_cached(virtual_clock):
+    cache = ntls.ProbeCache(clock=virtual_clock)
+
+    def timeout():
+        raise asyncio.TimeoutError()
+
+    with pytest.raises(asyncio.TimeoutError):
+        cache.get("telephony", 60, timeout)
+    assert not cache.is_negative("telephony")
+    assert cache.get("telephony", 60, lambda: "{}") == "{}"
+
+
+def test_joined_callers_see_the_error():
+    cache = ntls.ProbeCache()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise OSError("helper crashed")
+
+    async def main():
+        return await asyncio.gather(cache.aget("key", 60, failing), cache.aget("key", 0, failing), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(result) for result in results] == [OSError, OSError]
+    assert cache.coalesced == 1 and not cache.entries
@@ -0,0 +1,21 @@
+import socket
+
+import ntls
+
+
+def closed_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_refused_udp_probe_counts_as_reply():
+    prober = ntls.Prober(methods=("udp",))
+    try:
+        results = prober.probe("127.0.0.1", count=3, timeout=1, interval=0.01, port=closed_udp_port())
+    finally:
+        prober.close()
+    assert None not in results
+    assert all(0 <= rtt < 1000 for rtt in results)
@@ -0,0 +1,77 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ntls
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    routes = {
+        "/fast": (0, "198.51.100.2"),
+        "/json": (0, '{"ip": "198.51.100.3"}'),
+        "/slow": (1.0, "198.51.100.1"),
+        "/garbage": (0, "<html>rate limited</html>")
+    }
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path not in self.routes:
+            self.send_error(503)
+            return
+        delay, body = self.routes[self.path]
+        time.sleep(delay)
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def providers():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ProviderHandler)
+    server.daemon_threads = True
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_first_valid_answer_wins(providers):
+    _, url = providers
+    service = ntls.PublicIPService([(f"{url}/slow", "text"), (f"{url}/garbage", "text"), (f"{url}/down", "text"), (f"{url}/fast", "text")], timeout=2)
+    started = time.perf_counter()
+    assert service.lookup() == "198.51.100.2"
+    assert time.perf_counter() - started < 0.5
+
+
+def test_json_provider_and_all_failing(providers):
+    _, url = providers
+    assert ntls.PublicIPService([(f"{url}/down", "text"), (f"{url}/json", "json")], timeout=2).lookup() == "198.51.100.3"
+    assert ntls.PublicIPService([(f"{url}/down", "text"), (f"{url}/garbage", "text")], timeout=2).lookup() == "N/A"
+
+
+def test_cached_until_ttl_or_invalidated(providers):
+    server, url = providers
+    virtual_clock = ntls.VirtualClock()
+    service = ntls.PublicIPService([(f"{url}/fast", "text")], ttl=30, timeout=2, clock=virtual_clock)
+
+    assert service.lookup() == "198.51.100.2"
+    virtual_clock.advance(29)
+    assert service.lookup() == "198.51.100.2"
+    assert len(server.requests) == 1
+
+    virtual_clock.advance(2)
+    service.lookup()
+    assert len(server.requests) == 2
+
+    service.invalidate()
+    service.lookup()
+    service.lookup(max_age=0)
+    assert len(server.requests) == 4
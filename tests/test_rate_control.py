@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+import ntls
+
+
+async def idle():
+    pass
+
+
+@pytest.fixture
+def controller(caplog):
+    caplog.set_level("INFO", logger=ntls.main_logger_name)
+    virtual_clock = ntls.VirtualClock()
+    backends = ntls.system_backends()
+    backends.clock = virtual_clock
+    backends.incidents = ntls.IncidentEngine(clock=virtual_clock.time)
+    scheduler = ntls.Scheduler()
+    scheduler.add("dns_latency", idle, ntls.PING_INTERVAL)
+    scheduler.add("summary", idle, ntls.SUMMARY_INTERVAL)
+    scheduler.add("public_ip", idle, ntls.PUBLIC_IP_CHECK_INTERVAL)
+    scheduler.add("battery", idle, ntls.BATTERY_INTERVAL)
+    return ntls.RateController(scheduler, backends=backends), virtual_clock
+
+
+def intervals(controller):
+    return {name: task.interval for name, task in controller.scheduler.tasks.items()}
+
+
+def test_battery_slows_sampling_within_limits(controller):
+    controller, _ = controller
+    controller.note_battery(25, "DISCHARGING")
+    assert intervals(controller) == {"dns_latency": 2, "summary": 10, "public_ip": 120, "battery": 120}
+    controller.note_battery(10, "DISCHARGING")
+    assert intervals(controller) == {"dns_latency": 4, "summary": 20, "public_ip": 240, "battery": 240}
+    controller.note_battery(10, "CHARGING")
+    assert intervals(controller) == {"dns_latency": 1, "summary": 5, "public_ip": 60, "battery": 60}
+
+
+def test_incident_samples_densely_then_backs_off(controller, caplog):
+    controller, virtual_clock = controller
+    controller.note_incident("ping incident")
+    assert controller.mode == "incident"
+    assert intervals(controller) == {"dns_latency": 0.5, "summary": 5, "public_ip": 30, "battery": 30}
+    assert any(message.endswith("Rate: dns_latency 1 s -> 0.5 s (incident, ping incident)") for message in caplog.messages)
+
+    virtual_clock.advance(ntls.RATE_INCIDENT_HOLD + 1)
+    asyncio.run(controller.tick())
+    assert controller.mode == "normal"
+    assert intervals(controller)["dns_latency"] == 1
+
+    virtual_clock.advance(ntls.RATE_STEADY_AFTER)
+    asyncio.run(controller.tick())
+    assert controller.mode == "steady"
+    assert intervals(controller) == {"dns_latency": 2, "summary": 10, "public_ip": 120, "battery": 120}
+    assert caplog.messages[-1].endswith("(steady, mode change)")
+
+
+def test_open_incident_holds_dense_sampling(controller):
+    controller, virtual_clock = controller
+    controller.backends.incidents.current = object()
+    virtual_clock.advance(ntls.RATE_STEADY_AFTER * 2)
+    asyncio.run(controller.tick())
+    assert controller.mode == "incident"
+    assert intervals(controller)["dns_latency"] == 0.5
@@ -0,0 +1,54 @@
+import pytest
+
+import ntls
+
+
+def segments(log_dir, prefix):
+    return [str(path) for path in sorted(log_dir.iterdir()) if path.name.startswith(prefix)]
+
+
+def test_text_log_matches_structured_log(monitor_run):
+    log_dir = monitor_run()
+    text = ntls.load_recorded_trace(segments(log_dir, "network_logs_"))
+    structured = ntls.load_recorded_trace(segments(log_dir, "network_metrics_"))
+    assert len(text.times["rtt"]) > 0
+    assert list(text.values["rtt"]) == pytest.approx(list(structured.values["rtt"]), abs=1e-3, nan_ok=True)
+    assert list(text.times["rtt"]) == pytest.approx(list(structured.times["rtt"]), abs=0.01)
+    assert text.values["network_type"] == structured.values["network_type"]
+
+
+def test_replay_text_logs(monitor_run, monkeypatch, tmp_path):
+    monkeypatch.setattr(ntls, "STRUCTURED_LOG", False)
+    log_dir = monitor_run()
+    trace = ntls.load_recorded_trace([str(log_dir)])
+    pings = 0
+    for path in segments(log_dir, "network_logs_"):
+        with open(path) as f:
+            pings += f.read().count("] Ping to ")
+    assert len(trace.times["rtt"]) == pings > 0
+
+    results = ntls.replay_trace(trace, str(tmp_path / "ntls_replay"))
+    assert results["trace_samples"] == trace.samples()
+
+
+def test_replay_uses_trace_backends(monkeypatch, tmp_path):
+    def unavailable(*args, **kwargs):
+        raise AssertionError("replay reached the host")
+
+    for name in ("get_link_state", "get_local_ip_addresses", "run_command_async"):
+        monkeypatch.setattr(ntls, name, unavailable)
+    monkeypatch.setattr(ntls.prober, "probe", unavailable)
+    clock, metrics = ntls.clock, ntls.metrics
+
+    trace = ntls.Trace()
+    start = ntls.REPLAY_SYNTHETIC_START
+    trace.add(start, "local_ip", ntls.REPLAY_LOCAL_IP)
+    trace.add(start + 30, "local_ip", "10.0.1.2")
+    for step in range(120):
+        trace.add(start + step, "rtt", 40.0)
+    results = ntls.replay_trace(trace.finish(), str(tmp_path))
+
+    assert ntls.clock is clock and ntls.metrics is metrics
+    assert results["rtt"]["count"] > 0
+    with open(tmp_path / ntls.REPLAY_LOG_FILE) as f:
+        assert f"Local IP changed: {ntls.REPLAY_LOCAL_IP} -> 10.0.1.2" in f.read()
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+import ntls
+
+
+@pytest.fixture
+def simulated():
+    virtual_clock = ntls.VirtualClock()
+    loop = ntls.SimulatedEventLoop(virtual_clock)
+    yield virtual_clock, loop
+    loop.close()
+
+
+def run_for(loop, scheduler, duration):
+    async def stop():
+        scheduler.stop()
+        return False
+
+    async def main():
+        scheduler.add("stop", stop, duration, initial_delay=duration)
+        try:
+            await scheduler.run()
+        finally:
+            await scheduler.shutdown()
+
+    loop.run_until_complete(main())
+
+
+@pytest.mark.parametrize("window, b_offset", [(0.05, 0.0), (0.0, 0.03)])
+def test_due_tasks_coalesce_within_window(simulated, window, b_offset):
+    virtual_clock, loop = simulated
+    scheduler = ntls.Scheduler(coalesce_window=window)
+    runs = []
+
+    def recorder(name):
+        async def run():
+            runs.append((name, virtual_clock.monotonic()))
+        return run
+
+    scheduler.add("a", recorder("a"), 1.0)
+    scheduler.add("b", recorder("b"), 1.0, initial_delay=0.03)
+    scheduler.add("c", recorder("c"), 1.0, initial_delay=0.5)
+    run_for(loop, scheduler, 2.9)
+
+    times = {name: [t for task, t in runs if task == name] for name in "abc"}
+    assert times["a"] == pytest.approx([0.0, 1.0, 2.0])
+    assert times["b"] == pytest.approx([b_offset, 1.0 + b_offset, 2.0 + b_offset])
+    assert times["c"] == pytest.approx([0.5, 1.5, 2.5])
+
+
+def test_shutdown_cancels_running_tasks(simulated):
+    _, loop = simulated
+    scheduler = ntls.Scheduler()
+    cancelled = []
+
+    async def hang():
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    scheduler.add("hang", hang, 1.0, deadline=7200)
+    run_for(loop, scheduler, 5.0)
+    assert cancelled == [True]
+    assert scheduler.tasks["hang"].running is None
+    assert scheduler.tasks["hang"].runs == 1
+
+
+def test_deadline_and_stop(simulated):
+    _, loop = simulated
+    scheduler = ntls.Scheduler()
+    timeouts = ntls.export_task_timeouts.value
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def once():
+        return False
+
+    scheduler.add("slow", slow, 1.0, deadline=2.0)
+    scheduler.add("once", once, 1.0)
+    run_for(loop, scheduler, 6.5)
+    assert scheduler.tasks["slow"].timeouts == 3
+    assert ntls.export_task_timeouts.value - timeouts == 3
+    assert scheduler.tasks["once"].runs == 1 and scheduler.tasks["once"].stopped
+
+
+def test_lag_is_measured_from_due_time(simulated):
+    virtual_clock, loop = simulated
+    scheduler = ntls.Scheduler()
+    started = []
+
+    async def blocking():
+        virtual_clock.advance(0.4)
+
+    async def punctual():
+        started.append(virtual_clock.monotonic())
+
+    scheduler.add("blocking", blocking, 1.0)
+    scheduler.add("punctual", punctual, 1.0, initial_delay=0.1)
+    run_for(loop, scheduler, 0.9)
+    assert started == pytest.approx([0.4])
+    assert scheduler.tasks["punctual"].lag == pytest.approx(0.3)
+    assert scheduler.tasks["blocking"].lag == 0.0
@@ -0,0 +1,133 @@
+import os
+
+import pytest
+
+import ntls
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    """A finished log segment in a source directory and an uploader outbox."""
+    monkeypatch.setattr(ntls, "UPLOAD_MIN_AGE", 0)
+    monkeypatch.setattr(ntls, "UPLOAD_CHUNK_SIZE", 4096)
+    source = tmp_path / "ntls_logs"
+    source.mkdir()
+    with open(source / "network_logs_2026-01-01_00-00-00.txt", "w") as f:
+        f.write(os.urandom(20000).hex())
+    ntls.http_pool.close()
+    yield tmp_path, [str(source)]
+    ntls.http_pool.close()
+
+
+@pytest.fixture
+def collector(tmp_path):
+    server, url = ntls.start_local_collector(str(tmp_path / "collector"))
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+
+def staged_item(uploader):
+    [(name, entry)] = uploader.state["items"].items()
+    with open(os.path.join(uploader.directory, name), "rb") as f:
+        return name, entry, f.read()
+
+
+def test_resume_after_partial_chunk(outbox, collector, monkeypatch):
+    tmp_path, sources = outbox
+    server, url = collector
+    uploader = ntls.Uploader(url, str(tmp_path / "ntls_outbox"), sources)
+    assert uploader.stage() == 1
+    name, entry, data = staged_item(uploader)
+    assert len(data) > 3 * ntls.UPLOAD_CHUNK_SIZE
+
+    offsets = []
+    drops = [2]
+    request = uploader._request
+
+    def interrupted(method, url, body=None, headers=None):
+        if method == "POST":
+            offsets.append(int(headers["X-NTLS-Offset"]))
+            if len(offsets) in drops:
+                drops.clear()
+                raise ConnectionResetError("connection dropped mid-chunk")
+        return request(method, url, body, headers)
+
+    monkeypatch.setattr(uploader, "_request", interrupted)
+    assert uploader.flush()[:2] == (0, 1)
+
+    # The collector kept only part of the second chunk before the link dropped.
+    partial = os.path.join(server.directory, entry["id"] + ".part")
+    assert os.path.getsize(partial) == ntls.UPLOAD_CHUNK_SIZE
+    with open(partial, "ab") as f:
+        f.write(data[ntls.UPLOAD_CHUNK_SIZE:ntls.UPLOAD_CHUNK_SIZE + 100])
+
+    offsets.clear()
+    entry["next_attempt"] = 0
+    assert uploader.flush()[:2] == (1, 0)
+    assert offsets[0] == ntls.UPLOAD_CHUNK_SIZE + 100
+    assert not uploader.state["items"]
+    with open(os.path.join(server.directory, f"{entry['id']}-{name}"), "rb") as f:
+        assert f.read() == data
+    assert server.completed == 1
+
+
+def test_outbox_survives_restart(outbox, collector):
+    tmp_path, sources = outbox
+    server, url = collector
+    directory = str(tmp_path / "ntls_outbox")
+    uploader = ntls.Uploader(url, directory, sources)
+    assert uploader.stage() == 1
+    name, entry, data = staged_item(uploader)
+
+    restarted = ntls.Uploader(url, directory, sources)
+    assert restarted.state["items"] == {name: entry}
+    assert restarted.stage() == 0
+    assert restarted.flush()[:2] == (1, 0)
+
+    again = ntls.Uploader(url, directory, sources)
+    assert not again.state["items"]
+    assert again.stage() == 0
+    with open(os.path.join(server.directory, f"{entry['id']}-{name}"), "rb") as f:
+        assert f.read() == data
+
+
+def test_backoff_until_collector_returns(outbox, tmp_path):
+    _, sources = outbox
+    server, url = ntls.start_local_collector(str(tmp_path / "collector"))
+    port = server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+    uploader = ntls.Uploader(url, str(tmp_path / "ntls_outbox"), sources, timeout=2)
+    uploader.stage()
+    name, entry, data = staged_item(uploader)
+
+    sent, failed, backoff = uploader.flush()
+    assert (sent, failed) == (0, 1)
+    assert entry["attempts"] == 1
+    assert 0.8 * ntls.UPLOAD_BACKOFF_BASE <= backoff <= 1.2 * ntls.UPLOAD_BACKOFF_BASE
+    assert ntls.Uploader(url, uploader.directory, sources).state["items"][name] == entry
+
+    # Still backing off: nothing is attempted.
+    sent, failed, backoff = uploader.flush()
+    assert (sent, failed) == (0, 0)
+    assert 0 < backoff <= 1.2 * ntls.UPLOAD_BACKOFF_BASE
+    assert entry["attempts"] == 1
+
+    entry["next_attempt"] = 0
+    sent, failed, backoff = uploader.flush()
+    assert (sent, failed) == (0, 1)
+    assert entry["attempts"] == 2
+    assert 1.6 * ntls.UPLOAD_BACKOFF_BASE <= backoff <= 2.4 * ntls.UPLOAD_BACKOFF_BASE
+
+    server, _ = ntls.start_local_collector(str(tmp_path / "collector"), port=port)
+    try:
+        entry["next_attempt"] = 0
+        assert uploader.flush() == (1, 0, None)
+        assert ntls.Uploader(url, uploader.directory, sources).state["items"] == {}
+        with open(os.path.join(server.directory, f"{entry['id']}-{name}"), "rb") as f:
+            assert f.read() == data
+    finally:
+        server.shutdown()
+        server.server_close()